@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of contact extraction in circular_ribbon_contact_map.py
+
+Times the cell-list contact search (residue_contacts) against a plain
+residue x residue x atom x atom loop on every chain pair of a structure, checks
+that both return the same contacts, minimum distances, atom contact counts and
+closest atoms, and writes the timings as JSON.
+Structure parsing and AtomTable construction are timed separately and not
+included in the contact timings.
+
+Usage examples:
+  # Default: all chain pairs of VLPIM_Web_services/6htx.pdb at 5 A
+  python benchmark_contact_map.py --output bench_contacts.json
+
+  # Several cutoffs on another structure, without the slow reference loop
+  python benchmark_contact_map.py --structure capsid.cif --cutoffs 4 5 8 --skip-reference
+
+Author: [Chufan Wang]
+Version: 1.0
+Date: 2025
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from itertools import combinations
+from typing import Dict, List
+
+import numpy as np
+from Bio.PDB import is_aa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import circular_ribbon_contact_map as crcm  # noqa: E402
+
+DEFAULT_STRUCTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'VLPIM_Web_services', '6htx.pdb'
+)
+
+
+def _loop_contacts(residues1, residues2, chain1, chain2, cutoff):
+    """Residue x residue x atom x atom reference loop (minimum distance, atom contact count, closest atoms)."""
+    contacts = []
+    contacts_detail = []
+    for res1 in residues1:
+        for res2 in residues2:
+            closest = None
+            n_atoms = 0
+            for atom1 in res1:
+                for atom2 in res2:
+                    if atom1.element != 'H' and atom2.element != 'H':
+                        dist = atom1 - atom2
+                        if dist <= cutoff:
+                            n_atoms += 1
+                            if closest is None or dist < closest[0]:
+                                closest = (dist, atom1.get_name(), atom2.get_name())
+            if closest is not None:
+                contacts.append((crcm.residue_label(chain1, res1), crcm.residue_label(chain2, res2)))
+                contacts_detail.append({
+                    'chain1': chain1,
+                    'res1_num': res1.id[1],
+                    'res1_name': res1.get_resname(),
+                    'chain2': chain2,
+                    'res2_num': res2.id[1],
+                    'res2_name': res2.get_resname(),
+                    'distance': round(closest[0], 3),
+                    'atom_contacts': n_atoms,
+                    'atom1': closest[1],
+                    'atom2': closest[2]
+                })
+    return contacts, contacts_detail
+
+
+def _chain_residues(structure) -> Dict[str, List]:
+    """Standard amino-acid residues per chain ID, over all models."""
+    residues = {}
+    for model in structure:
+        for chain in model:
+            residues.setdefault(chain.id, []).extend(
+                res for res in chain if is_aa(res, standard=True) and res.id[0] == ' '
+            )
+    return residues
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cell-list contact extraction against nested loops",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--structure', type=str, default=DEFAULT_STRUCTURE,
+                        help='mmCIF or PDB file (default: VLPIM_Web_services/6htx.pdb)')
+    parser.add_argument('--cutoffs', type=float, nargs='+', default=[5.0],
+                        help='Contact distance cutoffs in A (default: 5.0)')
+    parser.add_argument('--skip-reference', action='store_true',
+                        help='Do not run (or compare against) the nested-loop reference')
+    parser.add_argument('--output', type=str, default='benchmark_contact_map.json',
+                        help='Output JSON file (default: benchmark_contact_map.json)')
+    args = parser.parse_args()
+
+    structure, parse_seconds = _timed(crcm.load_structure, args.structure)
+    table, table_seconds = _timed(crcm.AtomTable.from_structure, structure)
+    residues = _chain_residues(structure)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'structure': os.path.basename(args.structure),
+            'chains': {chain: len(res) for chain, res in residues.items()},
+            'parse_seconds': round(parse_seconds, 4),
+            'atom_table_seconds': round(table_seconds, 4)
+        },
+        'results': []
+    }
+    print(f"Parsed {args.structure} in {parse_seconds:.3f}s (atom table {table_seconds:.3f}s): "
+          + ', '.join(f"{chain} ({len(res)} residues)" for chain, res in residues.items()))
+
+    for cutoff in args.cutoffs:
+        for chain1, chain2 in combinations(residues, 2):
+            (contacts, detail), grid_seconds = _timed(
+                crcm.residue_contacts, table, table.chain_residues(chain1), table.chain_residues(chain2),
+                chain1, chain2, cutoff)
+            result = {
+                'chain1': chain1,
+                'chain2': chain2,
+                'cutoff': cutoff,
+                'contacts': len(contacts),
+                'cell_list_seconds': round(grid_seconds, 4)
+            }
+            line = f"[{chain1}-{chain2} @ {cutoff} A] {len(contacts)} contacts, cell list {grid_seconds:.4f}s"
+            if not args.skip_reference:
+                (ref_contacts, ref_detail), loop_seconds = _timed(
+                    _loop_contacts, residues[chain1], residues[chain2], chain1, chain2, cutoff)
+                identical = contacts == ref_contacts and [
+                    {**row, 'distance': str(row['distance'])} for row in detail
+                ] == [{**row, 'distance': str(row['distance'])} for row in ref_detail]
+                result.update({
+                    'loop_seconds': round(loop_seconds, 4),
+                    'speedup': round(loop_seconds / max(grid_seconds, 1e-9), 1),
+                    'identical': identical
+                })
+                line += f", loop {loop_seconds:.3f}s ({result['speedup']}x), identical: {identical}"
+            report['results'].append(result)
+            print(line)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
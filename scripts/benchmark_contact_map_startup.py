@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cold-start benchmark of circular_ribbon_contact_map.py
+
+Runs each case in a fresh Python process and reports the best-of-repeats wall
+time as JSON. The import cases compare importing the module alone (what
+--extract-only pays) against importing it and loading the plotting libraries.
+The second case costs the same as the module-level holoviews/bokeh/matplotlib
+imports did before. The CLI cases run the two-chain extraction on a structure
+with --extract-only and with an HTML plot. The report also lists which plotting
+packages ended up imported in each case.
+
+Usage examples:
+  # Default: VLPIM_Web_services/6htx.pdb, chains A and B, 5 repeats
+  python benchmark_contact_map_startup.py --output bench_startup.json
+
+  # Another structure, import cases only
+  python benchmark_contact_map_startup.py --structure complex.cif --chain1 H --chain2 L --skip-cli
+
+Author: [Chufan Wang]
+Version: 1.0
+Date: 2025
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(SCRIPT_DIR, 'circular_ribbon_contact_map.py')
+DEFAULT_STRUCTURE = os.path.join(os.path.dirname(SCRIPT_DIR), 'VLPIM_Web_services', '6htx.pdb')
+PLOTTING_PACKAGES = ['holoviews', 'bokeh', 'matplotlib']
+
+# Prints the plotting packages present in sys.modules after the statement ran
+_IMPORT_PROBE = (
+    "import sys; sys.path.insert(0, {script_dir!r}); {statement}; "
+    "print(','.join(p for p in {packages!r} if p in sys.modules))"
+)
+
+
+def _run(command: List[str], cwd: str, repeats: int) -> Dict:
+    """Best-of-repeats wall time of a command in a fresh process."""
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        completed = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+        seconds.append(time.perf_counter() - started)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed:\n{completed.stderr}")
+    return {'seconds': round(min(seconds), 4), 'stdout': completed.stdout}
+
+
+def import_case(name: str, statement: str, repeats: int) -> Dict:
+    probe = _IMPORT_PROBE.format(script_dir=SCRIPT_DIR, statement=statement, packages=PLOTTING_PACKAGES)
+    run = _run([sys.executable, '-c', probe], SCRIPT_DIR, repeats)
+    loaded = run['stdout'].strip().splitlines()[-1] if run['stdout'].strip() else ''
+    return {'case': name, 'seconds': run['seconds'], 'plotting_modules': [p for p in loaded.split(',') if p]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark cold-start time of circular_ribbon_contact_map.py with and without plotting",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--structure', type=str, default=DEFAULT_STRUCTURE,
+                        help='mmCIF or PDB file for the CLI cases (default: VLPIM_Web_services/6htx.pdb)')
+    parser.add_argument('--chain1', type=str, default='A', help='First chain ID (default: A)')
+    parser.add_argument('--chain2', type=str, default='B', help='Second chain ID (default: B)')
+    parser.add_argument('--repeats', type=int, default=5, help='Repeats per case, best time kept (default: 5)')
+    parser.add_argument('--skip-cli', action='store_true', help='Only time the import cases')
+    parser.add_argument('--output', type=str, default='benchmark_contact_map_startup.json',
+                        help='Output JSON file (default: benchmark_contact_map_startup.json)')
+    args = parser.parse_args()
+    repeats = max(1, args.repeats)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'structure': os.path.basename(args.structure),
+            'repeats': repeats
+        },
+        'results': []
+    }
+
+    cases = [
+        import_case('import (extract-only)', 'import circular_ribbon_contact_map', repeats),
+        import_case('import + plotting libraries',
+                    'import circular_ribbon_contact_map as m; m.load_plotting()', repeats)
+    ]
+
+    if not args.skip_cli:
+        workdir = tempfile.mkdtemp(prefix="crcm_startup_")
+        try:
+            base = [sys.executable, SCRIPT, '--cif', os.path.abspath(args.structure),
+                    '--chain1', args.chain1, '--chain2', args.chain2]
+            for name, extra in [('cli --extract-only', ['--extract-only']),
+                                ('cli with HTML plot', ['--output', 'contact_map.html'])]:
+                run = _run(base + extra, workdir, repeats)
+                cases.append({'case': name, 'seconds': run['seconds']})
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for case in cases:
+        report['results'].append(case)
+        loaded = case.get('plotting_modules')
+        suffix = f" (plotting modules: {', '.join(loaded) or 'none'})" if loaded is not None else ''
+        print(f"{case['case']:30s} {case['seconds']:.3f}s{suffix}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
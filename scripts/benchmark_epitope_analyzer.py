@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark and scaling suite for epitope_analyzer.py
+
+Generates synthetic NetMHCIIpan outputs (wide-table and standard format), runs
+each EpitopeAnalyzer stage (parse, filter, extend, save) on them and reports
+wall time and memory per stage as JSON, so before/after comparisons of parser
+and filter changes are reproducible.
+
+Inputs are generated in a separate process and every stage runs in its own fresh
+worker, reading the previous stage's output from a pickle. Each stage reports its
+baseline RSS (after imports and loading its input) and stage_rss_mb, the growth of
+peak RSS above that baseline while the stage runs.
+
+Usage examples:
+  # Default scaling run (10^3 - 10^6 long-format rows, both formats)
+  python benchmark_epitope_analyzer.py --output bench_epitope.json
+
+  # Full range up to 10^7 rows, wide format only, 20 alleles
+  python benchmark_epitope_analyzer.py --sizes 1e3 1e4 1e5 1e6 1e7 --formats wide --alleles 20
+
+Author: [Chufan Wang]
+Version: 1.0
+Date: 2025
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import epitope_analyzer  # noqa: E402
+
+AMINO_ACIDS = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+PEPTIDE_LENGTH = 15
+CORE_LENGTH = 9
+FIELDS_PER_ALLELE = ['Core', 'Inverted', 'Score', 'Rank', 'Score_BA', 'nM', 'Rank_BA']
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _synthetic_sequence(n_peptides: int, rng: np.random.Generator) -> str:
+    return ''.join(rng.choice(AMINO_ACIDS, size=n_peptides + PEPTIDE_LENGTH - 1))
+
+
+def _allele_names(n_alleles: int) -> List[str]:
+    return [f"HLA-DPA1{i // 100:02d}{i % 100:02d}-DPB1{i // 100:02d}{i % 100:02d}" for i in range(n_alleles)]
+
+
+def _synthetic_block(sequence: str, pos: np.ndarray, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """Per-allele predictions for the peptides starting at pos (1-based)."""
+    n = len(pos)
+    offsets = rng.integers(0, PEPTIDE_LENGTH - CORE_LENGTH + 1, size=n)
+    return {
+        'Core': np.array([sequence[p - 1 + o:p - 1 + o + CORE_LENGTH] for p, o in zip(pos, offsets)]),
+        'Inverted': np.zeros(n, dtype=int),
+        'Score': rng.random(n),
+        # Skewed so that roughly 5% of rows are strong/weak binders
+        'Rank': rng.random(n) ** 2 * 100,
+        'Score_BA': rng.random(n),
+        'nM': rng.random(n) * 50000,
+        'Rank_BA': rng.random(n) * 100
+    }
+
+
+def generate_wide_table(path: str, fasta_path: str, n_peptides: int, n_alleles: int,
+                        seed: int = 0, chunk_size: int = 100000) -> None:
+    """Write a synthetic wide-table NetMHCIIpan output plus its FASTA."""
+    rng = np.random.default_rng(seed)
+    sequence = _synthetic_sequence(n_peptides, rng)
+    alleles = _allele_names(n_alleles)
+
+    with open(path, 'w') as f:
+        allele_row = ['', '', '', '']
+        for allele in alleles:
+            allele_row += [allele] + [''] * (len(FIELDS_PER_ALLELE) - 1)
+        f.write('\t'.join(allele_row + ['', '']) + '\n')
+        f.write('\t'.join(['Pos', 'Peptide', 'ID', 'Target'] + FIELDS_PER_ALLELE * n_alleles + ['Ave', 'NB']) + '\n')
+
+        for chunk_start in range(1, n_peptides + 1, chunk_size):
+            pos = np.arange(chunk_start, min(chunk_start + chunk_size, n_peptides + 1))
+            columns = {
+                'Pos': pos,
+                'Peptide': [sequence[p - 1:p - 1 + PEPTIDE_LENGTH] for p in pos],
+                'ID': 'Sequence',
+                'Target': 'NA'
+            }
+            for i in range(n_alleles):
+                for field, values in _synthetic_block(sequence, pos, rng).items():
+                    columns[f"{field}_{i}"] = values
+            columns['Ave'] = rng.random(len(pos))
+            columns['NB'] = 0
+            pd.DataFrame(columns).to_csv(f, sep='\t', header=False, index=False, float_format='%.6f')
+
+    with open(fasta_path, 'w') as f:
+        f.write(f">synthetic\n{sequence}\n")
+
+
+def generate_standard_table(path: str, fasta_path: str, n_peptides: int, n_alleles: int,
+                            seed: int = 0, chunk_size: int = 100000) -> None:
+    """Write a synthetic standard-format NetMHCIIpan output plus its FASTA."""
+    rng = np.random.default_rng(seed)
+    sequence = _synthetic_sequence(n_peptides, rng)
+    alleles = _allele_names(n_alleles)
+
+    with open(path, 'w') as f:
+        f.write("# Pos Peptide ID Allele Core %Rank_EL BA_Rank BA_IC50 BA_Raw Score\n")
+        for chunk_start in range(1, n_peptides + 1, chunk_size):
+            pos = np.arange(chunk_start, min(chunk_start + chunk_size, n_peptides + 1))
+            frames = []
+            for allele in alleles:
+                block = _synthetic_block(sequence, pos, rng)
+                frames.append(pd.DataFrame({
+                    'Pos': pos,
+                    'Peptide': [sequence[p - 1:p - 1 + PEPTIDE_LENGTH] for p in pos],
+                    'ID': 'Sequence',
+                    'Allele': allele,
+                    'Core': block['Core'],
+                    'Rank_EL': block['Rank'],
+                    'BA_Rank': block['Rank_BA'],
+                    'BA_IC50': block['nM'],
+                    'BA_Raw': block['Score_BA'],
+                    'Score': block['Score']
+                }))
+            pd.concat(frames).to_csv(f, sep=' ', header=False, index=False, float_format='%.6f')
+
+    with open(fasta_path, 'w') as f:
+        f.write(f">synthetic\n{sequence}\n")
+
+
+STAGES = [
+    # (stage, analyzer method, input pickle, output pickle)
+    ('parse', '_parse_netmhcii_output', None, 'parsed.pkl'),
+    ('filter', '_filter_epitopes_by_binding', 'parsed.pkl', 'selected.pkl'),
+    ('extend', '_extend_core_sequences', 'selected.pkl', 'extended.pkl'),
+    ('save', '_save_results', 'extended.pkl', None)
+]
+
+
+def prepare_case(table_format: str, long_rows: int, n_alleles: int, workdir: str, seed: int) -> Dict:
+    """Generate the input table and FASTA of one case (run in its own worker)."""
+    n_peptides = max(1, long_rows // n_alleles)
+    case_dir = os.path.join(workdir, f"{table_format}_{long_rows}")
+    os.makedirs(case_dir, exist_ok=True)
+    table_path = os.path.join(case_dir, "netmhcii.out")
+    fasta_path = os.path.join(case_dir, "sequence.fasta")
+
+    generate = generate_wide_table if table_format == 'wide' else generate_standard_table
+    started = time.perf_counter()
+    generate(table_path, fasta_path, n_peptides, n_alleles, seed=seed)
+    return {
+        'case_dir': case_dir,
+        'table_path': table_path,
+        'fasta_path': fasta_path,
+        'peptides': n_peptides,
+        'generate_seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def run_stage(stage: str, case: Dict, epitopes_number: int) -> Dict:
+    """
+    Time one run_analysis stage in a fresh worker process.
+
+    The stage input is loaded from the previous stage's pickle before timing. The
+    baseline is the peak RSS after imports and input loading; stage_rss_mb is how
+    far the stage raised the peak above it.
+    """
+    _, method, input_name, output_name = next(entry for entry in STAGES if entry[0] == stage)
+    config = epitope_analyzer.AnalysisConfig(
+        netmhcii_output=case['table_path'],
+        fasta_path=case['fasta_path'],
+        mode=epitope_analyzer.ImmunogenicityMode.REDUCE,
+        output_dir=os.path.join(case['case_dir'], "results"),
+        epitopes_number=epitopes_number
+    )
+    os.makedirs(config.output_dir, exist_ok=True)
+    analyzer = epitope_analyzer.EpitopeAnalyzer(config, log_mode="none")
+    analyzer.logger.setLevel(logging.ERROR)
+
+    import_rss = _peak_rss_mb()
+    if input_name:
+        stage_input = pd.read_pickle(os.path.join(case['case_dir'], input_name))
+    else:
+        stage_input = case['table_path']
+    baseline_rss = _peak_rss_mb()
+
+    started = time.perf_counter()
+    result = getattr(analyzer, method)(stage_input)
+    seconds = time.perf_counter() - started
+    peak_rss = _peak_rss_mb()
+
+    info = {}
+    if output_name:
+        result.to_pickle(os.path.join(case['case_dir'], output_name))
+        info['rows'] = int(len(result))
+        if stage == 'parse':
+            info['parsed_table_mb'] = round(result.memory_usage(deep=True).sum() / 1e6, 2)
+        elif stage == 'filter':
+            info['selected_cores'] = int(result['core'].nunique()) if not result.empty else 0
+    return {
+        'seconds': round(seconds, 4),
+        'import_rss_mb': round(import_rss, 1),
+        'baseline_rss_mb': round(baseline_rss, 1),
+        'peak_rss_mb': round(peak_rss, 1),
+        'stage_rss_mb': round(peak_rss - baseline_rss, 1),
+        'info': info
+    }
+
+
+def run_case(table_format: str, long_rows: int, n_alleles: int, epitopes_number: int,
+             workdir: str, seed: int, context) -> Dict:
+    """Generate one input, then time every run_analysis stage in its own fresh process."""
+    # Generating in a worker keeps this process small; spawned workers inherit its
+    # peak RSS on Linux
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        case = pool.submit(prepare_case, table_format, long_rows, n_alleles, workdir, seed).result()
+
+    stages = {}
+    for stage, _, _, _ in STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            stages[stage] = pool.submit(run_stage, stage, case, epitopes_number).result()
+    info = {stage: stats.pop('info') for stage, stats in stages.items()}
+
+    return {
+        'format': table_format,
+        'long_rows': info['parse']['rows'],
+        'peptides': case['peptides'],
+        'alleles': n_alleles,
+        'input_mb': round(os.path.getsize(case['table_path']) / 1e6, 2),
+        'parsed_table_mb': info['parse']['parsed_table_mb'],
+        'selected_cores': info['filter']['selected_cores'],
+        'selected_rows': info['extend']['rows'],
+        'generate_seconds': case['generate_seconds'],
+        'import_rss_mb': stages['parse']['import_rss_mb'],
+        'stages': stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in stages.values()), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark epitope_analyzer.py stages on synthetic NetMHCIIpan outputs",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6],
+                        help='Long-format row counts (peptides x alleles) to benchmark (default: 1e3 1e4 1e5 1e6)')
+    parser.add_argument('--alleles', type=int, default=10,
+                        help='Number of alleles per synthetic table (default: 10)')
+    parser.add_argument('--formats', nargs='+', choices=['wide', 'standard'], default=['wide', 'standard'],
+                        help='NetMHCIIpan formats to benchmark (default: both)')
+    parser.add_argument('--epitopes-number', type=int, default=10,
+                        help='Number of cores to select (default: 10)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Directory for generated inputs (default: a temporary directory)')
+    parser.add_argument('--output', type=str, default='benchmark_epitope_analyzer.json',
+                        help='Output JSON file (default: benchmark_epitope_analyzer.json)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="epitope_bench_")
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'parser_version': epitope_analyzer.PARSER_VERSION,
+            'alleles': args.alleles,
+            'seed': args.seed
+        },
+        'results': []
+    }
+
+    # Inputs are generated and every stage runs in a fresh process, so each
+    # stage's RSS excludes the generator and the earlier stages
+    context = multiprocessing.get_context('spawn')
+    for table_format in args.formats:
+        for size in args.sizes:
+            long_rows = int(size)
+            print(f"[{table_format}] {long_rows} long-format rows ...", flush=True)
+            result = run_case(table_format, long_rows, args.alleles, args.epitopes_number,
+                              workdir, args.seed, context)
+            report['results'].append(result)
+            stage_summary = ', '.join(
+                f"{name} {stage['seconds']:.3f}s +{stage['stage_rss_mb']} MB"
+                for name, stage in result['stages'].items()
+            )
+            print(f"    {stage_summary} (RSS after import {result['import_rss_mb']} MB)")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the --output-format options of run_ic50_sum.py and epitope_analyzer.py
+
+Builds synthetic result tables shaped like run_ic50_sum's per-peptide
+*_wy2_scores table and epitope_analyzer's selected_epitopes table, writes each
+with netmhcii_table.write_result_table in every output format, reads it back
+with read_result_table and reports write/read wall time and file size as JSON,
+relative to the plain CSV output.
+
+Usage examples:
+  # Default run (10^4 - 10^6 rows, all formats)
+  python benchmark_output_formats.py --output bench_formats.json
+
+  # Larger tables, typed formats only
+  python benchmark_output_formats.py --sizes 1e6 1e7 --formats csv parquet npz
+
+Author: [Chufan Wang]
+Version: 1.0
+Date: 2025
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from netmhcii_table import (  # noqa: E402
+    HAS_PYARROW, OUTPUT_FORMATS, read_result_table, resolve_output_format, write_result_table
+)
+
+AMINO_ACIDS = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+PEPTIDE_LENGTH = 15
+CORE_LENGTH = 9
+
+
+def _random_peptides(n: int, length: int, rng: np.random.Generator) -> np.ndarray:
+    letters = rng.choice(AMINO_ACIDS, size=(n, length))
+    return letters.view(f'<U{length}').ravel()
+
+
+def scores_table(n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Table shaped like run_ic50_sum's *_wy2_scores output (after reset_index)."""
+    overall = np.sort(rng.random(n_rows) * 2000).round(3)
+    return pd.DataFrame({
+        'index': np.arange(n_rows),
+        'Peptide': _random_peptides(n_rows, PEPTIDE_LENGTH, rng),
+        'ID': np.char.add('design_', (np.arange(n_rows) // 500).astype(str)),
+        'Allele_Count': rng.integers(1, 30, size=n_rows),
+        'Best_IC50(nM)': (rng.random(n_rows) * 50000).round(2),
+        'Overall_Score_Sum': overall,
+    })
+
+
+def epitope_table(n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Table shaped like epitope_analyzer's selected_epitopes output (compact dtypes)."""
+    n_cores = max(1, n_rows // 20)
+    cores = _random_peptides(n_cores, CORE_LENGTH, rng)
+    alleles = np.array([f"HLA-DPA1*01:{i:02d}-DPB1*01:{i:02d}" for i in range(20)])
+    start = rng.integers(1, 5000, size=n_rows).astype('int32')
+    return pd.DataFrame({
+        'sequence': pd.Categorical(_random_peptides(n_rows, PEPTIDE_LENGTH, rng)),
+        'core': pd.Categorical(cores[rng.integers(0, n_cores, size=n_rows)]),
+        'start': start,
+        'end': start + PEPTIDE_LENGTH - 1,
+        'score': rng.random(n_rows).astype('float32'),
+        'rank_el': (rng.random(n_rows) * 100).astype('float32'),
+        'ic50': (rng.random(n_rows) * 50000).astype('float32'),
+        'allele': pd.Categorical(alleles[rng.integers(0, len(alleles), size=n_rows)]),
+        'binding_class': np.where(rng.random(n_rows) < 0.3, 'Strong', 'Weak'),
+        'number_of_strong_binding': rng.integers(0, 20, size=n_rows),
+    })
+
+
+def run_case(df: pd.DataFrame, output_format: str, workdir: str, repeats: int) -> Dict:
+    """Best-of-repeats write and read-back time for one table and format."""
+    base_path = os.path.join(workdir, f"table_{output_format.replace('.', '_')}")
+    write_seconds, read_seconds = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        path = write_result_table(df, base_path, output_format)
+        write_seconds.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        back = read_result_table(path)
+        read_seconds.append(time.perf_counter() - started)
+    result = {
+        'format': output_format,
+        'written_as': resolve_output_format(output_format),
+        'write_seconds': round(min(write_seconds), 4),
+        'read_seconds': round(min(read_seconds), 4),
+        'size_mb': round(os.path.getsize(path) / 1e6, 3),
+        'dtypes_preserved': bool((back.dtypes.astype(str) == df.dtypes.astype(str)).all()),
+    }
+    os.remove(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark result table output formats against plain CSV",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e4, 1e5, 1e6],
+                        help='Row counts to benchmark (default: 1e4 1e5 1e6)')
+    parser.add_argument('--formats', nargs='+', choices=OUTPUT_FORMATS, default=list(OUTPUT_FORMATS),
+                        help='Output formats to benchmark (default: all); csv is always included as baseline')
+    parser.add_argument('--tables', nargs='+', choices=['scores', 'epitopes'], default=['scores', 'epitopes'],
+                        help='Table shapes to benchmark (default: both)')
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats per case, best time kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--output', type=str, default='benchmark_output_formats.json',
+                        help='Output JSON file (default: benchmark_output_formats.json)')
+    args = parser.parse_args()
+
+    formats = ['csv'] + [f for f in args.formats if f != 'csv']
+    builders = {'scores': scores_table, 'epitopes': epitope_table}
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'pyarrow': HAS_PYARROW,
+            'platform': platform.platform(),
+            'repeats': args.repeats,
+            'seed': args.seed
+        },
+        'results': []
+    }
+
+    workdir = tempfile.mkdtemp(prefix="format_bench_")
+    try:
+        for table in args.tables:
+            for size in args.sizes:
+                n_rows = int(size)
+                df = builders[table](n_rows, np.random.default_rng(args.seed))
+                print(f"[{table}] {n_rows} rows ...", flush=True)
+                baseline = None
+                for output_format in formats:
+                    result = run_case(df, output_format, workdir, max(1, args.repeats))
+                    if baseline is None:
+                        baseline = result
+                    result.update({
+                        'table': table,
+                        'rows': n_rows,
+                        'write_speedup_vs_csv': round(baseline['write_seconds'] / max(result['write_seconds'], 1e-9), 2),
+                        'read_speedup_vs_csv': round(baseline['read_seconds'] / max(result['read_seconds'], 1e-9), 2),
+                        'size_vs_csv': round(result['size_mb'] / max(baseline['size_mb'], 1e-9), 3)
+                    })
+                    report['results'].append(result)
+                    print(f"    {output_format:8s} write {result['write_seconds']:.3f}s, "
+                          f"read {result['read_seconds']:.3f}s, {result['size_mb']:.2f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
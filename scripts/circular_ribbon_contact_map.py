@@ -11,27 +11,80 @@ Usage examples:
   # From an mmCIF and two chains, extract sequences/contacts, then draw
   python circular_ribbon_contact_map.py --cif complex.cif --chain1 H --chain2 L --cutoff 5.0 --output H_L_contact_map.html
 
+  # Every inter-chain interface of a multichain model in one pass
+  python circular_ribbon_contact_map.py --cif capsid.cif --all-pairs --outdir interfaces/
+
+  # PNG/SVG without a browser, and batch rendering of many edge lists in 8 processes
+  python circular_ribbon_contact_map.py edges.csv --output contact_map.png
+  python circular_ribbon_contact_map.py --render-batch "interfaces/*_edges.csv" --cif capsid.cif --format svg --jobs 8 --outdir maps/
+
+  # Keep the residue contact matrix (min distance per residue pair), then replot at a tighter cutoff
+  python circular_ribbon_contact_map.py --cif complex.cif --chain1 H --chain2 L --cutoff 8 --save-matrix --extract-only
+  python circular_ribbon_contact_map.py --matrix H_L_contact_matrix.npz --chain1 H --chain2 L --cutoff 4.5 --output H_L_4.5.html
+
+  # Whole-capsid / large ensemble maps: contiguous interface segments, 200 heaviest bundled edges,
+  # then the residue-level contacts of one segment
+  python circular_ribbon_contact_map.py capsid_edges.csv --segments interface --top-edges 200 --output capsid_lod.html
+  python circular_ribbon_contact_map.py capsid_edges.csv --segments interface --drill-down A_45-52 --output A_45-52.html
+
+  # Batch extraction only: FASTA + contacts/edges CSV, no plotting libraries imported
+  python circular_ribbon_contact_map.py --cif complex.cif --chain1 H --chain2 L --extract-only
+
+  # Contact frequencies over many AF3 seeds / designs, edge width proportional to frequency
+  python circular_ribbon_contact_map.py --ensemble "af3_runs/*/*.cif" --chain1 A --chain2 B --jobs 8 --output A_B_consensus.html
+
 This file is mirrored from the author's local script so that users can
 download and run it directly from the Toolboxes repository.
 """
 
 import pandas as pd
-import holoviews as hv
-from holoviews import opts
+import numpy as np
 import argparse
 import sys
 import os
-from Bio.PDB import MMCIFParser, is_aa
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from Bio.PDB import MMCIFParser, PDBParser, is_aa
 from Bio.Data import IUPACData
 import csv
 import re
-import matplotlib.pyplot as plt  # noqa: F401 (kept for parity with original)
-import matplotlib.colors as mcolors
-
-hv.extension('bokeh')
 
 three_to_one = IUPACData.protein_letters_3to1
 
+# 残基理化类别 → 边颜色（CYS、疏水、极性、酸性、碱性；其余为灰色），hex 不含 alpha
+_RESIDUE_CLASS_COLORS = [
+    (('CYS',), '#000000'),
+    (('ALA', 'VAL', 'LEU', 'ILE', 'MET', 'PHE', 'TRP', 'PRO', 'GLY'), '#ff7744'),
+    (('SER', 'THR', 'TYR', 'ASN', 'GLN'), '#87cefa'),
+    (('ASP', 'GLU'), '#ff0000'),
+    (('LYS', 'ARG', 'HIS'), '#b565a7'),
+]
+RESIDUE_CLASS_COLORS = {
+    resname: color for resnames, color in _RESIDUE_CLASS_COLORS for resname in resnames
+}
+DEFAULT_EDGE_COLOR = '#aaaaaa'
+
+# matplotlib 渲染的输出格式；每条弦的采样点数与 HoloViews 的 chord_samples 相同
+STATIC_SUFFIXES = ('.png', '.svg', '.pdf')
+CHORD_SAMPLES = 50
+# 超过这么多条边时提示使用 --segments/--top-edges 分级显示
+LARGE_GRAPH_EDGES = 5000
+
+_hv = None
+
+
+def load_plotting():
+    """
+    按需导入 holoviews 并启用 bokeh 后端（只在真正绘图时调用）。
+    提取序列/接触的批量任务因此不必承担 holoviews/bokeh 的导入开销。
+    """
+    global _hv
+    if _hv is None:
+        import holoviews as hv
+        hv.extension('bokeh')
+        _hv = hv
+    return _hv
+
 
 def aa3to1(resname):
     return three_to_one.get(resname.capitalize(), 'X')
@@ -41,76 +94,473 @@ def residue_label(chain_id, res):
     return f"{chain_id}_{res.get_resname()}_{res.get_id()[1]}"
 
 
-def extract_chain_sequence(cif_file, chain_id):
-    parser = MMCIFParser(QUIET=True)
-    structure = parser.get_structure('struct', cif_file)
-    seq = []
-    res_ids = []
-    for model in structure:
-        for chain in model:
-            if chain.id == chain_id:
+def load_structure(structure_file):
+    """用 Bio.PDB 解析结构文件：.pdb/.ent 按 PDB 格式，其余按 mmCIF"""
+    if structure_file.lower().endswith(('.pdb', '.ent')):
+        parser = PDBParser(QUIET=True)
+    else:
+        parser = MMCIFParser(QUIET=True)
+    return parser.get_structure('struct', structure_file)
+
+
+class AtomTable:
+    """
+    结构文件解析一次后得到的紧凑原子表，序列、接触与节点标签都由它派生。
+
+    只包含标准氨基酸残基（is_aa(res, standard=True) 且非 HETATM），顺序与遍历
+    Bio.PDB 结构（模型 → 链 → 残基 → 原子）相同；多构象原子取 Bio.PDB 选中的那个。
+    残基级数组：res_model、res_chain、res_num、res_name；
+    原子级数组：atom_residue（所属残基下标）、element、atom_name、coords（float32，与 Bio.PDB 一致）。
+    """
+
+    def __init__(self, res_model, res_chain, res_num, res_name, atom_residue, element, atom_name, coords):
+        self.res_model = res_model
+        self.res_chain = res_chain
+        self.res_num = res_num
+        self.res_name = res_name
+        self.atom_residue = atom_residue
+        self.element = element
+        self.atom_name = atom_name
+        self.coords = coords
+
+    @classmethod
+    def from_structure(cls, structure):
+        """由 Bio.PDB 结构对象构建（只遍历一次）"""
+        res_model, res_chain, res_num, res_name = [], [], [], []
+        atom_residue, element, atom_name, coords = [], [], [], []
+        for model_index, model in enumerate(structure):
+            for chain in model:
                 for res in chain:
-                    if is_aa(res, standard=True) and res.id[0] == ' ':
-                        seq.append(aa3to1(res.get_resname()))
-                        res_ids.append(res.id[1])
-    return ''.join(seq), res_ids
+                    if not (is_aa(res, standard=True) and res.id[0] == ' '):
+                        continue
+                    for atom in res:
+                        atom_residue.append(len(res_num))
+                        element.append(atom.element)
+                        atom_name.append(atom.get_name())
+                        coords.append(atom.coord)
+                    res_model.append(model_index)
+                    res_chain.append(chain.id)
+                    res_num.append(res.id[1])
+                    res_name.append(res.get_resname())
+        return cls(
+            np.asarray(res_model, dtype=np.int32),
+            np.asarray(res_chain, dtype=object),
+            np.asarray(res_num, dtype=np.int64),
+            np.asarray(res_name, dtype=object),
+            np.asarray(atom_residue, dtype=np.int64),
+            np.asarray(element, dtype=object),
+            np.asarray(atom_name, dtype=object),
+            np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        )
+
+    @property
+    def n_residues(self):
+        return len(self.res_num)
+
+    def models(self):
+        """按模型拆分为 AtomTable 列表（单模型时返回 [self]）"""
+        model_ids = np.unique(self.res_model)
+        if len(model_ids) <= 1:
+            return [self]
+        tables = []
+        for model_id in model_ids:
+            residues = np.flatnonzero(self.res_model == model_id)
+            position = np.full(self.n_residues, -1, dtype=np.int64)
+            position[residues] = np.arange(len(residues))
+            atoms = np.flatnonzero(position[self.atom_residue] >= 0)
+            tables.append(AtomTable(
+                self.res_model[residues], self.res_chain[residues], self.res_num[residues],
+                self.res_name[residues], position[self.atom_residue[atoms]], self.element[atoms],
+                self.atom_name[atoms], self.coords[atoms]
+            ))
+        return tables
+
+    def chain_residues(self, chain_id):
+        """某条链的残基下标（升序，即遍历顺序）"""
+        return np.flatnonzero(self.res_chain == chain_id)
+
+    def labels(self, residues):
+        """残基下标 → 节点标签 Chain_RES3_Num"""
+        return _residue_labels(self, residues)
+
+    def heavy_atom_indices(self, residues):
+        """给定残基（下标）的重原子在表中的下标（按原子顺序）"""
+        return np.flatnonzero(np.isin(self.atom_residue, residues) & (self.element != 'H'))
+
+
+def _residue_labels(table, residues):
+    """AtomTable/ContactMatrix 的残基下标 → 节点标签 Chain_RES3_Num"""
+    return [f"{c}_{n}_{i}" for c, n, i in zip(table.res_chain[residues], table.res_name[residues],
+                                               table.res_num[residues].tolist())]
+
+
+def load_atom_table(structure_file):
+    """解析结构文件（mmCIF 或 PDB）一次并转换为 AtomTable"""
+    return AtomTable.from_structure(load_structure(structure_file))
+
+
+def _as_atom_table(source):
+    """接受结构文件路径或已构建的 AtomTable"""
+    return source if isinstance(source, AtomTable) else load_atom_table(source)
+
+
+def extract_chain_sequence(cif_file, chain_id):
+    """链的一字母序列与残基编号；cif_file 可为结构文件路径或 AtomTable"""
+    table = _as_atom_table(cif_file)
+    residues = table.chain_residues(chain_id)
+    return ''.join(aa3to1(name) for name in table.res_name[residues]), table.res_num[residues].tolist()
+
+
+def neighbor_atom_pairs(coords1, coords2, cutoff, groups1=None, groups2=None):
+    """
+    Cell-list 近邻搜索：返回距离 <= cutoff 的全部原子对 (i, j, 距离)。
+
+    coords2 按边长略大于 cutoff 的网格分桶并按桶号排序，coords1 的每个原子只与
+    相邻 27 个桶中的原子比较，复杂度约为 O(原子数) 而非 O(n1 × n2)。
+    距离按 float32 计算，与 Bio.PDB 的 atom1 - atom2 一致（相同的取舍与舍入）。
+    给定 groups1/groups2（每个原子的整数分组，如链序号）时只保留 groups1[i] < groups2[j] 的原子对，
+    用于在同一组坐标上一次搜索所有链间接触（同链及反向的原子对在计算距离前即被排除）。
+    结果按 (i, j) 升序排列。
+    """
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+    if len(coords1) == 0 or len(coords2) == 0 or cutoff < 0:
+        return empty
+    # 桶边长略大于 cutoff，保证 float32 距离恰好等于 cutoff 的原子对也落在相邻桶内
+    cell = max(cutoff * (1 + 1e-6) + 1e-6, 1e-3)
+    origin = np.minimum(coords1.min(axis=0), coords2.min(axis=0)).astype(np.float64)
+    cells1 = np.floor((coords1 - origin) / cell).astype(np.int64) + 1
+    cells2 = np.floor((coords2 - origin) / cell).astype(np.int64) + 1
+    dims = np.maximum(cells1.max(axis=0), cells2.max(axis=0)) + 2
+
+    def cell_key(cells):
+        return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order2 = np.argsort(cell_key(cells2), kind='stable')
+    sorted_keys2 = cell_key(cells2)[order2]
+
+    pair_i, pair_j, pair_d = [], [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                keys1 = cell_key(cells1 + np.array([dx, dy, dz]))
+                lo = np.searchsorted(sorted_keys2, keys1, side='left')
+                hi = np.searchsorted(sorted_keys2, keys1, side='right')
+                counts = hi - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                i = np.repeat(np.arange(len(coords1)), counts)
+                starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                j = order2[starts + np.arange(total)]
+                if groups1 is not None:
+                    in_groups = groups1[i] < groups2[j]
+                    i = i[in_groups]
+                    j = j[in_groups]
+                diff = coords1[i] - coords2[j]
+                dist = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1] + diff[:, 2] * diff[:, 2])
+                keep = dist <= cutoff
+                pair_i.append(i[keep])
+                pair_j.append(j[keep])
+                pair_d.append(dist[keep])
+    if not pair_i:
+        return empty
+    i = np.concatenate(pair_i)
+    j = np.concatenate(pair_j)
+    d = np.concatenate(pair_d)
+    order = np.lexsort((j, i))
+    return i[order], j[order], d[order]
+
+
+class ContactMatrix:
+    """
+    残基 × 残基的稀疏接触矩阵（COO），由重原子近邻表一次算出，可在不超过 cutoff 的任意距离阈值下复用。
+
+    残基级数组（与 AtomTable 相同的残基下标）：res_chain、res_num、res_name；
+    每个接触残基对一项：row、col（残基下标）、min_distance（最短重原子距离，float32）、
+    atom1/atom2（最近原子对的原子名），各项按 (row, col) 升序排列。
+    每个残基对 cutoff 内全部重原子对的距离按升序存于 pair_distances[pair_offsets[k]:pair_offsets[k + 1]]，
+    atom_contacts（原子接触数）由此得出，因此 select 降低阈值后的各项统计与直接按该阈值提取完全相同。
+    """
+
+    CSV_FIELDS = ['source', 'target', 'chain1', 'res1_num', 'res1_name', 'chain2', 'res2_num', 'res2_name',
+                  'min_distance', 'atom_contacts', 'atom1', 'atom2']
+
+    def __init__(self, res_chain, res_num, res_name, row, col, min_distance, atom1, atom2,
+                 pair_offsets, pair_distances, cutoff):
+        self.res_chain = res_chain
+        self.res_num = res_num
+        self.res_name = res_name
+        self.row = row
+        self.col = col
+        self.min_distance = min_distance
+        self.atom1 = atom1
+        self.atom2 = atom2
+        self.pair_offsets = pair_offsets
+        self.pair_distances = pair_distances
+        self.cutoff = float(cutoff)
+
+    @classmethod
+    def from_atom_pairs(cls, table, atom_i, atom_j, dist, cutoff):
+        """
+        原子对（table 中的原子下标及其距离）→ 残基对统计。
+        每个残基对取距离最小的原子对，距离相同时取原子顺序在前的那一对。
+        """
+        res_i = table.atom_residue[atom_i]
+        res_j = table.atom_residue[atom_j]
+        pair_key = res_i * table.n_residues + res_j
+        # 按残基对、再按距离排序（稳定排序，距离相同时保持原子顺序）
+        order = np.lexsort((dist, pair_key))
+        _, first = np.unique(pair_key[order], return_index=True)
+        best = order[first]
+        return cls(
+            table.res_chain, table.res_num, table.res_name, res_i[best], res_j[best], dist[best],
+            table.atom_name[atom_i[best]], table.atom_name[atom_j[best]],
+            np.append(first, len(order)).astype(np.int64), dist[order], cutoff
+        )
+
+    @property
+    def atom_contacts(self):
+        return np.diff(self.pair_offsets).astype(np.int32)
+
+    def __len__(self):
+        return len(self.row)
+
+    @property
+    def shape(self):
+        return (len(self.res_num), len(self.res_num))
+
+    def labels(self, residues):
+        """残基下标 → 节点标签 Chain_RES3_Num"""
+        return _residue_labels(self, residues)
+
+    def chain_labels(self, chain1, chain2):
+        """两条链全部残基的节点标签（残基顺序），与 get_all_residue_labels 相同"""
+        return self.labels(np.flatnonzero(np.isin(self.res_chain, [chain1, chain2])))
+
+    def take(self, index):
+        """只保留 index 指定的接触项"""
+        index = np.asarray(index, dtype=np.int64)
+        starts = self.pair_offsets[index]
+        lengths = self.pair_offsets[index + 1] - starts
+        offsets = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        distances = self.pair_distances[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])]
+        return ContactMatrix(
+            self.res_chain, self.res_num, self.res_name, self.row[index], self.col[index], self.min_distance[index],
+            self.atom1[index], self.atom2[index], offsets, distances, self.cutoff
+        )
+
+    def select(self, chain1=None, chain2=None, cutoff=None):
+        """
+        按链对与距离阈值筛选（cutoff 不能超过提取时的 cutoff）。
+        只给 chain1/chain2 中的一个时不按链筛选。
+        """
+        if cutoff is not None and cutoff > self.cutoff:
+            raise ValueError(f"cutoff {cutoff} exceeds the extraction cutoff {self.cutoff} of this contact matrix")
+        keep = np.ones(len(self), dtype=bool)
+        if cutoff is not None:
+            keep &= self.min_distance <= cutoff
+        if chain1 and chain2:
+            keep &= (self.res_chain[self.row] == chain1) & (self.res_chain[self.col] == chain2)
+        selected = self.take(np.flatnonzero(keep))
+        if cutoff is None:
+            return selected
+        # 每段距离已升序，去掉超过新阈值的原子对后重建偏移
+        within = selected.pair_distances <= cutoff
+        counts = np.add.reduceat(within.astype(np.int64), selected.pair_offsets[:-1]) if len(selected) else np.zeros(0, dtype=np.int64)
+        offsets = np.zeros(len(selected) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        selected.pair_offsets = offsets
+        selected.pair_distances = selected.pair_distances[within]
+        selected.cutoff = float(cutoff)
+        return selected
+
+    def to_contacts(self):
+        """(contacts, contacts_detail)，格式与 extract_contacts_from_cif 相同"""
+        contacts = list(zip(self.labels(self.row), self.labels(self.col)))
+        contacts_detail = [
+            {
+                'chain1': chain1,
+                'res1_num': num1,
+                'res1_name': name1,
+                'chain2': chain2,
+                'res2_num': num2,
+                'res2_name': name2,
+                'distance': distance,
+                'atom_contacts': n_atoms,
+                'atom1': atom1,
+                'atom2': atom2
+            }
+            for chain1, num1, name1, chain2, num2, name2, distance, n_atoms, atom1, atom2 in zip(
+                self.res_chain[self.row], self.res_num[self.row].tolist(), self.res_name[self.row],
+                self.res_chain[self.col], self.res_num[self.col].tolist(), self.res_name[self.col],
+                np.round(self.min_distance, 3), self.atom_contacts.tolist(), self.atom1, self.atom2
+            )
+        ]
+        return contacts, contacts_detail
+
+    def to_frame(self):
+        """每个残基对一行的 DataFrame（列见 CSV_FIELDS），source/target 可直接作为边表"""
+        return pd.DataFrame({
+            'source': self.labels(self.row),
+            'target': self.labels(self.col),
+            'chain1': self.res_chain[self.row],
+            'res1_num': self.res_num[self.row],
+            'res1_name': self.res_name[self.row],
+            'chain2': self.res_chain[self.col],
+            'res2_num': self.res_num[self.col],
+            'res2_name': self.res_name[self.col],
+            'min_distance': np.round(self.min_distance.astype(np.float64), 3),
+            'atom_contacts': self.atom_contacts,
+            'atom1': self.atom1,
+            'atom2': self.atom2
+        }, columns=self.CSV_FIELDS)
+
+    def to_csv(self, path):
+        self.to_frame().to_csv(path, index=False)
+
+    def to_npz(self, path):
+        """保存为压缩 npz（不含 pickle 对象，可用 ContactMatrix.from_npz 读回）"""
+        np.savez_compressed(
+            path,
+            res_chain=self.res_chain.astype(str), res_num=self.res_num, res_name=self.res_name.astype(str),
+            row=self.row, col=self.col, min_distance=self.min_distance,
+            atom1=self.atom1.astype(str), atom2=self.atom2.astype(str),
+            pair_offsets=self.pair_offsets, pair_distances=self.pair_distances, cutoff=np.float64(self.cutoff)
+        )
+
+    @classmethod
+    def from_npz(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data['res_chain'].astype(object), data['res_num'], data['res_name'].astype(object),
+                data['row'], data['col'], data['min_distance'], data['atom1'].astype(object),
+                data['atom2'].astype(object), data['pair_offsets'], data['pair_distances'], float(data['cutoff'])
+            )
+
+
+def residue_contact_matrix(table, residues1, residues2, cutoff=5.0):
+    """
+    AtomTable 中两组残基之间的 ContactMatrix：任一对重原子距离 <= cutoff 即视为接触。
+
+    重原子坐标用 neighbor_atom_pairs 做 cell-list 近邻搜索，再归并为残基对，
+    每个残基对记录最短距离、原子接触数与最近原子对。
+    """
+    atoms1 = table.heavy_atom_indices(residues1)
+    atoms2 = table.heavy_atom_indices(residues2)
+    atom_i, atom_j, dist = neighbor_atom_pairs(table.coords[atoms1], table.coords[atoms2], cutoff)
+    return ContactMatrix.from_atom_pairs(table, atoms1[atom_i], atoms2[atom_j], dist, cutoff)
+
+
+def residue_contacts(table, residues1, residues2, chain1, chain2, cutoff=5.0):
+    """
+    AtomTable 中两组残基（升序下标）之间的接触。
+
+    每个残基对报告最短重原子距离（distance）、cutoff 内的原子对数（atom_contacts）
+    与最近原子对的原子名（atom1/atom2）；接触按 residues1 顺序、再按 residues2 顺序排列。
+    chain1/chain2 为两组残基所在的链（contacts_detail 中的链名取自结构本身）。
+    """
+    residues1 = np.asarray(residues1, dtype=np.int64)
+    residues2 = np.asarray(residues2, dtype=np.int64)
+    return residue_contact_matrix(table, residues1, residues2, cutoff).to_contacts()
+
+
+def all_chain_contact_matrix(cif_file, cutoff=5.0):
+    """
+    一次近邻搜索得到所有链间残基接触的 ContactMatrix；cif_file 可为结构文件路径或 AtomTable。
+
+    全部重原子放进同一个网格，以链序号分组只保留链间原子对。
+    链按在结构中首次出现的顺序排列，每个接触项的行（row）所在链先出现。
+
+    Returns:
+        (链列表, ContactMatrix)
+    """
+    table = _as_atom_table(cif_file)
+    chains = list(dict.fromkeys(table.res_chain))
+    chain_index = {chain: i for i, chain in enumerate(chains)}
+    res_chain_index = np.array([chain_index[c] for c in table.res_chain], dtype=np.int64)
+
+    atoms = table.heavy_atom_indices(np.arange(table.n_residues))
+    atom_chain = res_chain_index[table.atom_residue[atoms]]
+    atom_i, atom_j, dist = neighbor_atom_pairs(table.coords[atoms], table.coords[atoms], cutoff,
+                                               groups1=atom_chain, groups2=atom_chain)
+    return chains, ContactMatrix.from_atom_pairs(table, atoms[atom_i], atoms[atom_j], dist, cutoff)
+
+
+def split_chain_pairs(chains, matrix):
+    """
+    把全链 ContactMatrix 按链对拆分为 {(chain1, chain2): (contacts, contacts_detail)}，
+    链对按 chains 顺序排列，只包含有接触的链对；chain1 为先出现的链。
+    """
+    chain_index = {chain: i for i, chain in enumerate(chains)}
+    res_chain_index = np.array([chain_index[c] for c in matrix.res_chain], dtype=np.int64)
+    pair_code = res_chain_index[matrix.row] * len(chains) + res_chain_index[matrix.col]
+    # 按链对稳定排序后拆分，每段内仍保持 (row, col) 顺序
+    order = np.argsort(pair_code, kind='stable')
+    codes, starts = np.unique(pair_code[order], return_index=True)
+    bounds = np.append(starts, len(order))
+    results = {}
+    for code, lo, hi in zip(codes.tolist(), bounds[:-1], bounds[1:]):
+        chain1, chain2 = chains[code // len(chains)], chains[code % len(chains)]
+        results[(chain1, chain2)] = matrix.take(order[lo:hi]).to_contacts()
+    return results
+
+
+def all_chain_pair_contacts(cif_file, cutoff=5.0):
+    """
+    所有链对之间的残基接触（一次近邻搜索，见 all_chain_contact_matrix）；
+    各链对的结果与 extract_contacts_from_cif(table, chain1, chain2, cutoff) 完全相同。
+
+    Returns:
+        (链列表, {(chain1, chain2): (contacts, contacts_detail)})，只包含有接触的链对
+    """
+    chains, matrix = all_chain_contact_matrix(cif_file, cutoff)
+    return chains, split_chain_pairs(chains, matrix)
+
+
+def chain_pair_summary(chains, pair_contacts):
+    """链 × 链的残基接触数矩阵（对称，对角线为 0）"""
+    summary = pd.DataFrame(0, index=pd.Index(chains, name='chain'), columns=chains)
+    for (chain1, chain2), (contacts, _) in pair_contacts.items():
+        summary.loc[chain1, chain2] = len(contacts)
+        summary.loc[chain2, chain1] = len(contacts)
+    return summary
+
+
+CONTACT_FIELDS = ['chain1', 'res1_num', 'res1_name', 'chain2', 'res2_num', 'res2_name', 'distance',
+                  'atom_contacts', 'atom1', 'atom2']
+
+
+def write_contacts_csv(path, contacts_detail):
+    with open(path, "w", newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CONTACT_FIELDS)
+        writer.writeheader()
+        for row in contacts_detail:
+            writer.writerow(row)
+
+
+def write_edges_csv(path, contacts):
+    pd.DataFrame(contacts, columns=['source', 'target']).drop_duplicates().to_csv(path, index=False)
+
+
+def chain_pair_contact_matrix(cif_file, chain1, chain2, cutoff=5.0):
+    """chain1 与 chain2 之间的 ContactMatrix；cif_file 可为结构文件路径或 AtomTable"""
+    table = _as_atom_table(cif_file)
+    residues1 = table.chain_residues(chain1)
+    # 与原实现一致：chain1 与 chain2 相同时没有接触
+    residues2 = table.chain_residues(chain2) if chain2 != chain1 else np.zeros(0, dtype=np.int64)
+    return residue_contact_matrix(table, residues1, residues2, cutoff)
 
 
 def extract_contacts_from_cif(cif_file, chain1, chain2, cutoff=5.0):
-    parser = MMCIFParser(QUIET=True)
-    structure = parser.get_structure('struct', cif_file)
-    residues1 = []
-    residues2 = []
-    for model in structure:
-        for chain in model:
-            if chain.id == chain1:
-                for res in chain:
-                    if is_aa(res, standard=True) and res.id[0] == ' ':
-                        residues1.append(res)
-            elif chain.id == chain2:
-                for res in chain:
-                    if is_aa(res, standard=True) and res.id[0] == ' ':
-                        residues2.append(res)
-    contacts = []
-    contacts_detail = []
-    for res1 in residues1:
-        for res2 in residues2:
-            found = False
-            for atom1 in res1:
-                for atom2 in res2:
-                    if atom1.element != 'H' and atom2.element != 'H':
-                        dist = atom1 - atom2
-                        if dist <= cutoff:
-                            label1 = residue_label(chain1, res1)
-                            label2 = residue_label(chain2, res2)
-                            contacts.append((label1, label2))
-                            contacts_detail.append({
-                                'chain1': chain1,
-                                'res1_num': res1.id[1],
-                                'res1_name': res1.get_resname(),
-                                'chain2': chain2,
-                                'res2_num': res2.id[1],
-                                'res2_name': res2.get_resname(),
-                                'distance': round(dist, 3)
-                            })
-                            found = True
-                            break
-                if found:
-                    break
-    return contacts, contacts_detail
+    """chain1 与 chain2 之间的残基接触（见 residue_contacts）；cif_file 可为结构文件路径或 AtomTable"""
+    return chain_pair_contact_matrix(cif_file, chain1, chain2, cutoff).to_contacts()
 
 
 def get_all_residue_labels(cif_file, chain1, chain2):
-    parser = MMCIFParser(QUIET=True)
-    structure = parser.get_structure('struct', cif_file)
-    labels = []
-    for model in structure:
-        for chain in model:
-            if chain.id in [chain1, chain2]:
-                for res in chain:
-                    if is_aa(res, standard=True) and res.id[0] == ' ':
-                        labels.append(residue_label(chain.id, res))
-    return labels
+    """两条链全部残基的节点标签（遍历顺序）；cif_file 可为结构文件路径或 AtomTable"""
+    table = _as_atom_table(cif_file)
+    return table.labels(np.flatnonzero(np.isin(table.res_chain, [chain1, chain2])))
 
 
 def sort_key(x):
@@ -118,115 +568,117 @@ def sort_key(x):
     return int(m.group(3)) if m else 0
 
 
-def plot_circular_contact_map(edge_file, node_file=None, output_file=None, all_nodes=None, chain1=None, chain2=None):
-    try:
-        df = pd.read_csv(edge_file)
-    except Exception as e:
-        print(f"[✘] 读取 {edge_file} 失败，文件内容可能异常或为空。请检查文件格式。\n错误信息: {e}")
-        return
+def read_edge_table(edge_file):
+    """读取边表（CSV 路径或 DataFrame），缺少 source/target 列或为空时打印原因并返回 None"""
+    if isinstance(edge_file, pd.DataFrame):
+        df, name = edge_file, '边表'
+    else:
+        try:
+            df = pd.read_csv(edge_file)
+        except Exception as e:
+            print(f"[✘] 读取 {edge_file} 失败，文件内容可能异常或为空。请检查文件格式。\n错误信息: {e}")
+            return None
+        name = edge_file
     if df.empty or 'source' not in df.columns or 'target' not in df.columns:
-        print(f"[✘] {edge_file} 文件为空或缺少必要的 source/target 列，无法绘图。")
+        print(f"[✘] {name} 文件为空或缺少必要的 source/target 列，无法绘图。")
+        return None
+    return df
+
+
+def prepare_chord_data(edge_file, node_file=None, all_nodes=None, chain1=None, chain2=None):
+    """
+    读取边表（CSV 路径或 DataFrame）并生成弦图的边表与节点表（HoloViews 与 matplotlib 两种渲染共用）。
+
+    Returns:
+        (edges, nodes)：edges 列为 source/target（节点下标）/color/value（边宽），
+        nodes 列为 index/name（无接触的节点为空字符串）/color；边表无法读取时返回 None
+    """
+    df = read_edge_table(edge_file)
+    if df is None:
         return
 
+    # 每条边的两端按 (source, target) 交错排列
+    endpoints = np.column_stack([df['source'].to_numpy(dtype=object), df['target'].to_numpy(dtype=object)]).ravel()
+    connected_nodes = set(endpoints)
+
     if all_nodes is not None and chain1 and chain2:
-        chain1_nodes = [n for n in all_nodes if n.split('_')[0] == chain1]
-        chain2_nodes = [n for n in all_nodes if n.split('_')[0] == chain2]
-        other_nodes = [n for n in all_nodes if n.split('_')[0] not in [chain1, chain2]]
-        all_nodes = chain2_nodes + other_nodes + chain1_nodes
+        all_nodes = pd.Series(list(all_nodes), dtype=object)
+        node_chain = all_nodes.str.split('_').str[0]
+        all_nodes = (list(all_nodes[node_chain == chain2]) + list(all_nodes[~node_chain.isin([chain1, chain2])])
+                     + list(all_nodes[node_chain == chain1]))
+    elif all_nodes is not None:
+        all_nodes = list(all_nodes)
     elif node_file:
         node_df = pd.read_csv(node_file)
         all_nodes = list(node_df['id'])
     else:
-        all_nodes = sorted(set(df['source']) | set(df['target']))
+        all_nodes = sorted(connected_nodes)
 
     node_map = {name: i for i, name in enumerate(all_nodes)}
-    connected_nodes = set(df['source']).union(set(df['target']))
-
-    chord_data = []
-    edge_colors = []
-    edge_widths = []
-    contact_distance_dict = {}
-    if 'distance' in df.columns:
-        for idx, row in df.iterrows():
-            contact_distance_dict[(row['source'], row['target'])] = row['distance']
-            contact_distance_dict[(row['target'], row['source'])] = row['distance']
-
-    for src, tgt in zip(df['source'], df['target']):
-        if src in node_map and tgt in node_map:
-            chord_data.append((node_map[src], node_map[tgt]))
-            edge_colors.append('#FFA500')
-            dist = contact_distance_dict.get((src, tgt), None)
-            if dist is not None:
-                min_d, max_d = 3, 8
-                width = 4 - 3.5 * (min(max(dist, min_d), max_d) - min_d) / (max_d - min_d)
-            else:
-                width = 2
-            edge_widths.append(width)
-
-    contact_nodes = set(df['source']).union(set(df['target']))
-    chain_resnum = {}
-    for n in contact_nodes:
-        parts = n.split('_')
-        if len(parts) == 3:
-            chain, _, num = parts
-            chain_resnum.setdefault(chain, []).append(int(num))
-
-    interfaces = []
-    for chain, nums in chain_resnum.items():
-        nums = sorted(nums)
-        current = []
-        last = None
-        for num in nums:
-            if last is not None and num == last + 1:
-                current.append(num)
-            else:
-                if len(current) >= 2:
-                    interfaces.append((chain, current))
-                current = [num]
-            last = num
-        if len(current) >= 2:
-            interfaces.append((chain, current))
-
-    hydrophobic = {'ALA', 'VAL', 'LEU', 'ILE', 'MET', 'PHE', 'TRP', 'PRO', 'GLY'}
-    polar = {'SER', 'THR', 'TYR', 'ASN', 'GLN'}
-    acidic = {'ASP', 'GLU'}
-    basic = {'LYS', 'ARG', 'HIS'}
-
-    edge_colors = []
-    edge_widths = []
-    node_color_map = {}
-    for src, tgt in zip(df['source'], df['target']):
-        parts = src.split('_')
-        color = mcolors.to_rgba('#AAAAAA', alpha=0.75)
-        if len(parts) == 3:
-            resname = parts[1].upper()
-            if resname == 'CYS':
-                color = mcolors.to_rgba('#000000', alpha=0.75)
-            elif resname in hydrophobic:
-                color = mcolors.to_rgba('#FF7744', alpha=0.75)
-            elif resname in polar:
-                color = mcolors.to_rgba('#87CEFA', alpha=0.75)
-            elif resname in acidic:
-                color = mcolors.to_rgba('#FF0000', alpha=0.75)
-            elif resname in basic:
-                color = mcolors.to_rgba('#B565A7', alpha=0.75)
-        edge_colors.append(mcolors.to_hex(color))
-        edge_widths.append(2)
-        node_color_map[src] = mcolors.to_hex(color)
-        node_color_map[tgt] = mcolors.to_hex(color)
-
-    labels = [(i, name if name in connected_nodes else '') for name, i in node_map.items()]
+
+    # 边颜色按 source 残基的理化类别查表；两端节点记为该颜色（后出现的边覆盖先前的）
+    parts = df['source'].astype(str).str.split('_')
+    resnames = parts.str[1].str.upper().where(parts.str.len() == 3)
+    colors = resnames.map(RESIDUE_CLASS_COLORS).fillna(DEFAULT_EDGE_COLOR).to_numpy(dtype=object)
+    endpoint_colors = pd.Series(np.repeat(colors, 2), index=endpoints)
+    node_color_map = endpoint_colors[~endpoint_colors.index.duplicated(keep='last')].to_dict()
+
+    # 集成模式的边表带 frequency 列：边宽与出现频率成正比（0.5–4），否则统一为 2；
+    # 分级显示的片段边表直接给出 width 列
+    if 'width' in df.columns:
+        widths = df['width'].astype(float).to_numpy()
+    elif 'frequency' in df.columns:
+        widths = (0.5 + 3.5 * df['frequency'].astype(float)).to_numpy()
+    else:
+        widths = np.full(len(df), 2)
+
+    # 只绘制两端都在节点列表中的边
+    drawn = (df['source'].isin(list(node_map)) & df['target'].isin(list(node_map))).to_numpy()
     edges = pd.DataFrame({
-        'source': [src for src, _ in chord_data],
-        'target': [tgt for _, tgt in chord_data],
-        'color': edge_colors,
-        'value': edge_widths
+        'source': df['source'][drawn].map(node_map).to_numpy(dtype=np.int64),
+        'target': df['target'][drawn].map(node_map).to_numpy(dtype=np.int64),
+        'color': colors[drawn],
+        'value': widths[drawn]
+    })
+
+    node_names = list(node_map)
+    node_index = list(node_map.values())
+    nodes = pd.DataFrame({
+        'index': node_index,
+        'name': [name if name in connected_nodes else '' for name in node_names]
     })
-    nodes = pd.DataFrame(labels, columns=['index', 'name'])
     nodes['index'] = nodes['index'].astype(int)
     nodes = nodes.drop_duplicates(subset=['index']).sort_values('index').reset_index(drop=True)
-    nodes['color'] = [node_color_map.get(name, 'rgba(0,0,0,0.4)') for name, _ in labels]
+    # 节点颜色按节点下标在 node_color_map 中查找，未找到时为默认色（与原实现一致）
+    nodes['color'] = [node_color_map.get(i, 'rgba(0,0,0,0.4)') for i in node_index]
+    return edges, nodes
+
 
+def plot_circular_contact_map(edge_file, node_file=None, output_file=None, all_nodes=None, chain1=None, chain2=None,
+                              renderer='auto'):
+    """
+    绘制弦图。renderer='auto' 时 .png/.svg/.pdf 输出用 matplotlib（Agg，无需浏览器），
+    其余（HTML 或交互显示）用 HoloViews/Bokeh；renderer='bokeh' 时 PNG 仍走 export_png。
+    renderer='matplotlib' 只适用于 .png/.svg/.pdf 输出，HTML 输出或交互显示时报错不绘图。
+    """
+    static_output = bool(output_file) and output_file.lower().endswith(STATIC_SUFFIXES)
+    if renderer == 'matplotlib' and not static_output:
+        print(f"[✘] renderer='matplotlib' 只能输出 {'/'.join(STATIC_SUFFIXES)} 文件，"
+              f"HTML 或交互显示请用 auto/bokeh。")
+        return
+    chord_data = prepare_chord_data(edge_file, node_file, all_nodes, chain1, chain2)
+    if chord_data is None:
+        return
+    edges, nodes = chord_data
+    if len(edges) > LARGE_GRAPH_EDGES:
+        print(f"[i] 共 {len(edges)} 条边，图会很大；可用 --segments/--top-edges/--min-weight 分级显示。")
+    if static_output and renderer != 'bokeh':
+        render_chord_static(edges, nodes, output_file)
+        print(f"[✔] Saved circular ribbon contact map to {output_file}")
+        return
+
+    hv = load_plotting()
+    from holoviews import opts
     nodes = hv.Dataset(nodes, 'index', ['name', 'color'])
     chord = hv.Chord((edges, nodes))
     chord.opts(
@@ -269,6 +721,472 @@ def plot_circular_contact_map(edge_file, node_file=None, output_file=None, all_n
         show(render(chord, backend='bokeh'))
 
 
+def residue_segments(labels, window=None, max_gap=1):
+    """
+    把残基节点标签 Chain_RES3_Num 归并为片段（按链首次出现的顺序、再按残基编号排列）。
+
+    window 为 None 时按接触界面的连续片段归并：同一条链上编号相差不超过 max_gap 的残基连成一段；
+    window 为整数 N 时按固定窗口 (编号 - 1) // N 分段。片段名为 Chain_起始-终止，
+    无法解析的标签各自成段。
+
+    Returns:
+        DataFrame[residue, segment, chain, start, end]，每个残基一行
+    """
+    labels = pd.unique(pd.Series(list(labels), dtype=object))
+    parsed = pd.Series(labels, dtype=object).astype(str).str.extract(r'^(.+)_[^_]+_(-?\d+)$')
+    frame = pd.DataFrame({'residue': labels, 'chain': parsed[0].to_numpy(dtype=object),
+                          'num': pd.to_numeric(parsed[1]).to_numpy()})
+    parsable = frame['num'].notna().to_numpy()
+    frame.loc[~parsable, 'chain'] = frame.loc[~parsable, 'residue']
+    chain_order = {chain: i for i, chain in enumerate(pd.unique(frame['chain']))}
+    frame['chain_index'] = frame['chain'].map(chain_order)
+    frame = frame.sort_values(['chain_index', 'num'], kind='stable').reset_index(drop=True)
+
+    num = frame['num'].to_numpy(dtype=float)
+    if window is not None:
+        block = np.floor((num - 1) / window)
+        frame['start'] = block * window + 1
+        frame['end'] = frame['start'] + window - 1
+    else:
+        # 与链编号、相邻编号比较：换链、编号跳跃超过 max_gap 或不可解析时开始新片段
+        chain_index = frame['chain_index'].to_numpy()
+        new_run = np.ones(len(frame), dtype=bool)
+        new_run[1:] = (chain_index[1:] != chain_index[:-1]) | ~(num[1:] - num[:-1] <= max_gap)
+        run = np.cumsum(new_run)
+        frame['start'] = frame.groupby(run)['num'].transform('min')
+        frame['end'] = frame.groupby(run)['num'].transform('max')
+
+    frame['start'] = frame['start'].astype('Int64')
+    frame['end'] = frame['end'].astype('Int64')
+    frame['segment'] = (frame['chain'].astype(str) + '_' + frame['start'].astype(str) + '-'
+                        + frame['end'].astype(str)).where(frame['num'].notna(), frame['residue'])
+    return frame[['residue', 'segment', 'chain', 'start', 'end']]
+
+
+def bundle_segment_edges(df, segment_of):
+    """
+    把残基级边合并为片段间的边：权重为残基边权重之和（有 frequency 列时为频率，否则每条边记 1），
+    contacts 为合并的残基边数。按权重降序排列。
+    """
+    weight = df['frequency'].astype(float) if 'frequency' in df.columns else pd.Series(1.0, index=df.index)
+    edges = pd.DataFrame({
+        'source': df['source'].map(segment_of),
+        'target': df['target'].map(segment_of),
+        'weight': weight
+    })
+    bundled = edges.groupby(['source', 'target'], sort=False).agg(
+        weight=('weight', 'sum'), contacts=('weight', 'size')).reset_index()
+    return bundled.sort_values('weight', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def limit_edges(edges, top_edges=None, min_weight=None):
+    """只保留 weight >= min_weight 的边，再取权重最大的 top_edges 条（权重相同时保持原顺序）"""
+    if min_weight is not None:
+        edges = edges[edges['weight'] >= min_weight]
+    if top_edges:
+        edges = edges.sort_values('weight', ascending=False, kind='stable').head(top_edges)
+    return edges
+
+
+def plot_contact_map_lod(edge_file, output_file=None, segments='interface', top_edges=None, min_weight=None,
+                         drill_down=None, all_nodes=None, chain1=None, chain2=None, renderer='auto'):
+    """
+    大图的分级显示（level of detail）。
+
+    segments='interface' 时残基按接触界面的连续片段归并，为整数（或数字字符串）N 时按 N 个残基的固定窗口归并
+    （给定 all_nodes 时窗口覆盖整条链）；片段间的边合并为一条、权重相加（见 bundle_segment_edges），
+    边宽按权重缩放到 0.5–4。segments=None 时不归并，只按权重筛选残基级边。
+    min_weight/top_edges 限制保留的边。drill_down 给定片段名时只画与该片段内残基相连的残基级边。
+    给定 output_file 时另写出 {名称}_segments.csv 与 {名称}_segment_edges.csv。
+    """
+    df = read_edge_table(edge_file)
+    if df is None:
+        return
+    df = df.assign(weight=df['frequency'].astype(float) if 'frequency' in df.columns else 1.0)
+    endpoints = pd.unique(np.column_stack([df['source'].to_numpy(dtype=object),
+                                           df['target'].to_numpy(dtype=object)]).ravel())
+    try:
+        window = None if segments in (None, 'interface') else int(segments)
+    except (TypeError, ValueError):
+        window = 0
+    if window is not None and window <= 0:
+        print(f"[✘] 无效的 segments: {segments}（应为 'interface' 或正整数窗口大小）")
+        return
+    labels = endpoints
+    if window is not None and all_nodes is not None:
+        labels = list(all_nodes) + [n for n in endpoints if n not in set(all_nodes)]
+    seg = residue_segments(labels, window)
+    segment_of = dict(zip(seg['residue'], seg['segment']))
+    stem = os.path.splitext(output_file)[0] if output_file else None
+
+    if drill_down:
+        members = set(seg.loc[seg['segment'] == drill_down, 'residue'])
+        if not members:
+            print(f"[✘] 未找到片段 {drill_down}。可用片段（前 10 个）: {', '.join(pd.unique(seg['segment'])[:10])}")
+            return
+        detail = limit_edges(df[df['source'].isin(members) | df['target'].isin(members)], top_edges, min_weight)
+        print(f"[i] 片段 {drill_down}：{len(members)} 个残基，{len(detail)} 条残基级接触")
+        plot_circular_contact_map(detail, None, output_file, renderer=renderer)
+        return
+
+    if segments is None:
+        limited = limit_edges(df, top_edges, min_weight)
+        print(f"[i] 保留 {len(limited)}/{len(df)} 条边")
+        plot_circular_contact_map(limited, None, output_file, all_nodes=all_nodes, chain1=chain1, chain2=chain2,
+                                  renderer=renderer)
+        return
+
+    bundled = bundle_segment_edges(df, segment_of)
+    limited = limit_edges(bundled, top_edges, min_weight)
+    limited = limited.assign(width=0.5 + 3.5 * limited['weight'] / max(limited['weight'].max(), 1e-12))
+    print(f"[i] {len(endpoints)} 个残基归并为 {seg['segment'].nunique()} 个片段，"
+          f"{len(df)} 条边合并为 {len(bundled)} 条，保留 {len(limited)} 条")
+    if stem:
+        os.makedirs(os.path.dirname(stem) or '.', exist_ok=True)
+        summary = seg.groupby('segment', sort=False).agg(
+            chain=('chain', 'first'), start=('start', 'first'), end=('end', 'first'), residues=('residue', 'size')
+        ).reset_index()
+        summary.to_csv(f"{stem}_segments.csv", index=False)
+        bundled.to_csv(f"{stem}_segment_edges.csv", index=False)
+        print(f"[✔] 片段表: {stem}_segments.csv，片段间边表: {stem}_segment_edges.csv")
+    plot_circular_contact_map(limited, None, output_file, all_nodes=list(pd.unique(seg['segment'])),
+                              chain1=chain1, chain2=chain2, renderer=renderer)
+
+
+def chord_layout(edges, n_nodes):
+    """
+    与 HoloViews layout_chords 相同的环形布局（每条边权重为 1）：节点按下标顺序排在圆上，
+    每个节点的弧长与其连接的边数成正比（无接触的节点弧长为 0），边端点在节点弧段上依次取点。
+
+    Returns:
+        (bounds, source_angles, target_angles)：bounds 为 n_nodes+1 个弧段边界角（弧度），
+        source/target_angles 为每条边两端的角度
+    """
+    endpoints = np.column_stack([edges['source'].to_numpy(dtype=np.int64),
+                                 edges['target'].to_numpy(dtype=np.int64)]).ravel()
+    degree = np.bincount(endpoints, minlength=n_nodes).astype(float)
+    if degree.sum() == 0:
+        degree[:] = 1
+    bounds = np.zeros(n_nodes + 1)
+    bounds[1:] = np.cumsum(degree / degree.sum() * 2 * np.pi)
+
+    # 节点弧段上取 degree 个等距点，按边的顺序（先 source 后 target）从弧段末端往回取
+    used = pd.Series(endpoints).groupby(endpoints).cumcount().to_numpy()
+    n_points = degree[endpoints]
+    frac = (n_points - 1 - used) / np.maximum(n_points - 1, 1)
+    angles = bounds[endpoints] + (bounds[endpoints + 1] - bounds[endpoints]) * frac
+    return bounds, angles[0::2], angles[1::2]
+
+
+def _mpl_color(color):
+    """Bokeh 的 CSS 颜色（含 'rgba(r,g,b,a)'）转为 matplotlib 可用的颜色"""
+    m = re.fullmatch(r'rgba?\(([^)]*)\)', str(color).replace(' ', ''))
+    if not m:
+        return color
+    values = [float(v) for v in m.group(1).split(',')]
+    return tuple(v / 255 for v in values[:3]) + tuple(values[3:4])
+
+
+def render_chord_static(edges, nodes, output_file, size=6.0, dpi=100):
+    """
+    用 matplotlib（Agg，不需要浏览器）把弦图画成 PNG/SVG/PDF（按扩展名）。
+    节点顺序、颜色、边宽与 HoloViews 图相同：弦为控制点取两端点一半的三次贝塞尔曲线，
+    节点为弧段中点处的方块，标签位于 1.05 倍半径处。默认 6 英寸 × 100 dpi，与 HTML 图同为 600 像素。
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+
+    px = 72.0 / 96  # Bokeh 的像素宽度换算为 matplotlib 的点
+    bounds, a0, a1 = chord_layout(edges, len(nodes))
+
+    t = np.linspace(0, 1, CHORD_SAMPLES)[None, :]
+    w0 = (1 - t) ** 3 + 1.5 * (1 - t) ** 2 * t
+    w1 = 1.5 * (1 - t) * t ** 2 + t ** 3
+    chords = np.stack([w0 * np.cos(a0)[:, None] + w1 * np.cos(a1)[:, None],
+                       w0 * np.sin(a0)[:, None] + w1 * np.sin(a1)[:, None]], axis=-1)
+
+    node_colors = [_mpl_color(c) for c in nodes['color']]
+    arc = np.linspace(bounds[:-1, None], bounds[1:, None], 20, axis=1)[..., 0]
+    arcs = np.stack([np.cos(arc), np.sin(arc)], axis=-1)
+    mid = (bounds[:-1] + bounds[1:]) / 2
+
+    fig = Figure(figsize=(size, size), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(-1.4, 1.4)
+    ax.set_ylim(-1.4, 1.4)
+    ax.set_aspect('equal')
+    ax.axis('off')
+    ax.add_collection(LineCollection(arcs, colors=node_colors, linewidths=10 * px))
+    ax.add_collection(LineCollection(chords, colors=[_mpl_color(c) for c in edges['color']],
+                                     linewidths=edges['value'].to_numpy(dtype=float) * px))
+    ax.scatter(np.cos(mid), np.sin(mid), s=(15 * px) ** 2, marker='s', c=node_colors, linewidths=0, zorder=3)
+    for angle, name in zip(mid, nodes['name']):
+        if not name:
+            continue
+        degrees = np.degrees(angle) % 360
+        flip = 90 < degrees < 270  # 左半圈的标签翻转 180° 保持可读
+        ax.text(1.05 * np.cos(angle), 1.05 * np.sin(angle), name, fontsize=8,
+                rotation=degrees - 180 if flip else degrees, rotation_mode='anchor',
+                ha='right' if flip else 'left', va='center')
+    fig.savefig(output_file)
+
+
+def _render_job(edge_file, output_file, all_nodes=None, chain1=None, chain2=None):
+    """批量渲染的单个任务（在子进程中运行），返回 (output_file, 错误信息；成功时为空字符串)"""
+    try:
+        chord_data = prepare_chord_data(edge_file, None, all_nodes, chain1, chain2)
+        if chord_data is None:
+            return output_file, '边表为空或无法读取'
+        render_chord_static(*chord_data, output_file)
+    except Exception as e:
+        return output_file, str(e)
+    return output_file, ''
+
+
+def render_contact_maps(patterns, outdir='.', fmt='png', jobs=1, cif_file=None):
+    """
+    --render-batch 模式：把多个边表（文件、目录中的 *_edges.csv 或通配符）渲染为 PNG/SVG，
+    在 jobs 个子进程中用 matplotlib 绘制，不需要浏览器。输出为 {outdir}/{名称}_contact_map.{fmt}。
+    给定 cif_file 时，节点为结构中该边表两条链（由第一条边推断）的全部残基，与 --cif 单图模式一致；
+    否则节点为边表中出现的残基。
+
+    Returns:
+        [(输出文件, 错误信息), ...]
+    """
+    edge_files = expand_structure_inputs(patterns, suffixes=('_edges.csv',))
+    if not edge_files:
+        print("[✘] --render-batch 未匹配到任何边表文件。")
+        return []
+    os.makedirs(outdir, exist_ok=True)
+    table = load_atom_table(cif_file) if cif_file else None
+
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in edge_files]
+    stems = [stem[:-len('_edges')] if stem.endswith('_edges') else stem for stem in stems]
+    jobs_args = []
+    for path, stem in zip(edge_files, stems):
+        if stems.count(stem) > 1:
+            # 不同目录下的同名边表（如各 seed 的 A_B_edges.csv）以上级目录名区分
+            stem = f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}_{stem}"
+        all_nodes = chain1 = chain2 = None
+        if table is not None:
+            try:
+                first = pd.read_csv(path, nrows=1)
+                chain1 = str(first['source'].iloc[0]).split('_')[0]
+                chain2 = str(first['target'].iloc[0]).split('_')[0]
+                all_nodes = get_all_residue_labels(table, chain1, chain2)
+            except Exception:
+                all_nodes = chain1 = chain2 = None
+        jobs_args.append((path, os.path.join(outdir, f"{stem}_contact_map.{fmt}"), all_nodes, chain1, chain2))
+
+    if jobs > 1 and len(jobs_args) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_render_job, *zip(*jobs_args)))
+    else:
+        results = [_render_job(*job) for job in jobs_args]
+
+    failed = [(output, error) for output, error in results if error]
+    print(f"[✔] 已渲染 {len(results) - len(failed)}/{len(results)} 张接触图到 {outdir}")
+    for output, error in failed:
+        print(f"[✘] {output}: {error}")
+    return results
+
+
+def run_all_pairs(cif_file, cutoff=5.0, outdir='.', save_matrix=False):
+    """
+    --all-pairs 模式：为每个有接触的链对写出 {chain1}_{chain2}_contacts.csv 与 {chain1}_{chain2}_edges.csv
+    （格式同双链模式），并写出链 × 链接触数矩阵 chain_pair_summary.csv。
+    cif_file 也可为已算好的 ContactMatrix（--matrix），此时只按 cutoff 筛选；
+    save_matrix 时另写出残基接触矩阵 contact_matrix.npz 与 contact_matrix.csv。
+    """
+    os.makedirs(outdir, exist_ok=True)
+    if isinstance(cif_file, ContactMatrix):
+        chains, matrix = list(dict.fromkeys(cif_file.res_chain)), cif_file.select(cutoff=cutoff)
+    else:
+        chains, matrix = all_chain_contact_matrix(cif_file, cutoff)
+    pair_contacts = split_chain_pairs(chains, matrix)
+    if save_matrix:
+        save_contact_matrix(matrix, os.path.join(outdir, "contact_matrix"))
+    for (chain1, chain2), (contacts, contacts_detail) in pair_contacts.items():
+        write_contacts_csv(os.path.join(outdir, f"{chain1}_{chain2}_contacts.csv"), contacts_detail)
+        write_edges_csv(os.path.join(outdir, f"{chain1}_{chain2}_edges.csv"), contacts)
+    summary_csv = os.path.join(outdir, "chain_pair_summary.csv")
+    chain_pair_summary(chains, pair_contacts).to_csv(summary_csv)
+
+    print(f"[✔] {len(chains)} 条链，{len(pair_contacts)} 个链对有接触（cutoff {cutoff} Å），结果写入 {outdir}")
+    ranked = sorted(pair_contacts.items(), key=lambda item: -len(item[1][0]))
+    for (chain1, chain2), (contacts, _) in ranked[:10]:
+        print(f"    {chain1}-{chain2}: {len(contacts)} 个残基接触")
+    print(f"[✔] 链对接触数矩阵: {summary_csv}")
+    return pair_contacts
+
+
+def save_contact_matrix(matrix, base_path):
+    """写出 {base_path}.npz（可用 --matrix 读回）与 {base_path}.csv"""
+    matrix.to_npz(base_path + ".npz")
+    matrix.to_csv(base_path + ".csv")
+    print(f"[✔] 残基接触矩阵（{len(matrix)} 个残基对，cutoff {matrix.cutoff} Å）: {base_path}.npz / {base_path}.csv")
+
+
+STRUCTURE_SUFFIXES = ('.cif', '.mmcif', '.pdb', '.ent')
+
+
+def expand_structure_inputs(patterns, suffixes=STRUCTURE_SUFFIXES):
+    """将文件、目录与通配符展开为文件列表（去重，保持给定顺序；目录内取以 suffixes 结尾的文件并按文件名排序）"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+                if name.lower().endswith(suffixes)
+            )
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _model_contacts(path, chain1=None, chain2=None, cutoff=5.0):
+    """
+    集成模式的单文件任务（在子进程中运行）：文件中的每个模型各算一次接触。
+    给定 chain1/chain2 时只算该链对，否则算全部链对。
+
+    Returns:
+        [(模型名, 接触 DataFrame[chain1, chain2, source, target, distance]), ...]，或出错时的错误信息
+    """
+    try:
+        tables = load_atom_table(path).models()
+    except Exception as e:
+        return path, str(e)
+    results = []
+    for model_index, table in enumerate(tables, start=1):
+        if chain1 and chain2:
+            pair_contacts = {(chain1, chain2): extract_contacts_from_cif(table, chain1, chain2, cutoff)}
+        else:
+            pair_contacts = all_chain_pair_contacts(table, cutoff)[1]
+        rows = [
+            (c1, c2, source, target, detail['distance'])
+            for (c1, c2), (contacts, contacts_detail) in pair_contacts.items()
+            for (source, target), detail in zip(contacts, contacts_detail)
+        ]
+        name = f"{path}#{model_index}" if len(tables) > 1 else path
+        results.append((name, pd.DataFrame(rows, columns=['chain1', 'chain2', 'source', 'target', 'distance'])))
+    return path, results
+
+
+def ensemble_contact_frequencies(paths, chain1=None, chain2=None, cutoff=5.0, jobs=1):
+    """
+    多个预测模型（AF3 不同 seed、设计变体、多模型 CIF 的各个模型）的接触频率。
+
+    每个文件在 jobs 个子进程中用向量化路径提取接触，残基对出现次数累加为稀疏（COO）频率表。
+
+    Returns:
+        (edges_df, models_df)：edges_df 每个残基对一行，列为 source/target/chain1/chain2/count/
+        frequency（出现的模型比例）/mean_distance/min_distance，按 frequency 降序；
+        models_df 每个模型一行，列为 model/file/contacts/error
+    """
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            outcomes = list(pool.map(_model_contacts, paths, [chain1] * len(paths), [chain2] * len(paths),
+                                     [cutoff] * len(paths)))
+    else:
+        outcomes = [_model_contacts(path, chain1, chain2, cutoff) for path in paths]
+
+    frames = []
+    models = []
+    for path, result in outcomes:
+        if isinstance(result, str):
+            models.append({'model': path, 'file': path, 'contacts': 0, 'error': result})
+            continue
+        for name, frame in result:
+            models.append({'model': name, 'file': path, 'contacts': len(frame), 'error': ''})
+            frames.append(frame)
+    models_df = pd.DataFrame(models, columns=['model', 'file', 'contacts', 'error'])
+    n_models = len(frames)
+
+    columns = ['source', 'target', 'chain1', 'chain2', 'count', 'frequency', 'mean_distance', 'min_distance']
+    contacts = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if contacts.empty:
+        return pd.DataFrame(columns=columns), models_df
+    contacts['distance'] = contacts['distance'].astype(float)
+    edges = contacts.groupby(['source', 'target', 'chain1', 'chain2'], sort=False).agg(
+        count=('distance', 'size'), mean_distance=('distance', 'mean'), min_distance=('distance', 'min')
+    ).reset_index()
+    edges['frequency'] = (edges['count'] / n_models).round(4)
+    edges['mean_distance'] = edges['mean_distance'].round(3)
+    edges['min_distance'] = edges['min_distance'].round(3)
+    edges = edges.sort_values('frequency', ascending=False, kind='stable').reset_index(drop=True)
+    return edges[columns], models_df
+
+
+def run_ensemble(patterns, chain1=None, chain2=None, cutoff=5.0, jobs=1, outdir='.', min_frequency=0.0,
+                 output_file=None, renderer='auto'):
+    """
+    --ensemble 模式：写出频率加权边表 ensemble_{chain1}_{chain2}_edges.csv（未指定链对时为
+    ensemble_edges.csv，只保留 frequency >= min_frequency 的残基对）与 ensemble_models.csv；
+    给定 output_file 时按频率设置边宽绘图。
+    """
+    paths = expand_structure_inputs(patterns)
+    if not paths:
+        print("[✘] --ensemble 未匹配到任何结构文件（.cif/.mmcif/.pdb/.ent）。")
+        return None
+    os.makedirs(outdir, exist_ok=True)
+    edges, models_df = ensemble_contact_frequencies(paths, chain1, chain2, cutoff, jobs)
+    edges = edges[edges['frequency'] >= min_frequency]
+
+    tag = f"{chain1}_{chain2}_" if chain1 and chain2 else ""
+    edge_file = os.path.join(outdir, f"ensemble_{tag}edges.csv")
+    edges.to_csv(edge_file, index=False)
+    models_df.to_csv(os.path.join(outdir, "ensemble_models.csv"), index=False)
+
+    failed = models_df[models_df['error'] != '']
+    print(f"[✔] {len(models_df) - len(failed)} 个模型（{len(paths)} 个文件），{len(edges)} 个残基对，结果: {edge_file}")
+    for _, row in failed.iterrows():
+        print(f"[✘] {row['model']}: {row['error']}")
+    if len(edges):
+        print(edges.head(10).to_string(index=False))
+
+    if output_file:
+        all_nodes = None
+        ok_files = models_df.loc[models_df['error'] == '', 'file']
+        if chain1 and chain2 and len(ok_files):
+            # 以第一个模型的残基为节点；设计变体中残基名不同的节点补在后面
+            all_nodes = get_all_residue_labels(ok_files.iloc[0], chain1, chain2)
+            known = set(all_nodes)
+            all_nodes += [n for n in pd.unique(edges[['source', 'target']].to_numpy().ravel()) if n not in known]
+        plot_circular_contact_map(edge_file, None, output_file, all_nodes=all_nodes, chain1=chain1, chain2=chain2,
+                                  renderer=renderer)
+    return edges
+
+
+def _plot_edges(args, edge_file, all_nodes=None, chain1=None, chain2=None):
+    """按命令行参数绘图：给定 --segments/--drill-down/--top-edges/--min-weight 时用分级显示"""
+    if args.segments or args.drill_down or args.top_edges or args.min_weight is not None:
+        plot_contact_map_lod(edge_file, args.output, args.segments, args.top_edges, args.min_weight,
+                             args.drill_down, all_nodes, chain1, chain2, args.renderer)
+    else:
+        plot_circular_contact_map(edge_file, args.nodes, args.output, all_nodes=all_nodes, chain1=chain1,
+                                  chain2=chain2, renderer=args.renderer)
+
+
+def segment_mode(value):
+    """--segments 的参数类型：'interface' 或正整数窗口大小"""
+    if value == 'interface':
+        return value
+    try:
+        window = int(value)
+    except ValueError:
+        window = 0
+    if window <= 0:
+        raise argparse.ArgumentTypeError(f"expected 'interface' or a positive window size, got {value!r}")
+    return window
+
+
 def main():
     parser = argparse.ArgumentParser(description="Plot a circular ribbon contact map from a Cytoscape-style edges.csv file or extract sequence/contact info from mmCIF.")
     parser.add_argument('edge_file', type=str, nargs='?', default=None, help='Input edges.csv file (with columns source,target)')
@@ -278,33 +1196,107 @@ def main():
     parser.add_argument('--chain1', type=str, default=None, help='First chain ID in CIF')
     parser.add_argument('--chain2', type=str, default=None, help='Second chain ID in CIF')
     parser.add_argument('--cutoff', type=float, default=5.0, help='Distance cutoff (Å) for contact extraction')
+    parser.add_argument('--all-pairs', action='store_true',
+                        help='With --cif: extract contacts for every inter-chain pair in one neighbor search')
+    parser.add_argument('--outdir', type=str, default='.',
+                        help='Output directory for --all-pairs/--ensemble CSV files and --render-batch images '
+                             '(default: current directory)')
+    parser.add_argument('--ensemble', type=str, nargs='+', default=None, metavar='PATH',
+                        help='Model files, directories or glob patterns (multi-model CIFs count each model): '
+                             'write a contact-frequency edge list over all models')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes for --ensemble/--render-batch (default: 1)')
+    parser.add_argument('--min-frequency', type=float, default=0.0,
+                        help='With --ensemble: only keep residue pairs found in at least this fraction of models')
+    parser.add_argument('--save-matrix', action='store_true',
+                        help='With --cif: also write the residue contact matrix (minimum distance, atom contact count, '
+                             'closest atoms) as {chain1}_{chain2}_contact_matrix.npz/.csv, or contact_matrix.npz/.csv '
+                             'in --outdir with --all-pairs')
+    parser.add_argument('--matrix', type=str, default=None,
+                        help='Contact matrix .npz from --save-matrix: reuse it instead of a structure at any --cutoff '
+                             'up to its extraction cutoff (with --chain1/--chain2 for one pair, otherwise all pairs)')
+    parser.add_argument('--renderer', choices=['auto', 'bokeh', 'matplotlib'], default='auto',
+                        help='Plot backend: auto uses matplotlib (no browser) for .png/.svg/.pdf output and '
+                             'Bokeh for HTML; bokeh exports PNG through a headless browser; matplotlib only '
+                             'applies to .png/.svg/.pdf --output (default: auto)')
+    parser.add_argument('--render-batch', type=str, nargs='+', default=None, metavar='PATH',
+                        help='Edge files, directories (*_edges.csv) or glob patterns: render each to '
+                             '{outdir}/{name}_contact_map.{format} with matplotlib in --jobs processes')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png',
+                        help='Image format for --render-batch (default: png)')
+    parser.add_argument('--extract-only', action='store_true',
+                        help='Only write the sequence/contact/edge files; skip plotting (plotting libraries are not imported)')
+    parser.add_argument('--segments', type=segment_mode, default=None, metavar='MODE',
+                        help="Large-graph mode: merge residues into segments, 'interface' (contiguous contact "
+                             "stretches) or a window size such as 20, and bundle edges between segments")
+    parser.add_argument('--top-edges', type=int, default=None,
+                        help='Only draw the N heaviest edges (bundled edges with --segments)')
+    parser.add_argument('--min-weight', type=float, default=None,
+                        help='Only draw edges with at least this weight (summed frequency, or residue contact '
+                             'count, of the bundled edges with --segments)')
+    parser.add_argument('--drill-down', type=str, default=None, metavar='SEGMENT',
+                        help='Draw the residue-level contacts of one segment (name as in *_segments.csv, e.g. A_45-52)')
     args = parser.parse_args()
+    if (args.renderer == 'matplotlib' and not (args.output or '').lower().endswith(STATIC_SUFFIXES)
+            and not (args.render_batch or args.extract_only or args.all_pairs)):
+        parser.error(f"--renderer matplotlib needs a {'/'.join(STATIC_SUFFIXES)} --output")
+
+    if args.render_batch:
+        render_contact_maps(args.render_batch, args.outdir, args.format, max(1, args.jobs), args.cif)
+        return
+    if args.ensemble:
+        run_ensemble(args.ensemble, args.chain1, args.chain2, args.cutoff, max(1, args.jobs), args.outdir,
+                     args.min_frequency, None if args.extract_only else args.output, args.renderer)
+        return
+    matrix = None
+    if args.matrix:
+        try:
+            matrix = ContactMatrix.from_npz(args.matrix).select(cutoff=args.cutoff)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"[✘] 无法使用接触矩阵 {args.matrix}: {e}")
+            return
+        if not (args.chain1 and args.chain2) or args.all_pairs:
+            run_all_pairs(matrix, args.cutoff, args.outdir)
+            return
+    if args.cif and args.all_pairs:
+        run_all_pairs(args.cif, args.cutoff, args.outdir, args.save_matrix)
+        return
 
-    if args.cif and args.chain1 and args.chain2:
-        seq1, _ = extract_chain_sequence(args.cif, args.chain1)
-        seq2, _ = extract_chain_sequence(args.cif, args.chain2)
-        with open(f"{args.chain1}_sequence.fasta", "w") as f:
-            f.write(f">{args.chain1}\n{seq1}\n")
-        with open(f"{args.chain2}_sequence.fasta", "w") as f:
-            f.write(f">{args.chain2}\n{seq2}\n")
-        contacts, contacts_detail = extract_contacts_from_cif(args.cif, args.chain1, args.chain2, args.cutoff)
-        contacts_csv = f"{args.chain1}_{args.chain2}_contacts.csv"
-        with open(contacts_csv, "w", newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['chain1','res1_num','res1_name','chain2','res2_num','res2_name','distance'])
-            writer.writeheader()
-            for row in contacts_detail:
-                writer.writerow(row)
+    if (args.cif or matrix is not None) and args.chain1 and args.chain2:
+        if matrix is not None:
+            # 由已保存的接触矩阵按新的 cutoff 筛选，不再解析结构
+            pair_matrix = matrix.select(args.chain1, args.chain2)
+            all_nodes = matrix.chain_labels(args.chain1, args.chain2)
+        else:
+            # 结构只解析一次，序列、接触与节点标签都由同一张原子表派生
+            table = load_atom_table(args.cif)
+            seq1, _ = extract_chain_sequence(table, args.chain1)
+            seq2, _ = extract_chain_sequence(table, args.chain2)
+            with open(f"{args.chain1}_sequence.fasta", "w") as f:
+                f.write(f">{args.chain1}\n{seq1}\n")
+            with open(f"{args.chain2}_sequence.fasta", "w") as f:
+                f.write(f">{args.chain2}\n{seq2}\n")
+            pair_matrix = chain_pair_contact_matrix(table, args.chain1, args.chain2, args.cutoff)
+            all_nodes = get_all_residue_labels(table, args.chain1, args.chain2)
+            if args.save_matrix:
+                save_contact_matrix(pair_matrix, f"{args.chain1}_{args.chain2}_contact_matrix")
+        contacts, contacts_detail = pair_matrix.to_contacts()
+        write_contacts_csv(f"{args.chain1}_{args.chain2}_contacts.csv", contacts_detail)
         if args.edge_file is None:
             edge_file = f"{args.chain1}_{args.chain2}_edges.csv"
-            pd.DataFrame(contacts, columns=['source','target']).drop_duplicates().to_csv(edge_file, index=False)
+            write_edges_csv(edge_file, contacts)
             args.edge_file = edge_file
+        if args.extract_only:
+            print(f"[✔] 已写出序列与接触文件（{len(contacts)} 个残基对），--extract-only 跳过绘图。")
+            return
 
-        all_nodes = get_all_residue_labels(args.cif, args.chain1, args.chain2)
-        plot_circular_contact_map(args.edge_file, args.nodes, args.output, all_nodes=all_nodes, chain1=args.chain1, chain2=args.chain2)
+        _plot_edges(args, args.edge_file, all_nodes, args.chain1, args.chain2)
         return
 
-    if args.edge_file:
-        plot_circular_contact_map(args.edge_file, args.nodes, args.output)
+    if args.edge_file and args.extract_only:
+        print("[!] --extract-only 需要配合 --cif/--chain1/--chain2 或 --ensemble 使用，未进行绘图。")
+    elif args.edge_file:
+        _plot_edges(args, args.edge_file)
     else:
         print("[!] 未指定edge_file，未进行绘图。仅提取了序列和互作信息。")
 
@@ -17,21 +17,32 @@ Date: 2025
 
 import os
 import sys
+import time
+import bisect
 import argparse
 import logging
 import json
+import io
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import Dict, List, Optional, Union
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 from enum import Enum
 
+import numpy as np
 import pandas as pd
 
+from netmhcii_table import (
+    OUTPUT_FORMATS, PARSER_VERSION, MISSING_POSITION, NetMHCIITable, ParsedTableCache, is_excel_file,
+    is_wide_table, load_netmhcii_table, read_result_table, write_result_table
+)
+
 
 class ImmunogenicityMode(Enum):
     """Enumeration for immunogenicity modulation modes."""
     REDUCE = "reduce"
     ENHANCE = "enhance"
+    BOTH = "both"  # reduce and enhance selections from a single parse
 
 
 @dataclass
@@ -45,34 +56,199 @@ class AnalysisConfig:
     # Output parameters
     output_dir: str = "results"
     log_level: str = "INFO"
+    output_format: str = "csv"  # csv, csv.gz, parquet, feather or npz (see netmhcii_table.OUTPUT_FORMATS)
     
     # Epitope selection parameters
     epitopes_number: int = 10
     epitope_length: int = 15  # Target epitope length (9-15 aa), extend from core if needed
     
+    # Overlap control: extended windows of selected cores must be at least
+    # min_spacing residues apart unless allow_overlap is set
+    min_spacing: int = 0
+    allow_overlap: bool = False
+    
+    # Per-sequence mode: analyze each NetMHCIIpan ID against its own FASTA record,
+    # using up to jobs worker processes
+    per_sequence: bool = False
+    jobs: int = 1
+    
+    # Directory for the persisted per-core binding state (see run_incremental)
+    state_dir: Optional[str] = None
+    
+    # Parsed-table cache parameters (cache disabled when cache_dir is None)
+    cache_dir: Optional[str] = None
+    cache_max_mb: float = 1024.0
+    
     def __post_init__(self):
         """Initialize default values after object creation."""
         pass
 
 
+# Compact dtypes of the parsed long table: repeated strings become categoricals,
+# positions int32 and scores float32 (roughly 5-10x smaller than object/float64)
+EPITOPE_CATEGORY_COLUMNS = ['sequence', 'core', 'allele', 'seq_id', 'method']
+EPITOPE_POSITION_COLUMNS = ['start', 'end']
+EPITOPE_SCORE_COLUMNS = ['score', 'rank_el', 'rank', 'ic50', 'raw_score']
+
+
+def _compact_epitope_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a parsed epitope table to its compact dtype representation."""
+    if df.empty:
+        return df
+    for col in EPITOPE_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in EPITOPE_POSITION_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.int32)
+    for col in EPITOPE_SCORE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float32)
+    return df
+
+
+def _sorted_categorical(values: pd.Series, rows: np.ndarray) -> pd.Categorical:
+    """Categorical of values[rows] with sorted categories, as astype('category') builds it."""
+    codes, uniques = pd.factorize(values, sort=True)
+    return pd.Categorical.from_codes(codes[rows], uniques).remove_unused_categories()
+
+
+def _epitope_frame_from_table(table: NetMHCIITable) -> pd.DataFrame:
+    """
+    Long epitope table (one row per peptide and allele) from a canonical NetMHCIIpan table.
+    
+    Rows come out peptide-major in file order; a peptide/allele pair is kept only when
+    the row has an integer position and all five numeric fields parse. Missing cores
+    fall back to the peptide.
+    """
+    if table.n_rows == 0 or table.n_alleles == 0:
+        return pd.DataFrame()
+    
+    keep = (table.positions != MISSING_POSITION)[:, None]
+    for name in ('Score', 'Rank', 'Score_BA', 'nM', 'Rank_BA'):
+        keep = keep & ~np.isnan(table.field(name))
+    rows, cols = np.nonzero(keep)
+    if rows.size == 0:
+        return pd.DataFrame()
+    
+    n = table.n_rows
+    peptides = table.peptides.fillna('') if table.peptides is not None else pd.Series([''] * n, dtype=str)
+    ids = table.ids.fillna('') if table.ids is not None else pd.Series(['Sequence'] * n, dtype=str)
+    peptide_codes, peptide_uniques = pd.factorize(peptides)
+    peptide_lengths = np.array([len(p) for p in peptide_uniques], dtype=np.int32)[peptide_codes]
+    
+    core_codes = table.core_codes[rows, cols] if table.core_codes is not None else np.full(rows.size, -1)
+    cores = np.asarray(peptide_uniques, dtype=object)[peptide_codes[rows]]
+    has_core = core_codes >= 0
+    cores[has_core] = table.core_categories[core_codes[has_core]]
+    
+    start = table.positions[rows]
+    df = pd.DataFrame({
+        'sequence': _sorted_categorical(peptides, rows),
+        'core': pd.Categorical(cores),
+        'start': start,
+        'end': start + peptide_lengths[rows] - 1,
+        'score': table.field('Score')[rows, cols],
+        'rank_el': table.field('Rank')[rows, cols],  # Rank is %Rank_EL
+        'rank': table.field('Rank_BA')[rows, cols],  # Rank_BA is BA_Rank
+        'ic50': table.field('nM')[rows, cols],
+        'raw_score': table.field('Score_BA')[rows, cols],
+        'allele': pd.Categorical(np.asarray(table.alleles, dtype=object)[cols]),
+        'seq_id': _sorted_categorical(ids, rows),
+        'method': pd.Categorical.from_codes(np.zeros(rows.size, dtype=np.int8), ['NetMHCIIpan-4.3'])
+    })
+    return _compact_epitope_frame(df)
+
+
+class IntervalIndex:
+    """
+    Sorted set of disjoint residue intervals with O(log n) overlap queries.
+    
+    Intervals are closed and 1-based. Two intervals conflict when fewer than
+    min_spacing residues separate them, so min_spacing=0 only rejects true overlaps.
+    """
+    
+    def __init__(self, min_spacing: int = 0):
+        self.min_spacing = max(0, int(min_spacing))
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+    
+    def __len__(self) -> int:
+        return len(self._starts)
+    
+    def overlaps(self, start: int, end: int) -> bool:
+        """Return True if [start, end] conflicts with any stored interval."""
+        lo = start - self.min_spacing
+        hi = end + self.min_spacing
+        # Stored intervals are disjoint, so ends are sorted like starts and only the
+        # last interval starting at or before hi can reach back to lo
+        i = bisect.bisect_right(self._starts, hi)
+        return i > 0 and self._ends[i - 1] >= lo
+    
+    def add(self, start: int, end: int) -> None:
+        """Insert [start, end]; the caller must check overlaps() first."""
+        i = bisect.bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
 class EpitopeAnalyzer:
     """Main class for epitope analysis."""
     
-    def __init__(self, config: AnalysisConfig):
-        """Initialize the analyzer with configuration."""
+    def __init__(self, config: AnalysisConfig, log_mode: str = "global"):
+        """
+        Initialize the analyzer with configuration.
+        
+        Args:
+            config: Analysis configuration
+            log_mode: "global" configures the root logger (CLI default);
+                "job" logs only to a per-job file in output_dir, leaving global
+                logging untouched (used by batch mode);
+                "none" installs no handlers and writes no log file, leaving
+                logging to the host application (used by the in-memory API)
+        """
         self.config = config
+        self.log_mode = log_mode
         self.logger = self._setup_logging()
+        # Protein sequence, read from the FASTA once or supplied in memory
+        self._sequence: Optional[str] = None
+        # Per-core binding counts and selected cores (per selection mode) of the
+        # last filtering step
+        self.core_counts_df: Optional[pd.DataFrame] = None
+        self.selected_cores: Dict[str, List[str]] = {}
         
     def _setup_logging(self) -> logging.Logger:
         """Set up logging configuration."""
+        if self.log_mode == "none":
+            return logging.getLogger(__name__)
+        
         # Create output directory if it doesn't exist
         os.makedirs(self.config.output_dir, exist_ok=True)
         
         # Configure logging
         log_file = os.path.join(self.config.output_dir, "epitope_analysis.log")
+        level = getattr(logging, self.config.log_level.upper())
+        
+        if self.log_mode == "job":
+            # Dedicated logger per output directory so concurrent jobs in one
+            # worker process never share handlers
+            logger = logging.getLogger(f"{__name__}.job.{os.path.abspath(self.config.output_dir)}")
+            logger.setLevel(level)
+            logger.propagate = False
+            for handler in list(logger.handlers):
+                handler.close()
+                logger.removeHandler(handler)
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            logger.addHandler(handler)
+            return logger
+        
         logging.basicConfig(
-            level=getattr(logging, self.config.log_level.upper()),
-            format='%(asctime)s - %(levelname)s - %(message)s',
+            level=level,
+            format=LOG_FORMAT,
             handlers=[
                 logging.FileHandler(log_file),
                 logging.StreamHandler(sys.stdout)
@@ -81,6 +257,13 @@ class EpitopeAnalyzer:
         
         return logging.getLogger(__name__)
     
+    def close(self) -> None:
+        """Release per-job log handlers (no-op for global logging)."""
+        if self.log_mode != "global":
+            for handler in list(self.logger.handlers):
+                handler.close()
+                self.logger.removeHandler(handler)
+    
     def _validate_inputs(self) -> None:
         """Validate input files and parameters."""
         self.logger.info("Validating input parameters...")
@@ -97,14 +280,17 @@ class EpitopeAnalyzer:
         if not self.config.fasta_path.lower().endswith(('.fasta', '.fa')):
             raise ValueError(f"Invalid FASTA file extension: {self.config.fasta_path}")
         
-        # Validate mode
+        self._validate_mode()
+        
+        self.logger.info("Input validation completed successfully")
+    
+    def _validate_mode(self) -> None:
+        """Coerce a string mode to ImmunogenicityMode."""
         if not isinstance(self.config.mode, ImmunogenicityMode):
             if isinstance(self.config.mode, str):
                 self.config.mode = ImmunogenicityMode(self.config.mode.lower())
             else:
                 raise ValueError(f"Invalid mode: {self.config.mode}")
-        
-        self.logger.info("Input validation completed successfully")
     
     def _save_config(self) -> None:
         """Save configuration to file for reproducibility."""
@@ -118,128 +304,82 @@ class EpitopeAnalyzer:
         
         self.logger.info(f"Configuration saved to {config_file}")
     
+    def _load_netmhcii_table(self, output_file: str) -> pd.DataFrame:
+        """
+        Load the parsed NetMHCIIpan table, using the parsed-table cache when enabled.
+        
+        Wide tables are cached in their canonical form (shared with run_ic50_sum.py),
+        standard-format tables as the parsed epitope frame. On a cache hit the file
+        is not parsed at all.
+        """
+        if not self.config.cache_dir:
+            return self._parse_netmhcii_output(output_file)
+        
+        cache = ParsedTableCache(
+            self.config.cache_dir,
+            int(self.config.cache_max_mb * 1024 * 1024),
+            self.logger
+        )
+        if self._is_wide_file(output_file):
+            table = load_netmhcii_table(output_file, cache=cache)
+            self.logger.info(f"Wide-table format with {table.n_alleles} HLA alleles")
+            return _epitope_frame_from_table(table)
+        
+        key = cache.key_for(output_file)
+        epitope_df = cache.load(key)
+        if epitope_df is not None:
+            self.logger.info(f"Loaded parsed table from cache (key {key})")
+            return epitope_df
+        
+        epitope_df = self._parse_netmhcii_output(output_file)
+        if not epitope_df.empty:
+            cache.store(key, epitope_df)
+        return epitope_df
+    
+    @staticmethod
+    def _is_wide_file(output_file: str) -> bool:
+        """Detect the wide-table format from the first two lines of a file."""
+        if is_excel_file(output_file):
+            return True
+        with open(output_file, 'r') as f:
+            head = [f.readline(), f.readline()]
+        return is_wide_table(head)
+    
     def _parse_netmhcii_output(self, output_file: str) -> pd.DataFrame:
         """
         Parse NetMHCIIpan output file.
         
         Supports multiple formats:
         1. Standard format: Pos Peptide ID Allele Core %Rank_EL BA_Rank BA_IC50 BA_Raw Score
-        2. Wide-table format: multiple HLA alleles in columns (Core, Inverted, Score, Rank, Score_BA, nM, Rank_BA)
+        2. Wide-table format: multiple HLA alleles in columns (Core, Inverted, Score, Rank, Score_BA, nM, Rank_BA),
+           parsed by the shared netmhcii_table module
         """
-        epitopes = []
-        
         try:
+            if self._is_wide_file(output_file):
+                table = load_netmhcii_table(output_file)
+                self.logger.info(f"Detected wide-table format with {table.n_alleles} HLA alleles")
+                return _epitope_frame_from_table(table)
             with open(output_file, 'r') as f:
                 lines = f.readlines()
-            
-            # Detect format by checking if file has HLA allele names in header
-            is_wide_format = False
-            hla_alleles = []
-            header_line = ""
-            
-            for i, line in enumerate(lines[:3]):
-                if 'HLA-' in line.upper() or 'DRB1_' in line.upper():
-                    is_wide_format = True
-                    header_line = line.strip()
-                    # Extract HLA allele names from header
-                    parts = line.split('\t')
-                    for part in parts:
-                        if 'HLA-' in part.upper() or 'DRB1_' in part.upper():
-                            hla_alleles.append(part.strip())
-                    break
-            
-            if is_wide_format:
-                self.logger.info(f"Detected wide-table format with {len(hla_alleles)} HLA alleles")
-                return self._parse_wide_table_format(lines, hla_alleles)
-            else:
-                self.logger.info("Detected standard tabular format")
-                return self._parse_standard_format(lines)
-        
+            self.logger.info("Detected standard tabular format")
+            return self._parse_standard_format(lines)
         except Exception as e:
             self.logger.error(f"Failed to parse NetMHCIIpan output: {e}")
             raise
     
-    def _parse_wide_table_format(self, lines: List[str], hla_alleles: List[str]) -> pd.DataFrame:
-        """
-        Parse wide-table format where each HLA has columns: Core, Inverted, Score, Rank, Score_BA, nM, Rank_BA
-        
-        Format example:
-        Pos  Peptide  ID  Target  Core  Inverted  Score  Rank  Score_BA  nM  Rank_BA  [Core  Inverted  Score  Rank  Score_BA  nM  Rank_BA ...]
-        """
-        epitopes = []
-        
-        # Find header line (line 2, 0-indexed line 1)
-        header_line = lines[1].strip()
-        header_parts = header_line.split('\t')
-        
-        # Find the data start line (usually line 2 or 3)
-        data_start_idx = 2
-        while data_start_idx < len(lines) and (lines[data_start_idx].strip().startswith('#') or not lines[data_start_idx].strip()):
-            data_start_idx += 1
-        
-        self.logger.info(f"Parsing wide-table format, data starts at line {data_start_idx + 1}")
-        
-        # Parse each data line
-        for line_idx in range(data_start_idx, len(lines)):
-            line = lines[line_idx].strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            parts = line.split('\t')
-            if len(parts) < 5:
-                continue
-            
-            try:
-                # Parse position, peptide, ID from first 3 columns
-                pos = int(parts[0])
-                peptide = parts[1]
-                seq_id = parts[2] if len(parts) > 2 else "Sequence"
-                
-                # For wide format: Target column, then alternating HLA columns
-                # Each HLA has: Core, Inverted, Score, Rank, Score_BA, nM, Rank_BA (7 columns)
-                cols_per_allele = 7
-                data_start_col = 4  # After Pos, Peptide, ID, Target
-                
-                # Process each HLA allele
-                for i, allele in enumerate(hla_alleles):
-                    allele_start_col = data_start_col + (i * cols_per_allele)
-                    
-                    if allele_start_col + 6 < len(parts):
-                        try:
-                            core = parts[allele_start_col]
-                            inverted = parts[allele_start_col + 1] if len(parts) > allele_start_col + 1 else "0"
-                            score = float(parts[allele_start_col + 2]) if len(parts) > allele_start_col + 2 else None
-                            rank = float(parts[allele_start_col + 3]) if len(parts) > allele_start_col + 3 else None
-                            score_ba = float(parts[allele_start_col + 4]) if len(parts) > allele_start_col + 4 else None
-                            nm = float(parts[allele_start_col + 5]) if len(parts) > allele_start_col + 5 else None
-                            rank_ba = float(parts[allele_start_col + 6]) if len(parts) > allele_start_col + 6 else None
-                            
-                            # Calculate position information
-                            start_pos = pos
-                            end_pos = start_pos + len(peptide) - 1
-                            
-                            epitopes.append({
-                                'sequence': peptide,
-                                'core': core if core and core != 'NA' else peptide,
-                                'start': start_pos,
-                                'end': end_pos,
-                                'score': score if score is not None else 0.0,
-                                'rank_el': rank,  # Rank is %Rank_EL
-                                'rank': rank_ba,  # Rank_BA is BA_Rank
-                                'ic50': nm,
-                                'raw_score': score_ba,
-                                'allele': allele,
-                                'seq_id': seq_id,
-                                'method': 'NetMHCIIpan-4.3'
-                            })
-                        except (ValueError, IndexError) as e:
-                            continue
-                        
-            except (ValueError, IndexError) as e:
-                continue
+    def _parse_netmhcii_lines(self, lines: List[str]) -> pd.DataFrame:
+        """Detect the NetMHCIIpan output format of already-read lines and parse them."""
+        try:
+            if is_wide_table(lines[:2]):
+                table = load_netmhcii_table(io.StringIO(''.join(lines)))
+                self.logger.info(f"Detected wide-table format with {table.n_alleles} HLA alleles")
+                return _epitope_frame_from_table(table)
+            self.logger.info("Detected standard tabular format")
+            return self._parse_standard_format(lines)
         
-        self.logger.info(f"Parsed {len(epitopes)} epitope entries from wide-table format")
-        return pd.DataFrame(epitopes)
+        except Exception as e:
+            self.logger.error(f"Failed to parse NetMHCIIpan output: {e}")
+            raise
     
     def _parse_standard_format(self, lines: List[str]) -> pd.DataFrame:
         """
@@ -322,35 +462,29 @@ class EpitopeAnalyzer:
                             continue
                     continue
         
-        return pd.DataFrame(epitopes)
+        return _compact_epitope_frame(pd.DataFrame(epitopes))
     
     def _get_sequence_length(self) -> int:
         """Get sequence length from FASTA file."""
         try:
-            seq_length = 0
-            with open(self.config.fasta_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('>'):
-                        seq_length += len(line)
-            return seq_length
+            return len(self._get_full_sequence())
         except Exception as e:
             self.logger.warning(f"Failed to read sequence length: {e}")
             raise
     
     def _get_full_sequence(self) -> str:
-        """Get full protein sequence from FASTA file."""
-        sequence = ""
+        """Get full protein sequence, reading the FASTA file only on first use."""
+        if self._sequence is not None:
+            return self._sequence
         with open(self.config.fasta_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('>'):
-                    sequence += line
+            sequence = _sequence_from_fasta_text(f.read())
         if not sequence:
             raise ValueError("Empty sequence read from FASTA file")
+        self._sequence = sequence
         return sequence
     
-    def _filter_epitopes_by_binding(self, epitope_df: pd.DataFrame) -> pd.DataFrame:
+    def _filter_epitopes_by_binding(self, epitope_df: pd.DataFrame,
+                                    core_counts_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
         """
         Filter epitopes based on strong/weak binding counts per Core sequence.
         
@@ -364,6 +498,8 @@ class EpitopeAnalyzer:
         
         Args:
             epitope_df: DataFrame with epitope predictions
+            core_counts_df: Precomputed per-core counts (e.g. merged from a persisted
+                state); counted from epitope_df when omitted
             
         Returns:
             Filtered DataFrame with selected epitopes
@@ -394,71 +530,33 @@ class EpitopeAnalyzer:
                 self.logger.warning("Neither core nor sequence column found, skipping filtering")
                 return epitope_df
         
-        # Classify binding strength
-        # Strong binding: %Rank <= 1.00%
-        # Weak binding: 1.00% < %Rank <= 5.00%
-        def classify_binding(rank_value):
-            if pd.isna(rank_value):
-                return None
-            if rank_value <= 1.00:
-                return 'strong'
-            elif rank_value <= 5.00:
-                return 'weak'
-            else:
-                return None
-        
-        epitope_df['binding_class'] = epitope_df[rank_col].apply(classify_binding)
-        
-        # Count strong and weak bindings per core
-        core_binding_counts = []
-        for core in epitope_df['core'].unique():
-            core_data = epitope_df[epitope_df['core'] == core]
-            strong_count = len(core_data[core_data['binding_class'] == 'strong'])
-            weak_count = len(core_data[core_data['binding_class'] == 'weak'])
-            number_of_strong_binding = strong_count + weak_count
-            
-            core_binding_counts.append({
-                'core': core,
-                'strong_count': strong_count,
-                'weak_count': weak_count,
-                'number_of_strong_binding': number_of_strong_binding
-            })
-        
-        core_counts_df = pd.DataFrame(core_binding_counts)
-        
-        # Sort by number_of_strong_binding
-        core_counts_df = core_counts_df.sort_values(
-            'number_of_strong_binding',
-            ascending=False
-        ).reset_index(drop=True)
+        if core_counts_df is None:
+            core_counts_df = self._count_binding_per_core(epitope_df, rank_col)
+        elif 'binding_class' not in epitope_df.columns:
+            self._classify_binding(epitope_df, rank_col)
+        # Unsorted counts (first-appearance order) are kept for state persistence
+        self.core_counts_df = core_counts_df
         
         self.logger.info(f"Core sequences ranked: {len(core_counts_df)} unique cores")
-        self.logger.info(f"Top 5 cores by binding count: {core_counts_df.head(5)['core'].tolist()}")
+        self.logger.info(f"Top 5 cores by binding count: {self._ranked_cores(core_counts_df, True, 5)}")
         
-        # Determine effective number of epitopes to select based on sequence length
-        # To prevent overlapping mutation regions, limit epitopes for short sequences
-        try:
-            # Read sequence length from FASTA
-            seq_length = self._get_sequence_length()
-            if seq_length < 200:
-                # For sequences shorter than 200 amino acids, limit to maximum 3 epitopes
-                n_effective = min(self.config.epitopes_number, 3)
-                self.logger.info(f"Sequence length ({seq_length} aa) < 200, limiting epitopes to {n_effective}")
-            else:
-                n_effective = self.config.epitopes_number
-        except Exception as e:
-            self.logger.warning(f"Could not determine sequence length: {e}, using user-defined value")
-            n_effective = self.config.epitopes_number
+        n_requested = self.config.epitopes_number
         
-        # Select top or bottom N cores based on mode
-        if self.config.mode == ImmunogenicityMode.REDUCE:
+        # Select top and/or bottom N cores based on mode
+        self.selected_cores = {}
+        if self.config.mode in (ImmunogenicityMode.REDUCE, ImmunogenicityMode.BOTH):
             # Reduce mode: select cores with highest binding (top N)
-            selected_cores = core_counts_df.head(n_effective)['core'].tolist()
-            self.logger.info(f"Reduce mode: selecting top {n_effective} cores with highest binding")
-        else:  # ENHANCE
+            self.logger.info(f"Reduce mode: selecting top {n_requested} cores with highest binding")
+            self.selected_cores['reduce'] = self._select_cores(epitope_df, core_counts_df, descending=True)
+        if self.config.mode in (ImmunogenicityMode.ENHANCE, ImmunogenicityMode.BOTH):
             # Enhance mode: select cores with lowest binding (bottom N)
-            selected_cores = core_counts_df.tail(n_effective)['core'].tolist()
-            self.logger.info(f"Enhance mode: selecting bottom {n_effective} cores with lowest binding")
+            self.logger.info(f"Enhance mode: selecting bottom {n_requested} cores with lowest binding")
+            self.selected_cores['enhance'] = self._select_cores(epitope_df, core_counts_df, descending=False)
+        
+        # Union of all selections, so extension runs once per core
+        selected_cores = list(dict.fromkeys(
+            core for cores in self.selected_cores.values() for core in cores
+        ))
         
         # Filter epitope_df to only include selected cores
         filtered_df = epitope_df[epitope_df['core'].isin(selected_cores)].copy()
@@ -475,6 +573,199 @@ class EpitopeAnalyzer:
         
         return filtered_df
     
+    @staticmethod
+    def _classify_binding(epitope_df: pd.DataFrame, rank_col: str) -> tuple:
+        """
+        Add the binding_class column and return boolean (strong, weak) masks.
+        
+        Strong binding: %Rank <= 1.00%; weak binding: 1.00% < %Rank <= 5.00%.
+        """
+        rank = epitope_df[rank_col].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore'):
+            strong = rank <= 1.00
+            weak = (rank > 1.00) & (rank <= 5.00)
+        epitope_df['binding_class'] = np.where(strong, 'strong', np.where(weak, 'weak', None))
+        return strong, weak
+    
+    def _count_binding_per_core(self, epitope_df: pd.DataFrame, rank_col: str) -> pd.DataFrame:
+        """
+        Count strong and weak bindings per core.
+        
+        Returns:
+            DataFrame with core, strong_count, weak_count and number_of_strong_binding,
+            one row per core in order of first appearance
+        """
+        strong, weak = self._classify_binding(epitope_df, rank_col)
+        codes, cores = pd.factorize(epitope_df['core'])
+        strong_count = np.bincount(codes, weights=strong, minlength=len(cores)).astype(np.int64)
+        weak_count = np.bincount(codes, weights=weak, minlength=len(cores)).astype(np.int64)
+        return pd.DataFrame({
+            'core': np.asarray(cores, dtype=object),
+            'strong_count': strong_count,
+            'weak_count': weak_count,
+            'number_of_strong_binding': strong_count + weak_count
+        })
+    
+    def _target_length(self) -> int:
+        """Return the validated target epitope length (9-15 aa, default 15)."""
+        if self.config.epitope_length < 9 or self.config.epitope_length > 15:
+            self.logger.warning(f"Invalid epitope_length {self.config.epitope_length}, must be 9-15. Using 15.")
+            return 15
+        return self.config.epitope_length
+    
+    @staticmethod
+    def _extended_span(core_len: int, core_start: int, core_end: int,
+                       target_length: int, seq_length: int) -> tuple:
+        """
+        Return the 1-based (start, end) span an epitope row occupies after extension.
+        
+        Cores shorter than target_length are extended forward by up to 2 aa, then
+        backward by up to 4 aa, clipped to 1..seq_length; longer cores keep their span.
+        """
+        if core_len >= target_length:
+            return core_start, core_end
+        extension_needed = target_length - core_len
+        max_forward = min(2, extension_needed)
+        max_backward = min(4, extension_needed - max_forward)
+        return max(1, core_start - max_forward), min(seq_length, core_end + max_backward)
+    
+    def _core_windows(self, epitope_df: pd.DataFrame, seq_length: Optional[int]) -> Dict[str, List[tuple]]:
+        """
+        Return, for every core, the spans its rows occupy in the extended output.
+        
+        Each row's span is computed by _extended_span from its start/end columns,
+        exactly as _extend_core_sequences writes it. Without a sequence length the
+        extension is skipped, so the unextended spans are used. Overlapping spans of
+        one core are merged.
+        
+        Returns:
+            Dict mapping core -> sorted list of disjoint (start, end) windows (1-based)
+        """
+        target_length = self._target_length()
+        starts = epitope_df['start'].astype(int)
+        if 'end' in epitope_df.columns:
+            ends = epitope_df['end'].astype(int)
+        else:
+            ends = starts + epitope_df['core'].astype(str).str.len() - 1
+        occurrences = pd.DataFrame({
+            'core': epitope_df['core'].astype(str), 'start': starts, 'end': ends
+        }).drop_duplicates()
+        
+        windows: Dict[str, List[tuple]] = {}
+        for core, core_start, core_end in zip(occurrences['core'], occurrences['start'], occurrences['end']):
+            if seq_length:
+                span = self._extended_span(len(core), int(core_start), int(core_end),
+                                           target_length, seq_length)
+            else:
+                span = (int(core_start), int(core_end))
+            windows.setdefault(core, []).append(span)
+        
+        for core, spans in windows.items():
+            merged = []
+            for span_start, span_end in sorted(set(spans)):
+                if merged and span_start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+                else:
+                    merged.append((span_start, span_end))
+            windows[core] = merged
+        return windows
+    
+    @staticmethod
+    def _ranked_cores(core_counts_df: pd.DataFrame, descending: bool, limit: int) -> List[str]:
+        """
+        Return up to limit cores ordered by number_of_strong_binding.
+        
+        Ties keep first-appearance order when descending and the reverse of it when
+        ascending, so the ascending ranking is exactly the descending one reversed.
+        Only the first limit entries are ordered (argpartition), avoiding a full sort.
+        """
+        counts = core_counts_df['number_of_strong_binding'].to_numpy(dtype=np.int64)
+        n_cores = len(counts)
+        limit = min(limit, n_cores)
+        if limit <= 0:
+            return []
+        
+        # Unique integer keys encode (count, tie-break) so partitioning is deterministic
+        position = np.arange(n_cores, dtype=np.int64)
+        if descending:
+            key = -counts * n_cores + position
+        else:
+            key = counts * n_cores + (n_cores - 1 - position)
+        candidates = np.argpartition(key, limit - 1)[:limit] if limit < n_cores else position
+        order = candidates[np.argsort(key[candidates])]
+        return core_counts_df['core'].to_numpy()[order].tolist()
+    
+    def _select_cores(self, epitope_df: pd.DataFrame, core_counts_df: pd.DataFrame,
+                      descending: bool) -> List[str]:
+        """
+        Select epitopes_number cores from the top (descending) or bottom of the ranking.
+        
+        Without allow_overlap, candidates are taken in growing batches until enough
+        non-overlapping cores are found or the ranking is exhausted.
+        """
+        n_select = self.config.epitopes_number
+        n_cores = len(core_counts_df)
+        
+        if self.config.allow_overlap:
+            return self._ranked_cores(core_counts_df, descending, n_select)
+        
+        limit = min(n_cores, max(4 * n_select, 64))
+        while True:
+            ordered_cores = self._ranked_cores(core_counts_df, descending, limit)
+            candidates_df = epitope_df[epitope_df['core'].isin(ordered_cores)]
+            selected_cores = self._select_non_overlapping_cores(candidates_df, ordered_cores, n_select)
+            if len(selected_cores) >= n_select or limit >= n_cores:
+                break
+            limit = min(n_cores, limit * 4)
+        
+        if len(selected_cores) < n_select:
+            self.logger.warning(
+                f"Only {len(selected_cores)} non-overlapping cores available (requested {n_select})"
+            )
+        return selected_cores
+    
+    def _select_non_overlapping_cores(self, epitope_df: pd.DataFrame,
+                                      ordered_cores: List[str], n_select: int) -> List[str]:
+        """
+        Greedily pick cores in ranking order, rejecting any whose extended window
+        overlaps (or lies closer than min_spacing to) an already selected one.
+        
+        Args:
+            epitope_df: Parsed epitope table with core, start and end columns
+            ordered_cores: Cores in preference order
+            n_select: Maximum number of cores to select
+            
+        Returns:
+            Selected cores in preference order
+        """
+        try:
+            seq_length = self._get_sequence_length()
+        except Exception as e:
+            self.logger.warning(f"Could not determine sequence length: {e}, windows are not clipped")
+            seq_length = None
+        
+        windows = self._core_windows(epitope_df, seq_length)
+        index = IntervalIndex(self.config.min_spacing)
+        selected_cores = []
+        rejected = 0
+        
+        for core in ordered_cores:
+            if len(selected_cores) >= n_select:
+                break
+            spans = windows.get(str(core), [])
+            if any(index.overlaps(span_start, span_end) for span_start, span_end in spans):
+                rejected += 1
+                continue
+            for span_start, span_end in spans:
+                index.add(span_start, span_end)
+            selected_cores.append(core)
+        
+        self.logger.info(
+            f"Non-overlapping selection (min spacing {self.config.min_spacing} aa): "
+            f"kept {len(selected_cores)} cores, rejected {rejected} overlapping cores"
+        )
+        return selected_cores
+    
     def _extend_core_sequences(self, epitope_df: pd.DataFrame) -> pd.DataFrame:
         """
         Extend Core sequences to target epitope_length using amino acids from the original VLP sequence.
@@ -507,11 +798,7 @@ class EpitopeAnalyzer:
             return epitope_df
         
         # Validate target length
-        if self.config.epitope_length < 9 or self.config.epitope_length > 15:
-            self.logger.warning(f"Invalid epitope_length {self.config.epitope_length}, must be 9-15. Using 15.")
-            target_length = 15
-        else:
-            target_length = self.config.epitope_length
+        target_length = self._target_length()
         
         extended_sequences = []
         extended_starts = []
@@ -531,14 +818,9 @@ class EpitopeAnalyzer:
                 extended_ends.append(core_end)
                 continue
             
-            # Calculate extension needed
-            extension_needed = target_length - core_len
-            max_forward = min(2, extension_needed)
-            max_backward = min(4, extension_needed - max_forward)
-            
             # Calculate new start and end positions (1-based)
-            new_start = max(1, core_start - max_forward)
-            new_end = min(seq_length, core_end + max_backward)
+            new_start, new_end = self._extended_span(core_len, core_start, core_end,
+                                                     target_length, seq_length)
             
             # Extract extended sequence from full sequence
             extended_seq = full_sequence[new_start - 1:new_end]
@@ -584,24 +866,14 @@ class EpitopeAnalyzer:
             
             # Run analysis steps
             self.logger.info("Step 1: Parsing NetMHCIIpan output...")
-            epitope_df = self._parse_netmhcii_output(self.config.netmhcii_output)
+            epitope_df = self._load_netmhcii_table(self.config.netmhcii_output)
             self.logger.info(f"Parsed {len(epitope_df)} epitopes from NetMHCIIpan output")
             
-            if epitope_df.empty:
-                raise ValueError("No epitopes found in NetMHCIIpan output")
-            
-            self.logger.info("Step 2: Filtering epitopes based on binding strength...")
-            epitope_df = self._filter_epitopes_by_binding(epitope_df)
-            self.logger.info(f"After filtering: {len(epitope_df)} epitopes selected")
-            
-            self.logger.info("Step 3: Extending core sequences to target length...")
-            epitope_df = self._extend_core_sequences(epitope_df)
-            
-            # Save results
-            result_file = os.path.join(self.config.output_dir, "selected_epitopes.csv")
-            epitope_df.to_csv(result_file, index=False)
-            
-            self.logger.info(f"Results saved to {result_file}")
+            if self.config.per_sequence:
+                epitope_df = self._run_per_sequence(epitope_df)
+            else:
+                epitope_df = self._run_selection(epitope_df)
+            self._save_results(epitope_df)
             
             # Log completion
             self.logger.info("=" * 60)
@@ -614,21 +886,562 @@ class EpitopeAnalyzer:
         except Exception as e:
             self.logger.error(f"Epitope analysis failed: {e}")
             raise
+    
+    def analyze(self, netmhcii: Union[pd.DataFrame, NetMHCIITable, str, io.TextIOBase], sequence: str,
+                persist: bool = False) -> pd.DataFrame:
+        """
+        Run the analysis on in-memory inputs, without touching the file system.
+        
+        config.netmhcii_output and config.fasta_path are ignored. The analyzer can
+        be reused for many calls, e.g. inside a long-running service.
+        
+        Args:
+            netmhcii: Parsed epitope table (see parse_netmhcii_text), a canonical
+                NetMHCIITable (see netmhcii_table.load_netmhcii_table), raw
+                NetMHCIIpan output text, or a text buffer holding it
+            sequence: Protein sequence, either plain or as FASTA text
+            persist: Also write analysis_config.json and the selected_epitopes
+                file into config.output_dir
+            
+        Returns:
+            DataFrame with the selected, extended epitopes
+        """
+        self._validate_mode()
+        self._sequence = _sequence_from_fasta_text(sequence)
+        if not self._sequence:
+            raise ValueError("Empty protein sequence")
+        
+        if isinstance(netmhcii, pd.DataFrame):
+            # Shallow copy: filtering adds columns that must not leak to the caller
+            epitope_df = netmhcii.copy(deep=False)
+        elif isinstance(netmhcii, NetMHCIITable):
+            epitope_df = _epitope_frame_from_table(netmhcii)
+        else:
+            text = netmhcii.read() if hasattr(netmhcii, 'read') else netmhcii
+            epitope_df = self._parse_netmhcii_lines(text.splitlines(keepends=True))
+        self.logger.info(f"Analyzing {len(epitope_df)} in-memory epitope entries")
+        
+        epitope_df = self._run_selection(epitope_df)
+        
+        if persist:
+            os.makedirs(self.config.output_dir, exist_ok=True)
+            self._save_config()
+            self._save_results(epitope_df)
+        
+        return epitope_df
+    
+    def _run_selection(self, epitope_df: pd.DataFrame) -> pd.DataFrame:
+        """Filter the parsed table by binding strength and extend the selected cores."""
+        if epitope_df.empty:
+            raise ValueError("No epitopes found in NetMHCIIpan output")
+        
+        self.logger.info("Step 2: Filtering epitopes based on binding strength...")
+        full_df = epitope_df
+        epitope_df = self._filter_epitopes_by_binding(full_df)
+        self.logger.info(f"After filtering: {len(epitope_df)} epitopes selected")
+        
+        if self.config.state_dir and self.core_counts_df is not None:
+            self._save_binding_state(full_df, self.core_counts_df)
+        
+        self.logger.info("Step 3: Extending core sequences to target length...")
+        return self._extend_selected(epitope_df)
+    
+    def _run_per_sequence(self, epitope_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Analyze every seq_id shard separately against its matching FASTA record.
+        
+        Counting, selection and extension run per shard (in up to config.jobs worker
+        processes); results are merged in order of first appearance of each ID, so
+        the output does not depend on worker scheduling.
+        """
+        if epitope_df.empty:
+            raise ValueError("No epitopes found in NetMHCIIpan output")
+        if self.config.state_dir:
+            self.logger.warning("Binding state is not saved in per-sequence mode")
+        
+        with open(self.config.fasta_path, 'r') as f:
+            records = _read_fasta_records(f.read())
+        
+        seq_ids = [str(seq_id) for seq_id in pd.unique(epitope_df['seq_id'])]
+        shards = []
+        for seq_id, shard_df in epitope_df.groupby('seq_id', sort=False, observed=True):
+            seq_id = str(seq_id)
+            sequence = _match_fasta_record(seq_id, records, single_shard=len(seq_ids) == 1)
+            if sequence is None:
+                self.logger.warning(f"No FASTA record matches ID {seq_id}, skipping {len(shard_df)} rows")
+                continue
+            shard_df = shard_df.reset_index(drop=True)
+            for col in shard_df.columns:
+                if isinstance(shard_df[col].dtype, pd.CategoricalDtype):
+                    shard_df[col] = shard_df[col].cat.remove_unused_categories()
+            shards.append((seq_id, shard_df, sequence))
+        
+        if not shards:
+            raise ValueError("No NetMHCIIpan ID matches a FASTA record")
+        self.logger.info(f"Per-sequence mode: {len(shards)} shards, {self.config.jobs} worker(s)")
+        
+        shard_config = replace(self.config, per_sequence=False, state_dir=None, cache_dir=None)
+        results: Dict[str, pd.DataFrame] = {}
+        if self.config.jobs <= 1:
+            for seq_id, shard_df, sequence in shards:
+                results[seq_id] = _analyze_shard(shard_config, seq_id, shard_df, sequence)
+        else:
+            with ProcessPoolExecutor(max_workers=self.config.jobs) as pool:
+                futures = {
+                    pool.submit(_analyze_shard, shard_config, seq_id, shard_df, sequence): seq_id
+                    for seq_id, shard_df, sequence in shards
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+        
+        merged = [results[seq_id] for seq_id, _, _ in shards if not results[seq_id].empty]
+        if not merged:
+            return epitope_df.iloc[0:0]
+        merged_df = pd.concat(merged, ignore_index=True)
+        merged_df['seq_id'] = merged_df['seq_id'].astype(str)
+        self.logger.info(f"Merged {len(merged_df)} epitopes from {len(merged)} sequences")
+        return merged_df
+    
+    def _extend_selected(self, filtered_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Extend the selected cores once; in both mode, label rows by selection.
+        
+        In both mode the union of the reduce and enhance cores is extended once and
+        then split, adding a selection column (a core picked by both appears twice).
+        """
+        extended_df = self._extend_core_sequences(filtered_df)
+        if self.config.mode != ImmunogenicityMode.BOTH or extended_df.empty:
+            return extended_df
+        
+        parts = []
+        for selection, cores in self.selected_cores.items():
+            part = extended_df[extended_df['core'].isin(cores)].copy()
+            part['selection'] = selection
+            parts.append(part)
+        return pd.concat(parts, ignore_index=True)
+    
+    def run_incremental(self, delta_file: str) -> pd.DataFrame:
+        """
+        Merge a delta NetMHCIIpan file holding only new alleles into the persisted state.
+        
+        The per-core strong/weak counts and parsed rows saved by a previous run with
+        state_dir are loaded as-is; only the delta rows are parsed and counted. The
+        merged counts drive the usual reduce/enhance selection and extension, and the
+        state is updated so further deltas can follow.
+        
+        Args:
+            delta_file: NetMHCIIpan output for the additional alleles
+            
+        Returns:
+            DataFrame with the selected, extended epitopes
+        """
+        if not self.config.state_dir:
+            raise ValueError("run_incremental requires config.state_dir")
+        
+        try:
+            self._validate_inputs()
+            if not os.path.exists(delta_file):
+                raise FileNotFoundError(f"Delta NetMHCIIpan file not found: {delta_file}")
+            
+            epitope_df, core_counts_df, state = self._load_binding_state()
+            self.logger.info(
+                f"Loaded binding state: {len(core_counts_df)} cores, {len(state['alleles'])} alleles"
+            )
+            
+            self.logger.info("Parsing delta NetMHCIIpan output...")
+            delta_df = self._load_netmhcii_table(delta_file)
+            if delta_df.empty:
+                raise ValueError("No epitopes found in delta NetMHCIIpan output")
+            
+            rank_col = state['rank_col']
+            if rank_col not in delta_df.columns:
+                raise ValueError(f"Delta file lacks the {rank_col} column used by the saved state")
+            new_alleles = [str(a) for a in pd.unique(delta_df['allele'])]
+            repeated = sorted(set(new_alleles) & set(state['alleles']))
+            if repeated:
+                raise ValueError(f"Delta file repeats alleles already in the state: {', '.join(repeated)}")
+            
+            delta_counts = self._count_binding_per_core(delta_df, rank_col)
+            merged_counts = (
+                pd.concat([core_counts_df, delta_counts], ignore_index=True)
+                .groupby('core', sort=False)[['strong_count', 'weak_count', 'number_of_strong_binding']]
+                .sum()
+                .reset_index()
+            )
+            self.logger.info(
+                f"Merged {len(new_alleles)} new alleles: {len(merged_counts) - len(core_counts_df)} new cores"
+            )
+            
+            merged_df = _compact_epitope_frame(pd.concat([epitope_df, delta_df], ignore_index=True))
+            selected_df = self._filter_epitopes_by_binding(merged_df, core_counts_df=merged_counts)
+            selected_df = self._extend_selected(selected_df)
+            
+            self._save_binding_state(merged_df, merged_counts, sources=state['sources'] + [delta_file])
+            self._save_results(selected_df)
+            return selected_df
+        
+        except Exception as e:
+            self.logger.error(f"Incremental epitope analysis failed: {e}")
+            raise
+    
+    def _save_binding_state(self, epitope_df: pd.DataFrame, core_counts_df: pd.DataFrame,
+                            sources: Optional[List[str]] = None) -> None:
+        """Persist parsed rows, per-core counts and allele list to config.state_dir."""
+        state_dir = self.config.state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        
+        rank_col = 'rank_el' if 'rank_el' in epitope_df.columns else 'rank'
+        state = {
+            'parser_version': PARSER_VERSION,
+            'rank_col': rank_col,
+            'alleles': [str(a) for a in pd.unique(epitope_df['allele'])],
+            'sources': sources if sources is not None else [self.config.netmhcii_output],
+            'rows_file': _write_frame(epitope_df, os.path.join(state_dir, "epitopes"))
+        }
+        core_counts_df.to_csv(os.path.join(state_dir, "core_counts.csv"), index=False)
+        with open(os.path.join(state_dir, "binding_state.json"), 'w') as f:
+            json.dump(state, f, indent=2)
+        
+        self.logger.info(f"Binding state saved to {state_dir}")
+    
+    def _load_binding_state(self) -> tuple:
+        """Load (epitope_df, core_counts_df, state) written by _save_binding_state."""
+        state_dir = self.config.state_dir
+        state_file = os.path.join(state_dir, "binding_state.json")
+        if not os.path.exists(state_file):
+            raise FileNotFoundError(f"No binding state found in {state_dir}")
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        if state.get('parser_version') != PARSER_VERSION:
+            raise ValueError(
+                f"Binding state was written by parser version {state.get('parser_version')}, "
+                f"expected {PARSER_VERSION}; re-run the full analysis"
+            )
+        
+        epitope_df = _read_frame(os.path.join(state_dir, state['rows_file']))
+        core_counts_df = pd.read_csv(
+            os.path.join(state_dir, "core_counts.csv"),
+            dtype={'core': str},
+            keep_default_na=False
+        )
+        return epitope_df, core_counts_df, state
+    
+    def _save_results(self, epitope_df: pd.DataFrame) -> None:
+        """
+        Write the selected epitopes to selected_epitopes.<ext> in output_dir.
+        
+        The extension follows config.output_format (.csv by default). In both mode,
+        selected_epitopes_reduce and selected_epitopes_enhance are written instead.
+        """
+        if self.config.mode != ImmunogenicityMode.BOTH:
+            result_file = write_result_table(
+                epitope_df, os.path.join(self.config.output_dir, "selected_epitopes"), self.config.output_format
+            )
+            self.logger.info(f"Results saved to {result_file}")
+            return
+        
+        for selection in ('reduce', 'enhance'):
+            if 'selection' in epitope_df.columns:
+                part = epitope_df[epitope_df['selection'] == selection].drop(columns='selection')
+            else:
+                part = epitope_df
+            result_file = write_result_table(
+                part, os.path.join(self.config.output_dir, f"selected_epitopes_{selection}"), self.config.output_format
+            )
+            self.logger.info(f"{selection.capitalize()} results saved to {result_file}")
+
+
+def _write_frame(df: pd.DataFrame, base_path: str) -> str:
+    """Write a table as Parquet (pyarrow) or .npz; returns the file name written."""
+    return os.path.basename(write_result_table(df, base_path, 'parquet'))
+
+
+def _read_frame(path: str) -> pd.DataFrame:
+    """Read a table written by _write_frame."""
+    return read_result_table(path)
+
+
+def _sequence_from_fasta_text(text: str) -> str:
+    """Concatenate the sequence lines of FASTA text (plain sequences pass through)."""
+    return ''.join(
+        line.strip() for line in text.splitlines()
+        if line.strip() and not line.startswith('>')
+    )
+
+
+def _read_fasta_records(text: str) -> Dict[str, str]:
+    """Return {record id: sequence} for FASTA text; the id is the header's first word."""
+    records: Dict[str, str] = {}
+    name = None
+    chunks: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('>'):
+            if name is not None:
+                records[name] = ''.join(chunks)
+            header = line[1:].split()
+            name = header[0] if header else f"record_{len(records) + 1}"
+            chunks = []
+        else:
+            chunks.append(line)
+    if name is not None:
+        records[name] = ''.join(chunks)
+    elif chunks:
+        records['Sequence'] = ''.join(chunks)
+    return records
+
+
+def _match_fasta_record(seq_id: str, records: Dict[str, str], single_shard: bool = False) -> Optional[str]:
+    """
+    Find the FASTA record for a NetMHCIIpan ID.
+    
+    NetMHCIIpan truncates sequence names, so an exact match is tried first, then a
+    unique prefix match; a lone record is used for a lone ID whatever its name.
+    """
+    if seq_id in records:
+        return records[seq_id]
+    prefixed = [name for name in records if name.startswith(seq_id)]
+    if len(prefixed) == 1:
+        return records[prefixed[0]]
+    if single_shard and len(records) == 1:
+        return next(iter(records.values()))
+    return None
+
+
+def _analyze_shard(config: AnalysisConfig, seq_id: str, shard_df: pd.DataFrame,
+                   sequence: str) -> pd.DataFrame:
+    """Run selection and extension for one seq_id shard (used by worker processes)."""
+    analyzer = EpitopeAnalyzer(config, log_mode="none")
+    result_df = analyzer.analyze(shard_df, sequence)
+    analyzer.logger.info(f"Sequence {seq_id}: {len(result_df)} epitopes selected")
+    return result_df
+
+
+def parse_netmhcii_text(netmhcii: Union[str, io.TextIOBase]) -> pd.DataFrame:
+    """
+    Parse NetMHCIIpan output held in memory (text or text buffer).
+    
+    The returned table can be passed to EpitopeAnalyzer.analyze repeatedly, so a
+    service parses each prediction once and re-runs selection with other settings.
+    """
+    analyzer = EpitopeAnalyzer(
+        AnalysisConfig(netmhcii_output="", fasta_path="", mode=ImmunogenicityMode.REDUCE),
+        log_mode="none"
+    )
+    text = netmhcii.read() if hasattr(netmhcii, 'read') else netmhcii
+    return analyzer._parse_netmhcii_lines(text.splitlines(keepends=True))
+
+
+def analyze_epitopes(netmhcii: Union[pd.DataFrame, NetMHCIITable, str, io.TextIOBase], sequence: str,
+                     mode: Union[ImmunogenicityMode, str] = ImmunogenicityMode.REDUCE,
+                     epitopes_number: int = 10, epitope_length: int = 15,
+                     output_dir: Optional[str] = None, **options) -> pd.DataFrame:
+    """
+    In-memory convenience wrapper around EpitopeAnalyzer.analyze.
+    
+    Nothing is written unless output_dir is given, in which case the configuration
+    and selected epitopes are persisted there. Logging goes through the module
+    logger and is left to the host application to configure.
+    
+    Args:
+        netmhcii: Parsed epitope table, NetMHCIITable, NetMHCIIpan output text or a text buffer
+        sequence: Protein sequence (plain or FASTA text)
+        mode: reduce, enhance or both
+        epitopes_number: Number of cores to select
+        epitope_length: Target epitope length (9-15 aa)
+        output_dir: Optional directory for persisted results
+        **options: Further AnalysisConfig fields (e.g. min_spacing, allow_overlap)
+        
+    Returns:
+        DataFrame with the selected, extended epitopes
+    """
+    config = AnalysisConfig(
+        netmhcii_output="",
+        fasta_path="",
+        mode=mode,
+        output_dir=output_dir or "results",
+        epitopes_number=epitopes_number,
+        epitope_length=epitope_length,
+        **options
+    )
+    analyzer = EpitopeAnalyzer(config, log_mode="none")
+    return analyzer.analyze(netmhcii, sequence, persist=output_dir is not None)
 
 
 def create_config_from_args(args) -> AnalysisConfig:
     """Create configuration from command line arguments."""
     return AnalysisConfig(
-        netmhcii_output=args.netmhcii_output,
+        netmhcii_output=args.netmhcii_output or args.delta_netmhcii,
         fasta_path=args.fasta,
         mode=ImmunogenicityMode(args.mode),
         output_dir=args.output_dir,
         log_level=args.log_level,
         epitopes_number=args.epitopes_number,
-        epitope_length=args.epitope_length
+        epitope_length=args.epitope_length,
+        min_spacing=args.min_spacing,
+        allow_overlap=args.allow_overlap,
+        per_sequence=args.per_sequence,
+        jobs=args.jobs,
+        state_dir=args.state_dir,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        output_format=args.output_format
     )
 
 
+BATCH_MANIFEST_COLUMNS = [
+    'netmhcii_output', 'fasta', 'mode', 'epitopes_number', 'epitope_length', 'output_dir'
+]
+
+
+def load_batch_manifest(manifest_path: str, log_level: str = "INFO",
+                        cache_dir: Optional[str] = None,
+                        cache_max_mb: float = 1024.0,
+                        output_format: str = "csv",
+                        output_dir: str = "results") -> List[AnalysisConfig]:
+    """
+    Load a batch manifest into analysis configurations.
+    
+    The manifest is a CSV file with the columns in BATCH_MANIFEST_COLUMNS, or a JSON
+    file holding a list of job objects (optionally under a "jobs" key). Only
+    netmhcii_output and fasta are required; the other fields fall back to the CLI
+    defaults, with output_dir defaulting to <output_dir>/job_<n>.
+    
+    Args:
+        manifest_path: Path to the CSV or JSON manifest
+        log_level: Logging level applied to every job
+        cache_dir: Parsed-table cache directory shared by every job (None disables it)
+        cache_max_mb: Size bound of the parsed-table cache
+        output_format: Format of every job's selected_epitopes file
+        output_dir: Batch output directory holding the default job directories
+        
+    Returns:
+        List of AnalysisConfig, one per job
+    """
+    if manifest_path.lower().endswith('.json'):
+        with open(manifest_path, 'r') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get('jobs', [])
+    else:
+        manifest_df = pd.read_csv(manifest_path, dtype=str, skipinitialspace=True)
+        entries = [
+            {key: value for key, value in row.items() if pd.notna(value) and str(value).strip()}
+            for row in manifest_df.to_dict(orient='records')
+        ]
+    
+    configs = []
+    for i, entry in enumerate(entries, start=1):
+        missing = [key for key in ('netmhcii_output', 'fasta') if not entry.get(key)]
+        if missing:
+            raise ValueError(f"Manifest job {i} is missing required field(s): {', '.join(missing)}")
+        unknown = set(entry) - set(BATCH_MANIFEST_COLUMNS)
+        if unknown:
+            raise ValueError(f"Manifest job {i} has unknown field(s): {', '.join(sorted(unknown))}")
+        configs.append(AnalysisConfig(
+            netmhcii_output=str(entry['netmhcii_output']).strip(),
+            fasta_path=str(entry['fasta']).strip(),
+            mode=ImmunogenicityMode(str(entry.get('mode', 'reduce')).strip().lower()),
+            output_dir=str(entry.get('output_dir', os.path.join(output_dir, f'job_{i}'))).strip(),
+            log_level=log_level,
+            epitopes_number=int(entry.get('epitopes_number', 10)),
+            epitope_length=int(entry.get('epitope_length', 15)),
+            cache_dir=cache_dir,
+            cache_max_mb=cache_max_mb,
+            output_format=output_format
+        ))
+    
+    output_dirs = [os.path.abspath(c.output_dir) for c in configs]
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError("Every manifest job needs its own output_dir")
+    
+    return configs
+
+
+def _run_batch_job(job_index: int, config: AnalysisConfig) -> Dict:
+    """Run one batch job with its own log file; never raises."""
+    started = time.time()
+    summary = {
+        'job': job_index,
+        'netmhcii_output': config.netmhcii_output,
+        'fasta': config.fasta_path,
+        'mode': config.mode.value,
+        'output_dir': config.output_dir,
+        'status': 'failed',
+        'epitopes_selected': 0,
+        'elapsed_s': None,
+        'error': ''
+    }
+    analyzer = None
+    try:
+        analyzer = EpitopeAnalyzer(config, log_mode="job")
+        results = analyzer.run_analysis()
+        summary['status'] = 'success'
+        summary['epitopes_selected'] = len(results)
+    except Exception as e:
+        summary['error'] = str(e)
+    finally:
+        if analyzer is not None:
+            analyzer.close()
+        summary['elapsed_s'] = round(time.time() - started, 3)
+    return summary
+
+
+def run_batch(configs: List[AnalysisConfig], jobs: int = 1,
+              summary_file: Optional[str] = None) -> pd.DataFrame:
+    """
+    Run many analyses, optionally across a process pool.
+    
+    Each job logs to epitope_analysis.log in its own output directory and a failing
+    job is recorded in the summary without affecting the others.
+    
+    Args:
+        configs: Job configurations (see load_batch_manifest)
+        jobs: Number of worker processes (1 runs the jobs sequentially in-process)
+        summary_file: Optional path of the combined summary CSV
+        
+    Returns:
+        DataFrame with one summary row per job, in manifest order
+    """
+    summaries = []
+    if jobs <= 1:
+        for i, config in enumerate(configs, start=1):
+            summaries.append(_run_batch_job(i, config))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(_run_batch_job, i, config): (i, config)
+                for i, config in enumerate(configs, start=1)
+            }
+            for future in as_completed(futures):
+                i, config = futures[future]
+                try:
+                    summaries.append(future.result())
+                except Exception as e:
+                    # Worker process died (e.g. killed by the OS); keep the other jobs
+                    summaries.append({
+                        'job': i,
+                        'netmhcii_output': config.netmhcii_output,
+                        'fasta': config.fasta_path,
+                        'mode': config.mode.value,
+                        'output_dir': config.output_dir,
+                        'status': 'failed',
+                        'epitopes_selected': 0,
+                        'elapsed_s': None,
+                        'error': f"Worker process failed: {e}"
+                    })
+    
+    summary_df = pd.DataFrame(summaries).sort_values('job').reset_index(drop=True)
+    if summary_file:
+        summary_dir = os.path.dirname(summary_file)
+        if summary_dir:
+            os.makedirs(summary_dir, exist_ok=True)
+        summary_df.to_csv(summary_file, index=False)
+    return summary_df
+
+
 def main():
     """Main entry point for the epitope analysis tool."""
     parser = argparse.ArgumentParser(
@@ -642,23 +1455,39 @@ Examples:
   # Enhance immunogenicity with custom parameters
   python epitope_analyzer.py --netmhcii-output netmhcii.out --fasta protein.fasta --mode enhance --epitopes-number 15 --epitope-length 12
   
+  # Reduce and enhance selections from one parse
+  python epitope_analyzer.py --netmhcii-output netmhcii.out --fasta protein.fasta --mode both
+  
+  # Many VLP variants in one NetMHCIIpan run: one analysis per ID, 8 workers
+  python epitope_analyzer.py --netmhcii-output variants.out --fasta variants.fasta --per-sequence --jobs 8
+  
   # Custom output directory and log level
   python epitope_analyzer.py --netmhcii-output netmhcii.out --fasta protein.fasta --mode reduce --output-dir custom_results --log-level DEBUG
+  
+  # Save binding state, then merge a NetMHCIIpan run for extra alleles later
+  python epitope_analyzer.py --netmhcii-output netmhcii.out --fasta protein.fasta --state-dir state
+  python epitope_analyzer.py --delta-netmhcii new_alleles.out --fasta protein.fasta --state-dir state
+  
+  # Batch mode: one job per manifest row, 4 worker processes
+  python epitope_analyzer.py --batch jobs.csv --jobs 4 --output-dir batch_results
         """
     )
     
-    # Required arguments
-    parser.add_argument('--netmhcii-output', type=str, required=True,
+    # Required arguments (unless --batch is given)
+    parser.add_argument('--netmhcii-output', type=str,
                        help='NetMHCIIpan output file path')
-    parser.add_argument('--fasta', type=str, required=True,
+    parser.add_argument('--fasta', type=str,
                        help='Input FASTA file path')
-    parser.add_argument('--mode', type=str, choices=['reduce', 'enhance'],
+    parser.add_argument('--mode', type=str, choices=['reduce', 'enhance', 'both'],
                        default='reduce',
-                       help='Immunogenicity mode: reduce or enhance (default: reduce)')
+                       help='Immunogenicity mode: reduce, enhance, or both from a single parse (default: reduce)')
     
     # Optional arguments
     parser.add_argument('--output-dir', type=str, default='results',
                        help='Output directory for results (default: results)')
+    parser.add_argument('--output-format', type=str, choices=OUTPUT_FORMATS, default='csv',
+                       help='Format of selected_epitopes files: csv, csv.gz, or typed parquet/feather/npz '
+                            '(parquet/feather need pyarrow, otherwise npz is written) (default: csv)')
     parser.add_argument('--log-level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
                        default='INFO', help='Logging level (default: INFO)')
     
@@ -668,15 +1497,52 @@ Examples:
     parser.add_argument('--epitope-length', type=int, default=15,
                        help='Target epitope length (9-15 aa), extends from core if needed (default: 15)')
     
+    parser.add_argument('--min-spacing', type=int, default=0,
+                       help='Minimum number of residues between extended windows of selected epitopes (default: 0)')
+    parser.add_argument('--allow-overlap', action='store_true',
+                       help='Do not reject epitopes whose extended windows overlap')
+    parser.add_argument('--per-sequence', action='store_true',
+                       help='Analyze each NetMHCIIpan ID separately against its matching FASTA record')
+    
+    # Incremental analysis parameters
+    parser.add_argument('--state-dir', type=str, default=None,
+                       help='Save per-core binding state here (or read it with --delta-netmhcii)')
+    parser.add_argument('--delta-netmhcii', type=str, default=None,
+                       help='NetMHCIIpan output with additional alleles to merge into --state-dir')
+    
+    # Parsed-table cache parameters
+    parser.add_argument('--cache-dir', type=str, default=None,
+                       help='Cache parsed NetMHCIIpan tables here, keyed by file content (default: disabled)')
+    parser.add_argument('--cache-max-mb', type=float, default=1024.0,
+                       help='Maximum cache size in MB; least recently used entries are evicted (default: 1024)')
+    
+    # Batch parameters
+    parser.add_argument('--batch', type=str, default=None,
+                       help='Manifest (CSV or JSON) of jobs with columns: ' + ', '.join(BATCH_MANIFEST_COLUMNS))
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes for --batch or --per-sequence (default: 1)')
+    
     args = parser.parse_args()
     
+    if args.batch:
+        run_batch_from_args(args)
+        return
+    if args.delta_netmhcii:
+        if not args.state_dir or not args.fasta:
+            parser.error("--delta-netmhcii requires --state-dir and --fasta")
+    elif not args.netmhcii_output or not args.fasta:
+        parser.error("--netmhcii-output and --fasta are required unless --batch is given")
+    
     try:
         # Create configuration
         config = create_config_from_args(args)
         
         # Initialize and run analysis
         analyzer = EpitopeAnalyzer(config)
-        results = analyzer.run_analysis()
+        if args.delta_netmhcii:
+            results = analyzer.run_incremental(args.delta_netmhcii)
+        else:
+            results = analyzer.run_analysis()
         
         print("\n" + "=" * 60)
         print("EPITOPE ANALYSIS COMPLETED SUCCESSFULLY!")
@@ -692,6 +1558,39 @@ Examples:
         sys.exit(1)
 
 
+def run_batch_from_args(args) -> None:
+    """Run --batch mode and print the combined summary."""
+    try:
+        configs = load_batch_manifest(
+            args.batch,
+            log_level=args.log_level,
+            cache_dir=args.cache_dir,
+            cache_max_mb=args.cache_max_mb,
+            output_format=args.output_format,
+            output_dir=args.output_dir
+        )
+        summary_file = os.path.join(args.output_dir, "batch_summary.csv")
+        summary_df = run_batch(configs, jobs=args.jobs, summary_file=summary_file)
+    except KeyboardInterrupt:
+        print("\nBatch interrupted by user")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\nBatch failed: {e}")
+        sys.exit(1)
+    
+    failed = summary_df[summary_df['status'] != 'success']
+    print("\n" + "=" * 60)
+    print("EPITOPE BATCH ANALYSIS COMPLETED")
+    print(f"Jobs succeeded: {len(summary_df) - len(failed)}/{len(summary_df)}")
+    for _, row in failed.iterrows():
+        print(f"  Job {row['job']} failed: {row['error']}")
+    print(f"Summary saved to: {summary_file}")
+    print("=" * 60)
+    
+    if not failed.empty:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     main()
 
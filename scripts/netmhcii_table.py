@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared NetMHCIIpan table loader
+
+NetMHCIIpan's wide-table output (.xls) has one row of allele names, one row of
+field names and then one row per peptide, with a Core, Inverted, Score, Rank,
+Score_BA, nM, Rank_BA block per allele. Both epitope_analyzer.py and
+run_ic50_sum.py read this format; this module parses it once into a canonical
+columnar structure (NetMHCIITable):
+
+- positions, peptides and sequence IDs, one entry per table row
+- the allele list in file order
+- one (rows x alleles) float matrix per numeric field
+- core sequences as integer codes into a category array
+
+Parsed tables can be cached on disk (ParsedTableCache), keyed by file content,
+so one parse serves every analysis of the same NetMHCIIpan output.
+
+Author: [Chufan Wang]
+Version: 1.0
+Date: 2025
+"""
+
+import os
+import re
+import csv
+import io
+import hashlib
+import importlib.util
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the parsers change the columns or dtypes they emit so that
+# stale cache entries are never reused
+PARSER_VERSION = "3"
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# Numeric fields of each allele block, and the per-row fields before the first block
+NUMERIC_FIELDS = ('Score', 'Rank', 'Score_BA', 'nM', 'Rank_BA')
+BASE_FIELDS = ('Pos', 'Peptide', 'ID')
+
+# Position of rows whose Pos cell is not an integer
+MISSING_POSITION = np.iinfo(np.int32).min
+
+EXCEL_SIGNATURES = (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')
+
+# Result table formats offered by --output-format; parquet/feather need pyarrow
+OUTPUT_FORMATS = ('csv', 'csv.gz', 'parquet', 'feather', 'npz')
+
+# Locus + numeric code, e.g. DRB1_0101, DPA10103, DQB10201
+_ALLELE_CODE_RE = re.compile(r'(D[PQR][AB]\d)_?(\d{2})(\d{2,3})(?!\d)')
+
+
+def normalize_allele(allele_label: str) -> str:
+    """
+    Convert a NetMHCIIpan allele name to standard notation, for every locus family.
+
+    DRB1_0101 -> DRB1*01:01, HLA-DPA10103-DPB10101 -> HLA-DPA1*01:03-DPB1*01:01,
+    HLA-DQA10501-DQB10201 -> HLA-DQA1*05:01-DQB1*02:01; unknown names pass through.
+    """
+    return _ALLELE_CODE_RE.sub(lambda m: f"{m.group(1)}*{m.group(2)}:{m.group(3)}", allele_label.strip())
+
+
+def is_excel_file(path: str) -> bool:
+    """Check the file signature (NetMHCIIpan's .xls output is really tab-separated text)."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    return any(head.startswith(sig) for sig in EXCEL_SIGNATURES)
+
+
+def is_wide_table(lines: Sequence[str]) -> bool:
+    """
+    Return True if the first lines are a wide-table allele row and field row.
+
+    The field row must name a Peptide column and at least one numeric allele field;
+    standard-format output (whitespace-separated rows, '#' headers) never does, even
+    when its allele column holds HLA- names.
+    """
+    if len(lines) < 2 or not lines[0].strip() or lines[0].lstrip().startswith('#'):
+        return False
+    fields = {part.strip() for part in re.split(r'[\t,]', lines[1])}
+    return 'Peptide' in fields and any(f in fields for f in NUMERIC_FIELDS)
+
+
+def locate_columns(header_alleles: Sequence[str],
+                   header_fields: Sequence[str]) -> Tuple[Dict[str, int], List[Tuple[str, Dict[str, int]]]]:
+    """
+    Map the two header rows to column indices.
+
+    An allele name starts a block and the fields after it, up to the next name,
+    belong to that block; base fields (Pos, Peptide, ID) are taken from before the
+    first block.
+
+    Returns:
+        ({base field: column}, [(allele name, {field: column}), ...])
+    """
+    base_cols: Dict[str, int] = {}
+    blocks: List[Tuple[str, Dict[str, int]]] = []
+    for i, name in enumerate(header_fields):
+        label = header_alleles[i].strip() if i < len(header_alleles) else ''
+        name = name.strip()
+        if label:
+            blocks.append((label, {}))
+        if not blocks:
+            if name in BASE_FIELDS and name not in base_cols:
+                base_cols[name] = i
+        elif name:
+            blocks[-1][1][name] = i
+    return base_cols, blocks
+
+
+def read_text_header(source: Union[str, io.TextIOBase]) -> Tuple[str, List[str], List[str]]:
+    """
+    Read the allele row and field row of a text table.
+
+    A text buffer is left positioned at the first data row.
+
+    Returns:
+        (separator, allele row cells, field row cells)
+    """
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8', newline='') as f:
+            head = [f.readline(), f.readline()]
+    else:
+        head = [source.readline(), source.readline()]
+    if not head[1].strip():
+        raise ValueError("Malformed NetMHCIIpan table: expected an allele row and a field row")
+    sep = '\t' if '\t' in head[1] else ','
+    header_alleles, header_fields = (next(csv.reader([line.rstrip('\r\n')], delimiter=sep)) for line in head)
+    return sep, header_alleles, header_fields
+
+
+@dataclass
+class NetMHCIITable:
+    """
+    Canonical columnar form of a NetMHCIIpan wide table.
+
+    Row i of every array describes the peptide on table row i; column j of every
+    matrix describes alleles[j]. Matrix entries are NaN where the file has no
+    parseable value, and present[field][j] is False when allele j's block has no
+    such column at all.
+    """
+    alleles: List[str]
+    positions: np.ndarray  # int32, MISSING_POSITION where Pos is not an integer
+    peptides: Optional[pd.Series]  # None when the file has no Peptide column
+    ids: Optional[pd.Series]  # None when the file has no ID column
+    matrices: Dict[str, np.ndarray]  # field -> (rows x alleles) float matrix
+    present: Dict[str, np.ndarray]  # field -> bool per allele
+    core_codes: Optional[np.ndarray] = None  # (rows x alleles) int32, -1 where missing
+    core_categories: Optional[np.ndarray] = None
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.positions)
+
+    @property
+    def n_alleles(self) -> int:
+        return len(self.alleles)
+
+    def field(self, name: str) -> np.ndarray:
+        """Return the (rows x alleles) matrix of a numeric field."""
+        if name not in self.matrices:
+            raise KeyError(f"Field {name} was not loaded (loaded: {', '.join(self.matrices)})")
+        return self.matrices[name]
+
+    def to_npz(self, path: str) -> None:
+        """Write the table to .npz (strings stored as codes + categories)."""
+        arrays = {
+            '__alleles__': np.array(self.alleles, dtype=str),
+            '__fields__': np.array(list(self.matrices), dtype=str),
+            'positions': self.positions
+        }
+        for name, series in (('peptides', self.peptides), ('ids', self.ids)):
+            if series is not None:
+                codes, uniques = pd.factorize(series)
+                arrays[f'{name}_codes'] = codes.astype(np.int32)
+                arrays[f'{name}_categories'] = np.array([str(u) for u in uniques], dtype=str)
+        for name, matrix in self.matrices.items():
+            arrays[f'm_{name}'] = matrix
+            arrays[f'p_{name}'] = self.present[name]
+        if self.core_codes is not None:
+            arrays['core_codes'] = self.core_codes
+            arrays['core_categories'] = np.array([str(c) for c in self.core_categories], dtype=str)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def from_npz(cls, path: str) -> 'NetMHCIITable':
+        """Read a table written by to_npz."""
+        with np.load(path, allow_pickle=False) as data:
+            def strings(name):
+                if f'{name}_codes' not in data:
+                    return None
+                categorical = pd.Categorical.from_codes(
+                    data[f'{name}_codes'], data[f'{name}_categories'].astype(object)
+                )
+                return pd.Series(np.asarray(categorical.astype(object)), dtype=str)
+
+            fields = [str(f) for f in data['__fields__']]
+            has_cores = 'core_codes' in data
+            return cls(
+                alleles=[str(a) for a in data['__alleles__']],
+                positions=data['positions'],
+                peptides=strings('peptides'),
+                ids=strings('ids'),
+                matrices={f: data[f'm_{f}'] for f in fields},
+                present={f: data[f'p_{f}'] for f in fields},
+                core_codes=data['core_codes'] if has_cores else None,
+                core_categories=data['core_categories'].astype(object) if has_cores else None
+            )
+
+
+def _parse_positions(values: pd.Series) -> np.ndarray:
+    """Integer positions as int32, MISSING_POSITION where a cell is not an integer."""
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64')
+    valid = ~np.isnan(numeric) & (numeric == np.floor(numeric))
+    positions = np.full(len(numeric), MISSING_POSITION, dtype=np.int32)
+    positions[valid] = numeric[valid].astype(np.int32)
+    return positions
+
+
+def _build_table(data: pd.DataFrame, base_cols: Dict[str, int], blocks: List[Tuple[str, Dict[str, int]]],
+                 fields: Sequence[str], dtype, include_cores: bool) -> NetMHCIITable:
+    """Assemble a NetMHCIITable from data columns addressed by header column index."""
+    n = len(data)
+    k = len(blocks)
+    matrices = {}
+    present = {}
+    for name in fields:
+        matrix = np.full((n, k), np.nan, dtype=dtype)
+        mask = np.zeros(k, dtype=bool)
+        for j, (_, cols) in enumerate(blocks):
+            if name in cols:
+                matrix[:, j] = data[cols[name]].to_numpy(dtype=dtype, na_value=np.nan)
+                mask[j] = True
+        matrices[name] = matrix
+        present[name] = mask
+
+    core_codes = core_categories = None
+    if include_cores:
+        core_codes = np.full((n, k), -1, dtype=np.int32)
+        core_blocks = [(j, cols['Core']) for j, (_, cols) in enumerate(blocks) if 'Core' in cols]
+        if core_blocks and n:
+            codes, uniques = pd.factorize(pd.concat([data[c] for _, c in core_blocks], ignore_index=True))
+            codes = codes.astype(np.int32).reshape(len(core_blocks), n)
+            for row, (j, _) in enumerate(core_blocks):
+                core_codes[:, j] = codes[row]
+            core_categories = np.asarray(uniques, dtype=object)
+        else:
+            core_categories = np.array([], dtype=object)
+
+    return NetMHCIITable(
+        alleles=[label for label, _ in blocks],
+        positions=_parse_positions(data[base_cols['Pos']]) if 'Pos' in base_cols
+        else np.full(n, MISSING_POSITION, dtype=np.int32),
+        peptides=data[base_cols['Peptide']].astype(str).reset_index(drop=True) if 'Peptide' in base_cols else None,
+        ids=data[base_cols['ID']].astype(str).reset_index(drop=True) if 'ID' in base_cols else None,
+        matrices=matrices,
+        present=present,
+        core_codes=core_codes,
+        core_categories=core_categories
+    )
+
+
+def read_wide_table(source: Union[str, io.TextIOBase], dtype='float32',
+                    fields: Sequence[str] = NUMERIC_FIELDS, include_cores: bool = True) -> NetMHCIITable:
+    """
+    Parse a NetMHCIIpan wide table into a NetMHCIITable.
+
+    Text files (tab- or comma-separated, including NetMHCIIpan's text .xls) are read
+    with pandas' C parser, loading only the base, numeric and (optionally) Core
+    columns, numbers directly as dtype; real Excel files go through read_excel.
+
+    Args:
+        source: File path or text buffer
+        dtype: Float dtype of the field matrices (float32 keeps the table small,
+            float64 reproduces exact decimal input)
+        fields: Numeric fields to load
+        include_cores: Also load the Core column of each block
+    """
+    fields = [f for f in NUMERIC_FIELDS if f in fields]
+    dtype = np.dtype(dtype)
+
+    if isinstance(source, str) and is_excel_file(source):
+        raw = pd.read_excel(source, header=None, dtype=str)
+        if raw.shape[0] < 2:
+            raise ValueError("Malformed NetMHCIIpan table: expected an allele row and a field row")
+        base_cols, blocks = locate_columns(list(raw.iloc[0].fillna('')), list(raw.iloc[1].fillna('')))
+        data = raw.iloc[2:].reset_index(drop=True)
+        for _, cols in blocks:
+            for name in fields:
+                if name in cols:
+                    data[cols[name]] = pd.to_numeric(data[cols[name]], errors='coerce')
+        return _build_table(data, base_cols, blocks, fields, dtype, include_cores)
+
+    sep, header_alleles, header_fields = read_text_header(source)
+    base_cols, blocks = locate_columns(header_alleles, header_fields)
+    numeric_cols = {cols[name] for _, cols in blocks for name in fields if name in cols}
+    core_cols = {cols['Core'] for _, cols in blocks if 'Core' in cols} if include_cores else set()
+    text_cols = set(base_cols.values()) | core_cols
+    usecols = sorted(text_cols | numeric_cols)
+
+    dtypes = {i: str for i in text_cols}
+    dtypes.update({i: dtype for i in numeric_cols})
+    read_kwargs = dict(sep=sep, header=None, skiprows=2 if isinstance(source, str) else 0,
+                       usecols=usecols, encoding='utf-8', engine='c')
+    start = None if isinstance(source, str) else source.tell()
+    try:
+        data = pd.read_csv(source, dtype=dtypes, **read_kwargs)
+    except ValueError:
+        # A numeric column holds text: read everything as strings and coerce,
+        # unparseable cells become NaN
+        if start is not None:
+            source.seek(start)
+        data = pd.read_csv(source, dtype=str, **read_kwargs)
+        for i in numeric_cols:
+            data[i] = pd.to_numeric(data[i], errors='coerce')
+    return _build_table(data, base_cols, blocks, fields, dtype, include_cores)
+
+
+def load_netmhcii_table(source: Union[str, io.TextIOBase], dtype='float32',
+                        fields: Sequence[str] = NUMERIC_FIELDS, include_cores: bool = True,
+                        cache: Optional['ParsedTableCache'] = None) -> NetMHCIITable:
+    """
+    Load a wide table, through the on-disk cache when one is given.
+
+    Only complete tables (all fields and cores) of file inputs are cached, so a
+    cache entry written by one tool serves the other.
+    """
+    cacheable = (cache is not None and isinstance(source, str) and include_cores
+                 and set(fields) >= set(NUMERIC_FIELDS))
+    if not cacheable:
+        return read_wide_table(source, dtype, fields, include_cores)
+
+    key = cache.key_for(source, variant=np.dtype(dtype).name)
+    table = cache.load_table(key)
+    if table is not None:
+        cache.logger.info(f"Loaded parsed table from cache (key {key})")
+        return table
+    table = read_wide_table(source, dtype, fields, include_cores)
+    if table.n_rows:
+        cache.store_table(key, table)
+    return table
+
+
+def frame_to_npz(df: pd.DataFrame, path: str) -> None:
+    """Write a DataFrame to .npz; string columns are stored as codes + categories."""
+    arrays = {'__columns__': np.array([str(c) for c in df.columns])}
+    kinds = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            kind = 'category'
+        elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            kind = 'values'
+        else:
+            kind = 'text'
+
+        if kind == 'values':
+            arrays[f'c{i}'] = series.to_numpy()
+        else:
+            categorical = series if kind == 'category' else series.astype('category')
+            arrays[f'c{i}_codes'] = categorical.cat.codes.to_numpy()
+            arrays[f'c{i}_categories'] = np.array([str(c) for c in categorical.cat.categories])
+        kinds.append(kind)
+    arrays['__kinds__'] = np.array(kinds)
+    np.savez(path, **arrays)
+
+
+def frame_from_npz(path: str) -> pd.DataFrame:
+    """Read a DataFrame written by frame_to_npz."""
+    with np.load(path, allow_pickle=False) as data:
+        columns = {}
+        for i, (col, kind) in enumerate(zip(data['__columns__'], data['__kinds__'])):
+            if kind == 'values':
+                columns[str(col)] = data[f'c{i}']
+                continue
+            categorical = pd.Categorical.from_codes(data[f'c{i}_codes'], data[f'c{i}_categories'].astype(object))
+            if kind == 'category':
+                columns[str(col)] = categorical
+            else:
+                columns[str(col)] = np.asarray(categorical.astype(object))
+        return pd.DataFrame(columns)
+
+
+def resolve_output_format(output_format: str) -> str:
+    """Return the format actually written: parquet/feather fall back to npz without pyarrow."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}; expected one of {', '.join(OUTPUT_FORMATS)}")
+    if output_format in ('parquet', 'feather') and not HAS_PYARROW:
+        return 'npz'
+    return output_format
+
+
+def result_table_path(base_path: str, output_format: str = 'csv') -> str:
+    """Path written by write_result_table for base_path (base_path + format extension)."""
+    return f"{base_path}.{resolve_output_format(output_format)}"
+
+
+def write_result_table(df: pd.DataFrame, base_path: str, output_format: str = 'csv') -> str:
+    """
+    Write a result table without its index and return the path written.
+
+    csv and csv.gz are plain text; parquet and feather (pyarrow) and npz keep the
+    column dtypes, so numbers and categoricals read back without re-parsing.
+    """
+    output_format = resolve_output_format(output_format)
+    path = result_table_path(base_path, output_format)
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+    elif output_format == 'csv.gz':
+        df.to_csv(path, index=False, compression='gzip')
+    elif output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif output_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        frame_to_npz(df, path)
+    return path
+
+
+def read_result_table(path: str, nrows: Optional[int] = None) -> pd.DataFrame:
+    """Read a table written by write_result_table; the format follows the file extension."""
+    if path.endswith(('.csv', '.csv.gz')):
+        return pd.read_csv(path, nrows=nrows)
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    elif path.endswith('.feather'):
+        df = pd.read_feather(path)
+    elif path.endswith('.npz'):
+        df = frame_from_npz(path)
+    else:
+        raise ValueError(f"Unknown result table format: {path}")
+    return df if nrows is None else df.head(nrows)
+
+
+class ParsedTableCache:
+    """
+    Size-bounded on-disk cache of parsed NetMHCIIpan tables.
+
+    Entries are keyed by the SHA-256 of the input file content plus PARSER_VERSION, so
+    renamed or copied files still hit and parser changes invalidate old entries.
+    Canonical NetMHCIITables are stored as .table.npz; other parsed frames as Parquet
+    when pyarrow is available, otherwise as .npz. When the cache grows beyond
+    max_bytes the least recently used entries are removed.
+    """
+
+    PREFIX = "netmhcii_"
+
+    def __init__(self, cache_dir: str, max_bytes: int, logger: Optional[logging.Logger] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(input_file: str, variant: str = "") -> str:
+        """Return the cache key of an input file (variant distinguishes e.g. dtypes)."""
+        digest = hashlib.sha256()
+        with open(input_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        key = f"{digest.hexdigest()[:32]}_v{PARSER_VERSION}"
+        return f"{key}_{variant}" if variant else key
+
+    def _entry_paths(self, key: str) -> List[str]:
+        base = os.path.join(self.cache_dir, f"{self.PREFIX}{key}")
+        return [base + ".parquet", base + ".npz"]
+
+    def _table_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.PREFIX}{key}.table.npz")
+
+    def load(self, key: str) -> Optional[pd.DataFrame]:
+        """Return the cached frame for key, or None on a miss."""
+        for path in self._entry_paths(key):
+            if not os.path.exists(path):
+                continue
+            if path.endswith(".parquet") and not HAS_PYARROW:
+                continue
+            try:
+                df = pd.read_parquet(path) if path.endswith(".parquet") else frame_from_npz(path)
+            except Exception as e:
+                self.logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+                continue
+            # Touch the entry so the cleanup policy treats it as recently used
+            self._touch(path)
+            return df
+        return None
+
+    def load_table(self, key: str) -> Optional[NetMHCIITable]:
+        """Return the cached NetMHCIITable for key, or None on a miss."""
+        path = self._table_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = NetMHCIITable.from_npz(path)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+        self._touch(path)
+        return table
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        # Entries written by another user of a shared cache may not be ours to touch
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def store(self, key: str, df: pd.DataFrame) -> None:
+        """Store a frame under key, then enforce the size bound."""
+        path = self._entry_paths(key)[0 if HAS_PYARROW else 1]
+        if HAS_PYARROW:
+            self._write_entry(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+        else:
+            self._write_entry(path, lambda tmp_path: frame_to_npz(df, tmp_path))
+
+    def store_table(self, key: str, table: NetMHCIITable) -> None:
+        """Store a NetMHCIITable under key, then enforce the size bound."""
+        self._write_entry(self._table_path(key), table.to_npz)
+
+    def _write_entry(self, path: str, writer) -> None:
+        # Write to a temporary file and rename so concurrent batch jobs never read a
+        # partially written entry
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz" if path.endswith(".npz") else ".parquet", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            writer(tmp_path)
+            # mkstemp creates the file as 0600; use the umask-based default so a
+            # cache directory shared between users stays readable
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning(f"Failed to write cache entry {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.logger.info(f"Cached parsed table to {path}")
+        self.prune(keep=path)
+
+    def prune(self, keep: Optional[str] = None) -> None:
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith(self.PREFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                self.logger.info(f"Evicted cache entry {path}")
+            except OSError:
+                continue
@@ -1,126 +1,133 @@
 import pandas as pd
 import numpy as np
-import sys
 import os
+import glob
 import argparse
+import gzip
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# 输入文件路径（请确保路径存在）
-DEFAULT_CSV_PATH = r"f:\H盘备份\课题相关\VLPs从头设计-计算机辅助\deimmunology VLPs设计\Based on P03146\新框架\de novo design-proteinMPNN\HBcout\6htx_out-降原\两位点\seq a\seq-a .csv"
+from netmhcii_table import (
+    OUTPUT_FORMATS, NetMHCIITable, ParsedTableCache, is_excel_file, load_netmhcii_table, locate_columns,
+    normalize_allele, read_result_table, read_text_header, resolve_output_format, result_table_path,
+    write_result_table
+)
 
+# 批量模式下按目录展开时识别的输入文件后缀
+INPUT_SUFFIXES = ('.csv', '.tsv', '.txt', '.xls', '.xlsx')
+# 本脚本自身的输出文件后缀，展开目录时跳过
+OUTPUT_SUFFIXES = ('_wy2_scores.csv', '_wy2_seqsum.csv')
 
-def normalize_allele(allele_label: str) -> str:
-    """将 DRB1_0101 转换为 DRB1*01:01"""
-    try:
-        code = allele_label.split('_')[1]
-        return f"DRB1*{code[:2]}:{code[2:]}"
-    except Exception:
-        return allele_label
+# out-of-core 模式每块读取/写出的行数
+DEFAULT_CHUNKSIZE = 200000
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Compute wy2-aligned immunogenicity scores (per-row + seqsum).')
-    parser.add_argument('input', nargs='?', default=DEFAULT_CSV_PATH, help='Input CSV/XLS/XLSX path')
-    parser.add_argument('mode', nargs='?', default='reduce', choices=['reduce', 'enhance'], help='Mode: reduce or enhance')
-    parser.add_argument('--outdir', default=os.path.join('web_service', 'results'), help='Output directory for results')
-    args = parser.parse_args() if len(sys.argv) > 1 else argparse.Namespace(input=DEFAULT_CSV_PATH, mode='reduce', outdir=os.path.join('web_service','results'))
+def _read_text_header(path: str):
+    """读取文本表格的两行表头，返回 (分隔符, 基础列, [(标准化等位基因名, nM 列号), ...])"""
+    sep, header_alleles, header_fields = read_text_header(path)
+    base_cols, blocks = locate_columns(header_alleles, header_fields)
+    nm_cols = [(normalize_allele(label), cols['nM']) for label, cols in blocks if 'nM' in cols]
+    return sep, base_cols, nm_cols
 
-    csv_path = args.input
-    mode = args.mode
-    outdir = args.outdir
 
-    # 读取原始两行表头 + 数据（支持csv/txt/xls/xlsx）
-    ext = os.path.splitext(csv_path)[1].lower()
-    if ext in ('.xlsx', '.xls'):
-        try:
-            raw = pd.read_excel(csv_path, header=None, dtype=str)
-        except Exception:
-            # 退回为以制表符读取
-            raw = pd.read_csv(csv_path, header=None, dtype=str, sep='\t', engine='python')
-    else:
-        raw = pd.read_csv(csv_path, header=None, dtype=str, encoding='utf-8', engine='python')
-    if raw.shape[0] < 2:
-        raise ValueError("文件格式异常：需要至少两行表头（allele 行 + 字段行）")
+def _text_read_options(sep: str, base_cols, nm_cols):
+    """按列号只读取基础列与 nM 列的 read_csv 参数：(dtype 映射, 其余参数)"""
+    usecols = sorted(set(base_cols.values()) | {i for _, i in nm_cols})
+    dtypes = {i: str for i in base_cols.values()}
+    dtypes.update({i: 'float64' for _, i in nm_cols})
+    read_kwargs = dict(sep=sep, header=None, skiprows=2, usecols=usecols, encoding='utf-8', engine='c')
+    return dtypes, read_kwargs
 
-    header_alleles = list(raw.iloc[0].fillna(''))
-    header_fields = list(raw.iloc[1].fillna(''))
 
-    data = raw.iloc[2:].reset_index(drop=True)
-    data.columns = pd.MultiIndex.from_arrays([header_alleles, header_fields])
+def ic50_frames_from_table(table: NetMHCIITable):
+    """
+    由共享的 NetMHCIITable（见 netmhcii_table.py）取出打分所需的两张表。
 
-    # 基础列：仅限第一个等位基因块之前的空 allele 列，以及尾部 Ave/NB
-    try:
-        first_allele_idx = next(i for i, a in enumerate(header_alleles) if a and a.startswith('DRB1_'))
-    except StopIteration:
-        first_allele_idx = len(header_alleles)
-
-    base_map = {'Pos': 'Pos', 'Peptide': 'Peptide', 'ID': 'ID', 'Target': 'Target', 'Ave': 'Ave', 'NB': 'NB'}
-    base_df = pd.DataFrame()
-
-    # 前缀基础列（如 Pos, Peptide, ID, Target）
-    for i in range(first_allele_idx):
-        a, f = header_alleles[i], header_fields[i]
-        col = (a, f)
-        if a == '' and col in data.columns and f in base_map:
-            base_df[base_map[f]] = data[col].astype(str)
-
-    # 尾部 Ave/NB（如果存在）
-    for i in range(len(header_fields)):
-        a, f = header_alleles[i], header_fields[i]
-        if a == '' and f in ('Ave', 'NB'):
-            col = (a, f)
-            if col in data.columns:
-                base_df[base_map[f]] = data[col].astype(str)
-
-    # 收集等位基因 nM(IC50)
-    # 逐列扫描，携带最近一次出现的等位基因标签，将其赋予后续字段
-    ic50_cols = {}
-    current_allele = None
-    for i in range(len(header_fields)):
-        a_raw = header_alleles[i]
-        f_raw = header_fields[i]
-        if a_raw and a_raw.startswith('DRB1_'):
-            current_allele = normalize_allele(a_raw)
-        if f_raw == 'nM' and current_allele is not None:
-            col = (header_alleles[i], header_fields[i])
-            # 实际数据在该列（即使 allele 头为空，因为我们用 current_allele 记忆）
-            # 通过单层位置选取，避免 MultiIndex 匹配失败
-            series = data.iloc[:, i].astype(str)
-            ic50_cols[current_allele] = series
-
-    ic50_df = pd.DataFrame(ic50_cols)
-    ic50_df = ic50_df.apply(pd.to_numeric, errors='coerce')
-
-    total_rows = len(data)
-    # 优先从原始 data 中取 ('', 'Peptide')，否则用 base_df 或占位符
-    if ('', 'Peptide') in data.columns:
-        peptides_series = data.loc[:, ('', 'Peptide')]
-        if isinstance(peptides_series, pd.DataFrame):
-            peptides_series = peptides_series.iloc[:, 0]
-        peptides_series = peptides_series.astype(str)
-    elif 'Peptide' in base_df.columns:
+    Returns:
+        (base_df, ic50_df)：base_df 含 Peptide/ID（字符串，文件中存在时），
+        ic50_df 每个等位基因一列 nM 值，列名为标准化等位基因名（同名时保留最后一列）
+    """
+    base_df = pd.DataFrame({
+        name: series for name, series in (('Peptide', table.peptides), ('ID', table.ids)) if series is not None
+    })
+    # 缓存表为 float32：转为 float64 后再取最小值与四舍五入，Best_IC50 仍保留两位小数
+    nm = table.field('nM').astype(np.float64, copy=False)
+    present = table.present['nM']
+    ic50_df = pd.DataFrame({
+        normalize_allele(allele): nm[:, j] for j, allele in enumerate(table.alleles) if present[j]
+    })
+    return base_df, ic50_df
+
+
+def read_two_header_table(path: str, cache: ParsedTableCache = None):
+    """
+    读取 NetMHCIIpan 两行表头表格（allele 行 + 字段行），解析由共享模块 netmhcii_table 完成。
+
+    默认只加载 Peptide/ID 与各 nM 列，nM 按 float64 读取以保证结果逐位一致；
+    给定 cache 时改用与 epitope_analyzer.py 共享的完整 float32 缓存表（同一文件只解析一次）。
+
+    Returns:
+        (base_df, ic50_df)，见 ic50_frames_from_table
+    """
+    if cache is not None:
+        return ic50_frames_from_table(load_netmhcii_table(path, cache=cache))
+    return ic50_frames_from_table(load_netmhcii_table(path, dtype='float64', fields=('nM',), include_cores=False))
+
+
+def score_ic50_matrix(ic50_df: pd.DataFrame) -> np.ndarray:
+    """
+    对 IC50 矩阵一次性做按列（等位基因）排名与 0–100 线性缩放，与 wy2-score sum.py 对齐。
+
+    排名采用 average 处理并列；某列全部相同或全为缺失时得分为 50，缺失值同样填 50。
+    返回形状为 (等位基因数, 肽段数) 的 C 连续 float64 矩阵：按行顺序累加即等价于
+    旧的逐列 DataFrame 求和，保证 Overall_Score_Sum 结果逐位一致。
+    """
+    ranks = ic50_df.rank(method='average')
+    min_rank = ranks.min().to_numpy(dtype='float64')
+    span = ranks.max().to_numpy(dtype='float64') - min_rank
+    span[span == 0] = np.nan
+    # rank-norm: 0..100，rank小→分数小
+    scores = np.array(ranks.to_numpy(dtype='float64').T, order='C')
+    scores -= min_rank[:, None]
+    scores /= span[:, None]
+    scores *= 100.0
+    scores[np.isnan(scores)] = 50.0
+    return scores
+
+
+def overall_score_sum_from_scores(scores: np.ndarray, mode: str) -> np.ndarray:
+    """
+    由 score_ic50_matrix 的得分矩阵计算每条肽段的 Overall_Score_Sum（跨等位基因求和）。
+
+    reduce（降原）：弱结合好（分大好），统一最小化 → 取 100 - 得分后求和；
+    enhance（升原）：强结合好（分小好），直接求和并最小化。
+    """
+    if mode == 'reduce':
+        return (100.0 - scores).sum(axis=0)
+    return scores.sum(axis=0)
+
+
+def score_table(base_df: pd.DataFrame, ic50_df: pd.DataFrame, mode: str = 'reduce',
+                overall_score_sum: np.ndarray = None) -> pd.DataFrame:
+    """
+    由 read_two_header_table 的结果计算每条肽段的 wy2 得分。
+    已由 score_ic50_matrix/overall_score_sum_from_scores 算好的总分可通过 overall_score_sum 传入，避免重复打分。
+
+    Returns:
+        列为 Peptide/ID/Allele_Count/Best_IC50(nM)/Overall_Score_Sum 的 DataFrame，
+        按 Overall_Score_Sum 排序（reduce 升序、enhance 降序）
+    """
+    total_rows = len(ic50_df) if ic50_df.shape[1] else len(base_df)
+    if 'Peptide' in base_df.columns:
         peptides_series = base_df['Peptide'].astype(str)
     else:
         peptides_series = pd.Series([f"pep_{i}" for i in range(total_rows)], dtype=str)
     peptides = peptides_series.reset_index(drop=True)
 
     # 与 wy2-score sum.py 对齐：按等位基因做排名 → 线性缩放得分（Rank 越小得分越高）
-    score_df = pd.DataFrame(index=ic50_df.index)
-    for allele in ic50_df.columns:
-        ranks = ic50_df[allele].rank(method='average')
-        min_rank = ranks.min()
-        max_rank = ranks.max()
-        denom = (max_rank - min_rank) if (max_rank - min_rank) != 0 else np.nan
-        # rank-norm: 0..100，rank小→分数小
-        score = ((ranks - min_rank) / denom) * 100.0
-        score_df[f'Score_{allele}'] = score.fillna(50.0)
-
-    # Overall Score（sum across alleles）
-    if mode == 'reduce':
-        # 降原：弱结合好（分大好），统一最小化 → 取反
-        overall_score_sum = (100.0 - score_df).sum(axis=1, skipna=True)
-    else:
-        # 升原：强结合好（分小好），直接求和并最小化
-        overall_score_sum = score_df.sum(axis=1, skipna=True)
+    if overall_score_sum is None:
+        overall_score_sum = overall_score_sum_from_scores(score_ic50_matrix(ic50_df), mode)
+    overall_score_sum = pd.Series(overall_score_sum, index=ic50_df.index)
 
     # 统一长度
     n = ic50_df.shape[0]
@@ -140,20 +147,457 @@ def main():
         'Best_IC50(nM)': best_ic50_vals,
         'Overall_Score_Sum': overall_vals,
     })
-    out = out.sort_values('Overall_Score_Sum', ascending=(mode=='reduce')).reset_index(drop=True)
+    return out.sort_values('Overall_Score_Sum', ascending=(mode == 'reduce')).reset_index(drop=True)
+
+
+def aggregate_seqsum(scores_df: pd.DataFrame) -> pd.DataFrame:
+    """按序列 ID 汇总 Overall_Score_Sum（越小越好，升序排列）"""
+    seq_sum = scores_df.reset_index().groupby('ID', dropna=False)['Overall_Score_Sum'].sum().reset_index()
+    return seq_sum.sort_values('Overall_Score_Sum', ascending=True)
+
+
+def top_k_seqsum(ids, overall_score_sum: np.ndarray, k: int = None) -> pd.DataFrame:
+    """
+    按序列 ID 汇总 Overall_Score_Sum 并只返回总分最小的前 k 个（k 为 None 时返回全部）。
+
+    ID 先编码为整数再用 np.bincount 求和，前 k 个用 argpartition 选出，
+    无需构建肽段级 DataFrame，也不做字符串分组。overall_score_sum 应为已四舍五入到
+    3 位小数的逐肽段总分；序列总分同样保留 3 位小数，并列时按 ID 首次出现的顺序排列。
+    """
+    codes, uniques = pd.factorize(pd.Series(ids), use_na_sentinel=False)
+    sums = np.bincount(codes, weights=overall_score_sum, minlength=len(uniques)).round(3)
+    if k is not None and k < len(sums):
+        top = np.argpartition(sums, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.intp)
+    else:
+        top = np.arange(len(sums))
+    top = top[np.lexsort((top, sums[top]))]
+    return pd.DataFrame({'ID': np.asarray(uniques, dtype=object)[top], 'Overall_Score_Sum': sums[top]})
+
+
+def score_file_top_k(path: str, mode: str = 'reduce', k: int = None, with_peptides: bool = False,
+                     cache: ParsedTableCache = None):
+    """
+    只做序列级汇总的快速打分：读取 → 打分 → 按 ID 整数编码汇总 → 前 k 个序列。
+
+    Returns:
+        (top_df, scores_df, 肽段数, 等位基因数)；with_peptides 为 False 时 scores_df 为 None
+    """
+    base_df, ic50_df = read_two_header_table(path, cache)
+    overall = overall_score_sum_from_scores(score_ic50_matrix(ic50_df), mode).round(3)
+    n = len(overall)
+    ids = base_df['ID'] if 'ID' in base_df.columns else np.full(n, None, dtype=object)
+    top_df = top_k_seqsum(ids, overall, k)
+    scores_df = score_table(base_df, ic50_df, mode, overall) if with_peptides else None
+    return top_df, scores_df, n, ic50_df.shape[1]
+
+
+def score_netmhcii_table(table: NetMHCIITable, mode: str = 'reduce'):
+    """
+    对已解析的共享 NetMHCIITable 打分（例如与 epitope_analyzer 共用同一次解析）。
+
+    Returns:
+        (scores_df, seqsum_df)
+    """
+    scores_df = score_table(*ic50_frames_from_table(table), mode)
+    return scores_df, aggregate_seqsum(scores_df)
+
+
+def score_file(path: str, mode: str = 'reduce', cache: ParsedTableCache = None):
+    """
+    读取 → 提取 IC50 矩阵 → 打分 → 序列汇总，一步完成单个文件。
+
+    Returns:
+        (scores_df, seqsum_df, 等位基因数)
+    """
+    base_df, ic50_df = read_two_header_table(path, cache)
+    scores_df = score_table(base_df, ic50_df, mode)
+    return scores_df, aggregate_seqsum(scores_df), ic50_df.shape[1]
+
+
+def save_results(scores_df: pd.DataFrame, seqsum_df: pd.DataFrame, outdir: str, base: str, mode: str,
+                 top_k: int = None, output_format: str = 'csv'):
+    """
+    写出 {base}_{mode}_wy2_scores.csv 与 {base}_{mode}_wy2_seqsum.csv，返回两个路径。
+    scores_df 为 None 时不写肽段级文件（路径返回 None）；给定 top_k 时序列文件名为 {base}_{mode}_top{k}_wy2_seqsum.csv。
+    output_format 取 OUTPUT_FORMATS 之一（见 netmhcii_table.py），决定文件扩展名与写出格式。
+    """
+    os.makedirs(outdir, exist_ok=True)
+    out_path = None
+    if scores_df is not None:
+        out_path = write_result_table(
+            scores_df.reset_index(), os.path.join(outdir, f"{base}_{mode}_wy2_scores"), output_format)
+    tag = f"{mode}_top{top_k}" if top_k is not None else mode
+    seq_path = write_result_table(seqsum_df, os.path.join(outdir, f"{base}_{tag}_wy2_seqsum"), output_format)
+    return out_path, seq_path
+
+
+def _count_data_rows(path: str) -> int:
+    """两行表头之后的行数上限（空行也计入，实际行数以读取结果为准）"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 2, 0)
+
+
+def _average_ranks(values: np.ndarray) -> np.ndarray:
+    """单列 average 排名，等同 Series.rank(method='average')；缺失值保持 NaN"""
+    ranks = np.full(len(values), np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) == 0:
+        return ranks
+    order = valid[np.argsort(values[valid])]
+    sorted_vals = values[order]
+    starts = np.flatnonzero(np.r_[True, sorted_vals[1:] != sorted_vals[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    # 并列组 [s, e) 的名次为 s+1..e，平均为 (s + 1 + e) / 2
+    ranks[order] = np.repeat((starts + 1 + ends) / 2.0, ends - starts)
+    return ranks
+
+
+def _spill_ic50_columns(path: str, sep: str, base_cols, alleles, chunksize: int, matrix: np.memmap, numeric: bool):
+    """
+    第一遍：分块读取表格，将各等位基因 nM 写入 memmap（每个等位基因一行），
+    同时收集基础列与逐行统计（Allele_Count、Best_IC50），内存只随单块大小增长。
+    """
+    dtypes, read_kwargs = _text_read_options(sep, base_cols, list(alleles.items()))
+    pieces = {f: [] for f in base_cols}
+    counts, best = [], []
+    n = 0
+    with pd.read_csv(path, dtype=dtypes if numeric else str, chunksize=chunksize, **read_kwargs) as reader:
+        for data in reader:
+            rows = len(data)
+            if numeric:
+                nm = pd.DataFrame({a: data[i] for a, i in alleles.items()})
+            else:
+                nm = pd.DataFrame({a: pd.to_numeric(data[i], errors='coerce') for a, i in alleles.items()})
+            matrix[:, n:n + rows] = nm.to_numpy(dtype='float32').T
+            counts.append(nm.notna().sum(axis=1).to_numpy())
+            best.append(nm.min(axis=1, skipna=True).round(2).to_numpy())
+            for f, i in base_cols.items():
+                pieces[f].append(data[i].astype(str))
+            n += rows
+
+    base_df = pd.DataFrame({f: pd.concat(parts, ignore_index=True) for f, parts in pieces.items() if parts})
+    allele_count = np.concatenate(counts) if counts else np.zeros(0, dtype=int)
+    best_ic50 = np.concatenate(best) if best else np.zeros(0)
+    return base_df, allele_count, best_ic50
+
+
+def score_file_out_of_core(path: str, mode: str = 'reduce', outdir: str = os.path.join('web_service', 'results'),
+                           base: str = None, chunksize: int = DEFAULT_CHUNKSIZE, tmpdir: str = None,
+                           write_scores: bool = True, output_format: str = 'csv'):
+    """
+    out-of-core 打分：IC50 矩阵不进内存，结果与 score_file + save_results 完全一致。
+
+    第一遍分块读取 nM 列并写入临时 float32 memmap；随后逐个等位基因从 memmap 取出一列，
+    用 argsort 计算 average 排名并累加 Overall_Score_Sum；第二遍按排序结果分块写出得分表。
+    常驻内存只有每条肽段的向量（肽段、ID、计数、总分），与等位基因数无关。
+    write_scores 为 False 时跳过第二遍，只写序列汇总。
+    csv/csv.gz 得分表分块流式写出；parquet/feather/npz 需整表写出，按排序结果组装一次（仍只含每条肽段的向量）。
+    float32 对 NetMHCIIpan 输出的 nM（两位小数、< 131072）不会合并或颠倒任何取值，排名不变。
+
+    Returns:
+        (seqsum_df, 肽段数, 等位基因数)
+    """
+    if base is None:
+        base = os.path.splitext(os.path.basename(path))[0]
+    os.makedirs(outdir, exist_ok=True)
+
+    n_est = 0 if is_excel_file(path) else _count_data_rows(path)
+    alleles = dict(_read_text_header(path)[2]) if n_est else {}
+    if not alleles:
+        # Excel 无法分块读取；空表无需 memmap，直接走内存模式
+        scores_df, seqsum_df, n_alleles = score_file(path, mode)
+        save_results(scores_df if write_scores else None, seqsum_df, outdir, base, mode, output_format=output_format)
+        return seqsum_df, len(scores_df), n_alleles
+    sep, base_cols, _ = _read_text_header(path)
+
+    fd, mmap_path = tempfile.mkstemp(prefix='ic50_', suffix='.f32', dir=tmpdir)
+    os.close(fd)
+    try:
+        matrix = np.memmap(mmap_path, dtype='float32', mode='w+', shape=(len(alleles), n_est))
+        try:
+            base_df, allele_count, best_ic50 = _spill_ic50_columns(
+                path, sep, base_cols, alleles, chunksize, matrix, numeric=True)
+        except ValueError:
+            # nM 列含非数值文本时退回字符串读取后逐列转换，与 read_two_header_table 一致
+            base_df, allele_count, best_ic50 = _spill_ic50_columns(
+                path, sep, base_cols, alleles, chunksize, matrix, numeric=False)
+        n = len(allele_count)
+
+        # 按等位基因顺序逐列累加，与内存模式 (等位基因, 肽段) 矩阵按行求和的顺序相同
+        overall = np.zeros(n)
+        for j in range(len(alleles)):
+            ranks = _average_ranks(np.asarray(matrix[j, :n], dtype='float64'))
+            valid = ranks[~np.isnan(ranks)]
+            min_rank = valid.min() if valid.size else np.nan
+            span = (valid.max() - min_rank) if valid.size else np.nan
+            score = ranks - min_rank
+            score /= span if span != 0 else np.nan
+            score *= 100.0
+            score[np.isnan(score)] = 50.0
+            if mode == 'reduce':
+                overall += 100.0 - score
+            else:
+                overall += score
+        del matrix
+    finally:
+        os.remove(mmap_path)
+
+    overall = overall.round(3)
+    order = pd.DataFrame({'Overall_Score_Sum': overall}).sort_values(
+        'Overall_Score_Sum', ascending=(mode == 'reduce')).index.to_numpy()
+    if 'Peptide' in base_df.columns:
+        peptides = base_df['Peptide'].to_numpy()
+    else:
+        peptides = np.array([f"pep_{i}" for i in range(n)], dtype=object)
+    ids = base_df['ID'].to_numpy() if 'ID' in base_df.columns else np.full(n, None, dtype=object)
+
+    def scores_chunk(start, stop):
+        idx = order[start:stop]
+        return pd.DataFrame({
+            'index': np.arange(start, start + len(idx)),
+            'Peptide': peptides[idx],
+            'ID': ids[idx],
+            'Allele_Count': allele_count[idx].astype(int),
+            'Best_IC50(nM)': best_ic50[idx],
+            'Overall_Score_Sum': overall[idx],
+        })
+
+    # 第二遍：按排序结果分块写出得分表
+    output_format = resolve_output_format(output_format)
+    scores_base = os.path.join(outdir, f"{base}_{mode}_wy2_scores")
+    if write_scores and output_format in ('csv', 'csv.gz'):
+        out_path = result_table_path(scores_base, output_format)
+        opener = gzip.open if output_format == 'csv.gz' else open
+        with opener(out_path, 'wt', encoding='utf-8', newline='') as f:
+            for start in range(0, max(n, 1), chunksize):
+                scores_chunk(start, start + chunksize).to_csv(f, index=False, header=(start == 0))
+    elif write_scores:
+        write_result_table(scores_chunk(0, n), scores_base, output_format)
+
+    seqsum_df = aggregate_seqsum(pd.DataFrame({'ID': ids[order], 'Overall_Score_Sum': overall[order]}))
+    write_result_table(seqsum_df, os.path.join(outdir, f"{base}_{mode}_wy2_seqsum"), output_format)
+    return seqsum_df, n, len(alleles)
+
+
+def expand_inputs(patterns):
+    """将文件、目录与通配符展开为输入文件列表（去重，保持给定顺序；目录内按文件名排序）"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+                if name.lower().endswith(INPUT_SUFFIXES) and not name.endswith(OUTPUT_SUFFIXES)
+            )
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _output_bases(paths):
+    """各输入文件的输出前缀；文件名重复时加上所在目录名以免互相覆盖"""
+    bases = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    duplicated = {b for b in bases if bases.count(b) > 1}
+    return [
+        f"{os.path.basename(os.path.dirname(os.path.abspath(p)))}_{b}" if b in duplicated else b
+        for p, b in zip(paths, bases)
+    ]
+
+
+def _score_file_job(path: str, base: str, mode: str, outdir: str, options: dict):
+    """
+    批量模式的单文件任务（在子进程中运行）。options 可含 chunksize/tmpdir（out-of-core 模式）、
+    top_k（只汇总前 k 个序列）、write_peptides（是否写肽段级文件）、cache_dir/cache_max_mb（解析缓存）
+    与 output_format（输出格式）。
+    """
+    chunksize = options.get('chunksize')
+    top_k = options.get('top_k')
+    write_peptides = options.get('write_peptides', True)
+    output_format = options.get('output_format', 'csv')
+    cache = None
+    if options.get('cache_dir'):
+        cache = ParsedTableCache(options['cache_dir'], int(options.get('cache_max_mb', 1024.0) * 1024 * 1024))
+    try:
+        if chunksize:
+            seqsum_df, n_peptides, n_alleles = score_file_out_of_core(
+                path, mode, outdir, base, chunksize, options.get('tmpdir'), write_peptides, output_format)
+        elif top_k is not None or not write_peptides:
+            seqsum_df, scores_df, n_peptides, n_alleles = score_file_top_k(path, mode, top_k, write_peptides, cache)
+            save_results(scores_df, seqsum_df, outdir, base, mode, top_k, output_format)
+        else:
+            scores_df, seqsum_df, n_alleles = score_file(path, mode, cache)
+            save_results(scores_df if write_peptides else None, seqsum_df, outdir, base, mode,
+                         output_format=output_format)
+            n_peptides = len(scores_df)
+        return {'path': path, 'seqsum': seqsum_df, 'peptides': n_peptides, 'alleles': n_alleles, 'error': None}
+    except Exception as e:
+        return {'path': path, 'seqsum': None, 'peptides': 0, 'alleles': 0, 'error': str(e)}
+
+
+def run_batch(paths, mode: str = 'reduce', outdir: str = os.path.join('web_service', 'results'), jobs: int = 1,
+              chunksize: int = None, tmpdir: str = None, top_k: int = None, write_peptides: bool = True,
+              cache_dir: str = None, cache_max_mb: float = 1024.0, output_format: str = 'csv') -> pd.DataFrame:
+    """
+    批量打分：每个文件写出各自的 scores/seqsum，另写一张合并的 batch_{mode}_wy2_seqsum.csv
+    （Source 列为输入文件路径，按 Overall_Score_Sum 升序；扩展名随 output_format）。给定 chunksize 时每个文件走 out-of-core 模式；
+    给定 top_k 时每个文件只保留前 k 个序列，合并表也只保留全部文件中的前 k 个。
+
+    Returns:
+        合并后的 seqsum DataFrame
+    """
+    bases = _output_bases(paths)
+    options = {'chunksize': chunksize, 'tmpdir': tmpdir, 'top_k': top_k, 'write_peptides': write_peptides,
+               'cache_dir': cache_dir, 'cache_max_mb': cache_max_mb, 'output_format': output_format}
+    results = {}
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_score_file_job, p, b, mode, outdir, options) for p, b in zip(paths, bases)]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['path']] = result
+                _report_batch_result(result, len(results), len(paths))
+    else:
+        for p, b in zip(paths, bases):
+            result = _score_file_job(p, b, mode, outdir, options)
+            results[p] = result
+            _report_batch_result(result, len(results), len(paths))
+
+    # 合并时按输入顺序拼接，保证结果与进程完成顺序无关
+    frames = [
+        results[p]['seqsum'].assign(Source=p)[['Source', 'ID', 'Overall_Score_Sum']]
+        for p in paths if results[p]['error'] is None
+    ]
+    if frames:
+        combined = pd.concat(frames, ignore_index=True)
+    else:
+        combined = pd.DataFrame(columns=['Source', 'ID', 'Overall_Score_Sum'])
+    combined = combined.sort_values('Overall_Score_Sum', ascending=True, kind='stable').reset_index(drop=True)
+    if top_k is not None:
+        combined = combined.head(top_k)
+
+    os.makedirs(outdir, exist_ok=True)
+    tag = f"{mode}_top{top_k}" if top_k is not None else mode
+    combined_path = write_result_table(combined, os.path.join(outdir, f"batch_{tag}_wy2_seqsum"), output_format)
+
+    failed = [r for r in results.values() if r['error'] is not None]
+    print(f"\n完成 {len(paths) - len(failed)}/{len(paths)} 个文件，合并结果: {combined_path}")
+    for r in failed:
+        print(f"  失败: {r['path']}: {r['error']}")
+    return combined
+
+
+def _report_batch_result(result, done: int, total: int):
+    if result['error'] is None:
+        print(f"[{done}/{total}] {result['path']}: {result['peptides']} 条肽段, {result['alleles']} 个等位基因")
+    else:
+        print(f"[{done}/{total}] {result['path']}: 失败 ({result['error']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute wy2-aligned immunogenicity scores (per-row + seqsum).')
+    parser.add_argument('input', nargs='?', default=None, help='Input CSV/XLS/XLSX path')
+    parser.add_argument('mode', nargs='?', default='reduce', choices=['reduce', 'enhance'], help='Mode: reduce or enhance')
+    parser.add_argument('--outdir', default=os.path.join('web_service', 'results'), help='Output directory for results')
+    parser.add_argument('--batch', nargs='+', metavar='PATH',
+                        help='Score many inputs (files, directories or glob patterns) and write a combined seqsum table')
+    parser.add_argument('--jobs', type=int, default=1, help='Worker processes for --batch (default: 1)')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='Spill the IC50 matrix to a temporary memory-mapped file instead of holding it in RAM')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help=f'Rows per chunk in --out-of-core mode (default: {DEFAULT_CHUNKSIZE})')
+    parser.add_argument('--tmpdir', default=None,
+                        help='Directory for the --out-of-core memory-mapped file (default: system temp dir)')
+    parser.add_argument('--top-k', type=int, default=None, metavar='K',
+                        help='Only aggregate per sequence ID and keep the K best designs (integer-coded bincount)')
+    parser.add_argument('--no-peptide-output', action='store_true',
+                        help='Do not write the per-peptide <name>_<mode>_wy2_scores.csv file')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Parsed-table cache shared with epitope_analyzer.py (float32 nM; see README)')
+    parser.add_argument('--cache-max-mb', type=float, default=1024.0,
+                        help='Size bound of the parsed-table cache in MB (default: 1024)')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv',
+                        help='Result file format: csv, csv.gz, or typed parquet/feather/npz '
+                             '(parquet/feather need pyarrow, otherwise npz is written) (default: csv)')
+    args = parser.parse_args()
+    output_format = args.output_format
+    chunksize = max(1, args.chunksize) if args.out_of_core else None
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.top_k is not None and chunksize:
+        parser.error("--top-k cannot be combined with --out-of-core")
+    write_peptides = not args.no_peptide_output
+
+    if args.batch:
+        # 批量模式下 input 位置参数可省略，此时第一个位置参数也可能是 mode
+        mode = args.mode
+        if args.input in ('reduce', 'enhance'):
+            mode = args.input
+        elif args.input is not None:
+            parser.error("with --batch, give inputs to --batch and only the mode positionally")
+        paths = expand_inputs(args.batch)
+        if not paths:
+            parser.error("--batch matched no input files")
+        run_batch(paths, mode, args.outdir, max(1, args.jobs), chunksize, args.tmpdir, args.top_k, write_peptides,
+                  args.cache_dir, args.cache_max_mb, output_format)
+        return
+
+    if args.input is None:
+        parser.error("an input file is required (or use --batch)")
+
+    csv_path = args.input
+    mode = args.mode
+    outdir = args.outdir
+
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    cache = ParsedTableCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024)) if args.cache_dir else None
+    if chunksize:
+        # out-of-core：IC50 矩阵经 memmap 落盘，结果直接分块写出
+        seqsum_df, n_peptides, n_alleles = score_file_out_of_core(
+            csv_path, mode, outdir, base, chunksize, args.tmpdir, write_peptides, output_format)
+        print(f"Saved: {result_table_path(os.path.join(outdir, f'{base}_{mode}_wy2_seqsum'), output_format)}")
+        if write_peptides:
+            print("前10个（与 wy2 规则一致，Overall Score 越小越好）：")
+            scores_path = result_table_path(os.path.join(outdir, f"{base}_{mode}_wy2_scores"), output_format)
+            print(read_result_table(scores_path, nrows=10).set_index('index').to_string())
+        else:
+            print("序列总分前10个（越小越好）：")
+            print(seqsum_df.head(10).to_string(index=False))
+        print("\n统计：")
+        print(f"总肽段数: {n_peptides}")
+        print(f"等位基因列数: {n_alleles}")
+        return
+
+    if args.top_k is not None or not write_peptides:
+        # 只关心序列级结果：整数编码 + bincount 汇总，肽段级文件可选
+        top_df, out, n_peptides, n_alleles = score_file_top_k(csv_path, mode, args.top_k, write_peptides, cache)
+        _, seq_path = save_results(out, top_df, outdir, base, mode, args.top_k, output_format)
+        print(f"Saved: {seq_path}")
+        print("序列总分前10个（越小越好）：")
+        print(top_df.head(10).to_string(index=False))
+        print("\n统计：")
+        print(f"总肽段数: {n_peptides}")
+        print(f"等位基因列数: {n_alleles}")
+        print(f"序列数: {len(top_df) if args.top_k is None else f'前 {len(top_df)} 个'}")
+        return
+
+    # 读取两行表头 + 数据（支持csv/txt/xls/xlsx），只加载需要的列
+    base_df, ic50_df = read_two_header_table(csv_path, cache)
+    out = score_table(base_df, ic50_df, mode)
 
     # 保存结果
     try:
-        os.makedirs(outdir, exist_ok=True)
-        base = os.path.splitext(os.path.basename(csv_path))[0]
-        out_path = os.path.join(outdir, f"{base}_{mode}_wy2_scores.csv")
-        out.reset_index().to_csv(out_path, index=False)
-        # Sequence-level aggregation if ID present
-        if 'ID' in out.columns:
-            seq_sum = out.reset_index().groupby('ID', dropna=False)['Overall_Score_Sum'].sum().reset_index()
-            seq_sum = seq_sum.sort_values('Overall_Score_Sum', ascending=True)
-            seq_path = os.path.join(outdir, f"{base}_{mode}_wy2_seqsum.csv")
-            seq_sum.to_csv(seq_path, index=False)
+        out_path, _ = save_results(out, aggregate_seqsum(out), outdir, base, mode, output_format=output_format)
         print(f"Saved: {out_path}")
     except Exception as e:
         print(f"Save failed: {e}")
@@ -172,5 +616,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-